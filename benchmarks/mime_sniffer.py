@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2016 Wikimedia Foundation
+
+# Micro-benchmark of MIME type detection
+#
+# Compares the signature index of MimeSniffer to the chain of closures that
+# add_format used to wrap around Thumbor's get_mimetype, one per format in
+# the order engines are imported, on the first bytes of every original of
+# the test suite. Formats both detect differently are listed.
+#
+# Usage: python benchmarks/mime_sniffer.py [iterations]
+
+import glob
+import os
+import sys
+import timeit
+
+from wikimedia_thumbor.engine.djvu import djvu
+from wikimedia_thumbor.engine.ghostscript import ghostscript
+from wikimedia_thumbor.engine.gif import gif
+from wikimedia_thumbor.engine.imagemagick import imagemagick
+from wikimedia_thumbor.engine.stl import stl
+from wikimedia_thumbor.engine.svg import svg
+from wikimedia_thumbor.engine.tiff import tiff
+from wikimedia_thumbor.engine.vips import vips
+from wikimedia_thumbor.mime_sniffer import MimeSniffer
+
+
+ORIGINALS = os.path.join(os.path.dirname(__file__), '..', 'tests', 'integration', 'originals')
+
+# What the loaders' excerpts hold at most
+EXCERPT = 4096
+
+# The checks engines used to add, in import order
+CHAIN = [
+    ('image/webp', lambda buffer: buffer[:4] == b'RIFF' and buffer[8:12] == b'WEBP'),
+    ('image/xcf', lambda buffer: buffer[:8] == b'gimp xcf'),
+    ('image/vnd.djvu', lambda buffer: buffer[4:8] == b'FORM' and buffer[12:16] in (
+        b'DJVU', b'DJVM', b'PM44', b'BM44'
+    )),
+    ('image/tiff', lambda buffer: buffer[:7] in (b'II*\x00', 'MM\x00*')),
+    ('application/pdf', lambda buffer: buffer[:4] == b'%PDF'),
+    ('image/gif', lambda buffer: buffer[:4] == b'GIF8'),
+    ('application/sla', lambda buffer: stl.Engine.is_stl(buffer)),
+    ('image/svg+xml', lambda buffer: svg.Engine.is_svg(buffer)),
+]
+
+
+def chained():
+    get_mimetype = MimeSniffer.thumbor_get_mimetype
+
+    for mime, fn in CHAIN:
+        def get_mimetype(buffer, mime=mime, fn=fn, previous=get_mimetype):
+            if fn(buffer):
+                return mime
+
+            return previous(buffer)
+
+    return get_mimetype
+
+
+def buffers():
+    for path in sorted(glob.glob(os.path.join(ORIGINALS, '*'))):
+        with open(path, 'rb') as f:
+            yield os.path.basename(path), f.read(EXCERPT)
+
+
+def main(iterations):
+    # Engines register their formats when imported
+    assert djvu and ghostscript and gif and imagemagick and tiff and vips
+
+    excerpts = list(buffers())
+    implementations = (('chain', chained()), ('index', MimeSniffer.sniff))
+
+    for name, buffer in excerpts:
+        old, new = [get_mimetype(buffer) for _, get_mimetype in implementations]
+
+        if old != new:
+            print('%s: %s with the chain, %s with the index' % (name, old, new))
+
+    results = {}
+
+    for name, get_mimetype in implementations:
+        timer = timeit.Timer(lambda: [get_mimetype(buffer) for _, buffer in excerpts])
+        results[name] = min(timer.repeat(5, iterations)) / iterations / len(excerpts)
+
+    for name, _ in implementations:
+        print('%s: %.2f us per buffer' % (name, results[name] * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
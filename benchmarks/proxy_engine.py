@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2016 Wikimedia Foundation
+
+# Micro-benchmark of the per-request overhead of the proxy engine
+#
+# Compares loading a small JPEG and reading a few attributes through the
+# proxy engine, configured with the engines of the test suite, to doing
+# the same with the selected engine directly. Thumbor's PIL engine is the
+# catch-all, so that no external command runs.
+#
+# Usage: python benchmarks/proxy_engine.py [iterations]
+
+import io
+import sys
+import timeit
+from types import SimpleNamespace
+
+from PIL import Image
+
+from thumbor.config import Config
+from thumbor.context import Context, ServerParameters
+from thumbor.engines.pil import Engine as PILEngine
+from thumbor.importer import Importer
+
+from wikimedia_thumbor.engine.proxy import Engine as ProxyEngine
+
+
+ENGINES = [
+    ('wikimedia_thumbor.engine.djvu', ['djvu']),
+    ('wikimedia_thumbor.engine.vips', ['tiff', 'png']),
+    ('wikimedia_thumbor.engine.tiff', ['tiff']),
+    ('wikimedia_thumbor.engine.ghostscript', ['pdf']),
+    ('wikimedia_thumbor.engine.gif', ['gif']),
+    ('wikimedia_thumbor.engine.stl', ['stl']),
+    ('wikimedia_thumbor.engine.svg', ['svg']),
+    ('thumbor.engines.pil', ['jpg']),
+]
+
+ATTRIBUTES = ('size', 'extension', 'image', 'context')
+
+
+def context():
+    cfg = Config(SECURITY_KEY='ACME-SEC')
+    cfg.PROXY_ENGINE_ENGINES = ENGINES
+
+    importer = Importer(cfg)
+    importer.import_modules()
+
+    ctx = Context(ServerParameters(None, None, None, None, None, None), cfg, importer)
+    ctx.request_handler = SimpleNamespace(set_header=lambda name, value: None)
+
+    return ctx
+
+
+def jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def request(engine_class, ctx, buffer):
+    engine = engine_class(ctx)
+    engine.load(buffer, '.jpg')
+
+    for name in ATTRIBUTES * 10:
+        getattr(engine, name)
+
+
+def main(iterations):
+    ctx = context()
+    buffer = jpeg()
+
+    # Imports happen once per process, they're not part of the overhead
+    request(ProxyEngine, ctx, buffer)
+
+    results = {}
+
+    for name, engine_class in (('direct', PILEngine), ('proxy', ProxyEngine)):
+        timer = timeit.Timer(lambda: request(engine_class, ctx, buffer))
+        results[name] = min(timer.repeat(5, iterations)) / iterations
+
+    print('direct: %.1f us per request' % (results['direct'] * 1e6))
+    print('proxy:  %.1f us per request' % (results['proxy'] * 1e6))
+    print('proxy overhead: %.1f us per request' % ((results['proxy'] - results['direct']) * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
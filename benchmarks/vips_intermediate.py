@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2016 Wikimedia Foundation
+
+# Benchmark of the image the vips engine hands over to ImageMagick
+#
+# Writes a shrunk source the way the vips engine does, as a deflated PNG
+# and as an uncompressed one, on disk and on a tmpfs, then has convert
+# render a JPEG thumbnail from it. Needs vips and convert.
+#
+# Usage: python benchmarks/vips_intermediate.py [size] [repeat]
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+
+VARIANTS = [
+    ('png', ''),
+    ('png, compression=0', '[compression=0]'),
+]
+
+DIRECTORIES = [
+    ('disk', tempfile.gettempdir()),
+    ('tmpfs', '/dev/shm'),
+]
+
+
+def source(directory, size):
+    """A photo-like TIFF: noise over gradients, which deflate can't do
+    much with, like real photos."""
+    path = os.path.join(directory, 'source.tif')
+    gradient = Image.linear_gradient('L').resize((size, size))
+    noise = Image.effect_noise((size, size), 40)
+    Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.ROTATE_90))).save(path)
+
+    return path
+
+
+def timed(command):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+    return time.perf_counter() - start
+
+
+def main(size, repeat):
+    vips = shutil.which('vips')
+    convert = shutil.which('convert')
+
+    if vips is None or convert is None:
+        sys.exit('vips and convert are needed')
+
+    work = tempfile.mkdtemp()
+
+    try:
+        original = source(work, size)
+
+        for directory_name, directory in DIRECTORIES:
+            if not os.path.isdir(directory):
+                continue
+
+            for variant_name, options in VARIANTS:
+                intermediate_dir = tempfile.mkdtemp(dir=directory)
+                intermediate = os.path.join(intermediate_dir, 'vips_result.png')
+                write = read = 0
+
+                try:
+                    for _ in range(repeat):
+                        write += timed([vips, 'copy', original, intermediate + options])
+                        read += timed([convert, intermediate, '-resize', '400x', '-quality', '87', 'jpg:-'])
+
+                    print('%s on %s: vips %.2fs, convert %.2fs, %d bytes' % (
+                        variant_name,
+                        directory_name,
+                        write / repeat,
+                        read / repeat,
+                        os.path.getsize(intermediate)
+                    ))
+                finally:
+                    shutil.rmtree(intermediate_dir, True)
+    finally:
+        shutil.rmtree(work, True)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    )
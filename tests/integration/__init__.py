@@ -1,4 +1,3 @@
-import platform
 import os.path
 from tempfile import NamedTemporaryFile
 
@@ -50,12 +49,6 @@ class WikimediaTestCase(AsyncHTTPTestCase):
         cfg.THREED2PNG_PATH = which('3d2png')
         cfg.XVFB_RUN_PATH = which('xvfb-run')
         cfg.CONVERT_PATH = which('convert')
-        cfg.CWEBP_PATH = which('cwebp')
-        timeout = which(
-            'gtimeout' if platform.system() == 'Darwin' else 'timeout'
-        )
-        cfg.SUBPROCESS_TIMEOUT_PATH = timeout
-
         cfg.SUBPROCESS_USE_TIMEOUT = True
         cfg.SUBPROCESS_TIMEOUT = 60
         cfg.SUBPROCESS_TIMEOUT_KILL_AFTER = 0
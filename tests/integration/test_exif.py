@@ -169,3 +169,68 @@ class WikimediaExifTest(WikimediaTestCase):
             assert result.code == 500
             error_markers = ['[ExiftoolRunner] error:', 'wrong/path']
             assert all(marker in self.caplog.text for marker in error_markers)
+
+    def test_exiftool_stay_open(self):
+        path = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, 'Carrie.jpg')
+
+        with open(path, 'rb') as f:
+            buffer = f.read()
+
+        one_off = ExiftoolRunner.command(context=self.ctx, pre=['-j', '-ImageSize'], buffer=buffer)
+
+        self.ctx.config.EXIFTOOL_STAY_OPEN = True
+
+        try:
+            first = ExiftoolRunner.command(context=self.ctx, pre=['-j', '-ImageSize'], buffer=buffer)
+            pid = ExiftoolRunner.daemon.proc.pid
+            second = ExiftoolRunner.command(context=self.ctx, pre=['-j', '-ImageSize'], buffer=buffer)
+
+            assert ExiftoolRunner.daemon.proc.pid == pid
+            assert json.loads(first)[0]['ImageSize'] == json.loads(one_off)[0]['ImageSize']
+            assert json.loads(second)[0]['ImageSize'] == json.loads(one_off)[0]['ImageSize']
+
+            # A dead daemon gets restarted
+            ExiftoolRunner.daemon.proc.kill()
+            ExiftoolRunner.daemon.proc.wait()
+
+            third = ExiftoolRunner.command(context=self.ctx, pre=['-j', '-ImageSize'], buffer=buffer)
+
+            assert ExiftoolRunner.daemon.proc.pid != pid
+            assert json.loads(third)[0]['ImageSize'] == json.loads(one_off)[0]['ImageSize']
+        finally:
+            ExiftoolRunner.stop()
+
+    def test_exiftool_stay_open_arguments(self):
+        assert ExiftoolRunner.daemon_safe(['-j', '-Artist=Someone'])
+        assert not ExiftoolRunner.daemon_safe(['-Artist=Someone '])
+        assert not ExiftoolRunner.daemon_safe(['-Artist= Someone'])
+        assert not ExiftoolRunner.daemon_safe(['-Artist=Some\none'])
+        assert not ExiftoolRunner.daemon_safe(['#-Artist'])
+        assert not ExiftoolRunner.daemon_safe([''])
+
+        path = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, 'Carrie.jpg')
+
+        with open(path, 'rb') as f:
+            buffer = f.read()
+
+        fields = ['-Artist=Trailing space ', '-Copyright= Leading space', '-ImageDescription=#1']
+
+        def write():
+            return ExiftoolRunner.command(context=self.ctx, pre=fields + ['-o', '-'], buffer=buffer)
+
+        one_off = write()
+
+        written = json.loads(ExiftoolRunner.command(
+            context=self.ctx,
+            pre=['-j', '-Artist', '-Copyright', '-ImageDescription'],
+            buffer=one_off
+        ))[0]
+        assert written['Copyright'] == ' Leading space'
+        assert written['ImageDescription'] == '#1'
+
+        self.ctx.config.EXIFTOOL_STAY_OPEN = True
+
+        try:
+            assert write() == one_off
+        finally:
+            ExiftoolRunner.stop()
@@ -0,0 +1,133 @@
+import os
+import struct
+
+from PIL import Image, UnidentifiedImageError
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.header_sniffer import HeaderSniffer
+
+
+def pyramid_tiff():
+    """Little-endian TIFF: a 4000x3000 page with 1000x750 in a SubIFD,
+    2000x1500 as the next, reduced-resolution IFD, then a 800x600 page."""
+    ifds = [
+        (4000, 3000, 0, [(1000, 750)]),
+        (2000, 1500, 1, []),
+        (800, 600, 0, []),
+    ]
+
+    def ifd(width, height, subfile_type, next_offset, subifds_offset=None):
+        entries = [(254, 4, 1, subfile_type), (256, 4, 1, width), (257, 4, 1, height)]
+
+        if subifds_offset is not None:
+            entries.append((330, 13, 1, subifds_offset))
+
+        return struct.pack('<H', len(entries)) + b''.join(
+            struct.pack('<HHII', *entry) for entry in entries
+        ) + struct.pack('<I', next_offset)
+
+    def size(entries):
+        return 2 + entries * 12 + 4
+
+    buffer = b'II*\x00' + struct.pack('<I', 8)
+    offset = 8
+
+    for index, (width, height, subfile_type, subifds) in enumerate(ifds):
+        entries = 4 if subifds else 3
+        subifds_offset = offset + size(entries) if subifds else None
+        next_offset = offset + size(entries) + sum(size(3) for _ in subifds)
+
+        if index == len(ifds) - 1:
+            next_offset = 0
+
+        buffer += ifd(width, height, subfile_type, next_offset, subifds_offset)
+
+        for subifd_width, subifd_height in subifds:
+            buffer += ifd(subifd_width, subifd_height, 1, 0)
+
+        offset = len(buffer)
+
+    return buffer
+
+
+class WikimediaHeaderSnifferTest(WikimediaTestCase):
+    def original(self, name):
+        return os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, name)
+
+    def test_sniff_file_matches_pillow(self):
+        for name in os.listdir(self.ctx.config.FILE_LOADER_ROOT_PATH):
+            try:
+                expected = Image.open(self.original(name)).size
+            except UnidentifiedImageError:
+                continue
+
+            header = HeaderSniffer.sniff_file(self.original(name))
+
+            assert header is not None, name
+            assert (header.width, header.height) == expected, name
+
+    def test_sniff_excerpt(self):
+        with open(self.original('Cincinnati_Bell_logo.png'), 'rb') as f:
+            header = HeaderSniffer.sniff(f.read(self.ctx.config.LOADER_EXCERPT_LENGTH))
+
+        assert header.format == 'PNG'
+        assert (header.width, header.height) == (698, 150)
+        assert header.color_type == 'Palette'
+        assert header.has_alpha
+
+        with open(self.original('EXIF_rotation_180.jpg'), 'rb') as f:
+            header = HeaderSniffer.sniff(f.read(self.ctx.config.LOADER_EXCERPT_LENGTH))
+
+        assert header.format == 'JPEG'
+        assert (header.width, header.height) == (40, 60)
+        assert header.color_type == 'YCbCr'
+
+        with open(self.original('Janus.xcf'), 'rb') as f:
+            header = HeaderSniffer.sniff(f.read(self.ctx.config.LOADER_EXCERPT_LENGTH))
+
+        assert header.format == 'XCF'
+        assert (header.width, header.height) == (650, 701)
+
+    def test_sniff_incomplete(self):
+        # The first IFD of this TIFF is at the end of the file
+        with open(self.original('0729.tiff'), 'rb') as f:
+            assert HeaderSniffer.sniff(f.read(self.ctx.config.LOADER_EXCERPT_LENGTH)) is None
+
+        with open(self.original('Carrie.jpg'), 'rb') as f:
+            assert HeaderSniffer.sniff(f.read(100)) is None
+
+        header = HeaderSniffer.sniff_file(self.original('Physical_map_tagged_AdobeRGB.jpg'))
+        assert header.has_icc
+
+        assert HeaderSniffer.sniff(b'%PDF-1.4') is None
+
+    def test_tiff_pages(self):
+        path = self.original('International_Convention_for_Regulation_of_Whaling.tiff')
+
+        assert HeaderSniffer.sniff_file(path).pages == 3
+
+        with open(path, 'rb') as f:
+            buffer = f.read()
+
+        # Cut right after the first IFD, the next ones are missing
+        offset = struct.unpack('<I', buffer[4:8])[0]
+        count = struct.unpack('<H', buffer[offset:offset + 2])[0]
+        end = offset + 2 + count * 12 + 4
+
+        header = HeaderSniffer.sniff(buffer[:end])
+        assert header.width == 595
+        assert header.pages is None
+
+    def test_tiff_levels(self):
+        header = HeaderSniffer.sniff(pyramid_tiff())
+
+        assert (header.width, header.height) == (4000, 3000)
+        assert header.pages == 3
+        assert header.levels == [
+            [(4000, 3000, {}), (2000, 1500, {'page': 1}), (1000, 750, {'subifd': 0})],
+            [(2000, 1500, {'page': 1})],
+            [(800, 600, {'page': 2})],
+        ]
+
+        # Not all of the chain
+        assert HeaderSniffer.sniff(pyramid_tiff()[:80]).levels is None
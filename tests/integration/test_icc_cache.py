@@ -0,0 +1,75 @@
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from PIL import Image
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.icc_cache import IccProfileCache
+
+
+class WikimediaIccCacheTest(WikimediaTestCase):
+    def setUp(self):
+        super(WikimediaIccCacheTest, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.ctx.config.ICC_PROFILE_CACHE_PATH = os.path.join(self.cache_dir, 'icc')
+        self.ctx.config.ICC_PROFILE_CACHE_MAX_SIZE = 1024
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(WikimediaIccCacheTest, self).tearDown()
+
+    def test_path(self):
+        assert IccProfileCache.enabled(self.ctx)
+
+        profile = b'profile' * 10
+        path = IccProfileCache.path(self.ctx, profile)
+
+        with open(path, 'rb') as f:
+            assert f.read() == profile
+
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o444
+        assert IccProfileCache.path(self.ctx, profile) == path
+        assert IccProfileCache.path(self.ctx, b'other') != path
+        assert len(os.listdir(self.ctx.config.ICC_PROFILE_CACHE_PATH)) == 2
+
+    def test_evict(self):
+        old = IccProfileCache.path(self.ctx, b'a' * 600)
+        recent = IccProfileCache.path(self.ctx, b'b' * 300)
+
+        # Used long enough ago to be evicted, in LRU order
+        past = time.time() - 3600
+        os.utime(old, (past, past))
+        os.utime(recent, (past + 1, past + 1))
+
+        # Using it bumps it past the old one
+        IccProfileCache.path(self.ctx, b'b' * 300)
+
+        newest = IccProfileCache.path(self.ctx, b'c' * 300)
+
+        assert not os.path.exists(old)
+        assert os.path.exists(recent)
+        assert os.path.exists(newest)
+
+    def test_evict_grace(self):
+        first = IccProfileCache.path(self.ctx, b'a' * 800)
+        second = IccProfileCache.path(self.ctx, b'b' * 800)
+
+        # Over the limit, but both could still be in use
+        assert os.path.exists(first)
+        assert os.path.exists(second)
+
+    def test_disabled(self):
+        self.ctx.config.ICC_PROFILE_CACHE_PATH = None
+        assert not IccProfileCache.enabled(self.ctx)
+
+    def test_description(self):
+        with open(self.ctx.config.EXIF_TINYRGB_PATH, 'rb') as tinyrgb_file:
+            assert IccProfileCache.description(tinyrgb_file.read()) == 'c2'
+
+        original = Image.open('%s/Physical_map_tagged_AdobeRGB.jpg' % self.ctx.config.FILE_LOADER_ROOT_PATH)
+        assert IccProfileCache.description(original.info['icc_profile']) == 'Adobe RGB (1998)'
+
+        assert IccProfileCache.description(b'not a profile') is None
@@ -1,4 +1,7 @@
+from types import SimpleNamespace
+
 from . import WikimediaTestCase
+from wikimedia_thumbor.engine.imagemagick import Engine
 
 
 class WikimediaJpgTest(WikimediaTestCase):
@@ -227,3 +230,46 @@ class WikimediaJpgTest(WikimediaTestCase):
             expected_ssim=0.88,
             size_tolerance=0.83,
         )
+
+    def test_jpeg_scale(self):
+        assert Engine.jpeg_scale((4000, 3000), (400, 300)) == 8
+        assert Engine.jpeg_scale((4000, 3000), (600, 450)) == 4
+        assert Engine.jpeg_scale((4000, 3000), (1200, 900)) == 3
+        assert Engine.jpeg_scale((4000, 3000), (1600, 1200)) == 2
+        assert Engine.jpeg_scale((4000, 3000), (2100, 1575)) == 1
+
+        engine = Engine(self.ctx)
+        engine.source_metadata = SimpleNamespace(size=(4000, 3000), rotated=False)
+        assert engine.jpeg_size((600, 450)) == (1000, 750)
+
+        # The hint is in stored orientation, the target size once oriented
+        engine.source_metadata = SimpleNamespace(size=(3000, 4000), rotated=True)
+        assert engine.jpeg_size((800, 600)) == (750, 1000)
+        assert engine.jpeg_size((1600, 1200)) == (1500, 2000)
+
+    def test_convert_limits(self):
+        engine = Engine(self.ctx)
+        engine.source_metadata = SimpleNamespace(size=(4000, 3000), rotated=False)
+
+        assert engine.convert_limits((4000, 3000)) == {}
+        assert engine.convert_environment() is None
+
+        self.ctx.config.IMAGEMAGICK_MEMORY_BUDGET = 800 * 1024 * 1024
+        self.ctx.config.IMAGEMAGICK_MAX_THREADS = 4
+        self.ctx.config.IMAGEMAGICK_TEMPORARY_PATH = '/dev/shm'
+
+        # Decoded at 1/4 of its size, for a 600x450 thumbnail
+        size = engine.decoded_size(engine.jpeg_size((600, 450)))
+        assert size == (1000, 750)
+
+        assert engine.convert_limits(size) == {
+            'memory': 800 * 1024 * 1024,
+            'map': 800 * 1024 * 1024,
+            'area': 100 * 1024 * 1024,
+            'thread': 1,
+        }
+        assert engine.convert_limits(engine.decoded_size())['thread'] == 3
+        assert engine.convert_environment() == {'MAGICK_TEMPORARY_PATH': '/dev/shm'}
+
+        command = engine.convert_command()
+        assert command[command.index('thread') - 1:command.index('thread') + 2] == ['-limit', 'thread', '3']
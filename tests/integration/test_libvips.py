@@ -0,0 +1,223 @@
+import io
+
+from PIL import Image
+from thumbor.context import RequestParameters
+
+from . import WikimediaTestCase
+
+
+class WikimediaLibvipsTest(WikimediaTestCase):
+    def get_config(self):
+        cfg = super(WikimediaLibvipsTest, self).get_config()
+
+        cfg.PROXY_ENGINE_ENGINES = [
+            ('wikimedia_thumbor.engine.libvips', ['jpg', 'png', 'tiff', 'webp']),
+        ] + cfg.PROXY_ENGINE_ENGINES
+
+        return cfg
+
+    def run_and_check_engine(self, url, **kwargs):
+        self.run_and_check_ssim_and_size(url, **kwargs)
+
+        result = self.fetch(url)
+        assert result.headers.get('Thumbor-Engine') == 'wikimedia_thumbor.engine.libvips'
+
+    def test_jpg(self):
+        self.run_and_check_engine(
+            ('/thumbor/unsafe/400x/filters:conditional_sharpen(0.0,0.8,1.0,0.0,0.85)/'
+             'Christophe_Henner_-_June_2016.JPG'),
+            mediawiki_reference_thumbnail='400px-Christophe_Henner_-_June_2016.jpg',
+            perfect_reference_thumbnail='400px-Christophe_Henner_-_June_2016.png',
+            expected_width=400,
+            expected_height=267,
+            expected_ssim=0.92,
+            size_tolerance=1.02,
+        )
+        self.run_and_check_engine(
+            ('/thumbor/unsafe/400x/filters:conditional_sharpen(0.0,0.8,1.0,0.0,0.85):format(webp)/'
+             'Christophe_Henner_-_June_2016.JPG'),
+            mediawiki_reference_thumbnail='400px-Christophe_Henner_-_June_2016.jpg',
+            perfect_reference_thumbnail='400px-Christophe_Henner_-_June_2016.png',
+            expected_width=400,
+            expected_height=267,
+            expected_ssim=0.94,
+            size_tolerance=0.80,
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/800x/filters:conditional_sharpen(0.0,0.8,1.0,0.0,0.85)/Munich_subway_station_Westfriedhof.jpg',
+            mediawiki_reference_thumbnail='800px-Munich_subway_station_Westfriedhof.jpg',
+            perfect_reference_thumbnail='800px-Munich_subway_station_Westfriedhof.png',
+            expected_width=800,
+            expected_height=353,
+            expected_ssim=0.91,
+            size_tolerance=1.03,
+        )
+
+    def test_jpg_orientation(self):
+        self.run_and_check_engine(
+            '/thumbor/unsafe/40x/filters:conditional_sharpen(0.0,0.8,1.0,0.0,0.85)/EXIF_rotation_180.jpg',
+            mediawiki_reference_thumbnail='40px-EXIF_rotation_180.jpg',
+            perfect_reference_thumbnail='40px-EXIF_rotation_180.png',
+            expected_width=40,
+            expected_height=60,
+            expected_ssim=0.99,
+            size_tolerance=1.03,
+        )
+        self.run_and_check_engine(
+            ('/thumbor/unsafe/337x/filters:conditional_sharpen(0.0,0.8,1.0,0.0,0.85)/'
+             'Green_and_golden_Butterfly_copy.jpg'),
+            mediawiki_reference_thumbnail='337px-Green_and_golden_Butterfly_copy.jpg',
+            perfect_reference_thumbnail='337px-Green_and_golden_Butterfly_copy.png',
+            expected_width=337,
+            expected_height=599,
+            expected_ssim=0.94,
+            size_tolerance=1.0,
+        )
+
+    def test_jpg_metadata(self):
+        result = self.fetch('/thumbor/unsafe/400x/Christophe_Henner_-_June_2016.JPG')
+
+        with open(self.ctx.config.EXIF_TINYRGB_PATH, 'rb') as tinyrgb_file:
+            assert Image.open(result.buffer).info['icc_profile'] == tinyrgb_file.read()
+
+        result = self.fetch('/thumbor/unsafe/300x/Physical_map_tagged_AdobeRGB.jpg')
+        original = Image.open('%s/Physical_map_tagged_AdobeRGB.jpg' % self.ctx.config.FILE_LOADER_ROOT_PATH)
+        assert Image.open(result.buffer).info['icc_profile'] == original.info['icc_profile']
+
+        result = self.fetch('/thumbor/unsafe/800x/Munich_subway_station_Westfriedhof.jpg')
+        exif = Image.open(result.buffer).getexif()
+        assert exif[0x013B] == 'Martin Falbisoner'
+        assert exif[0x8298] == 'some rights reserved'
+
+    def test_cmyk(self):
+        # Imported here, like the proxy engine does, pyvips is optional
+        from wikimedia_thumbor.engine.libvips import Engine
+
+        # Rendered in sRGB, with TinyRGB rather than the CMYK profile
+        output = io.BytesIO()
+        Image.new('CMYK', (600, 400), (0, 128, 128, 0)).save(output, 'JPEG')
+        buffer = output.getvalue()
+
+        with open(self.ctx.config.EXIF_TINYRGB_PATH, 'rb') as tinyrgb_file:
+            tinyrgb = tinyrgb_file.read()
+
+        self.ctx.request = RequestParameters()
+
+        # Thumbnailed, then rendered in full
+        for size in ((300, 200), None):
+            engine = Engine(self.ctx)
+            assert engine.should_run(buffer)
+            engine.load(buffer, '.jpg')
+            engine.icc_profile = bytes(16) + b'CMYK' + bytes(108)
+
+            if size is not None:
+                engine.resize(*size)
+
+            image = Image.open(io.BytesIO(engine.read('.jpg', 80)))
+
+            assert image.mode == 'RGB'
+            assert image.size == (size or (600, 400))
+            assert image.info['icc_profile'] == tinyrgb
+
+    def test_png(self):
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/1Mcolors.png',
+            mediawiki_reference_thumbnail='400px-1Mcolors.png',
+            perfect_reference_thumbnail='400px-1Mcolors.png',
+            expected_width=400,
+            expected_height=400,
+            expected_ssim=0.99,
+            size_tolerance=0.74
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/filters:format(webp)/1Mcolors.png',
+            mediawiki_reference_thumbnail='400px-1Mcolors.png',
+            perfect_reference_thumbnail='400px-1Mcolors.png',
+            expected_width=400,
+            expected_height=400,
+            expected_ssim=0.99,
+            size_tolerance=0.2
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/PNG_transparency_demonstration_1.png',
+            mediawiki_reference_thumbnail='400px-PNG_transparency_demonstration_1.png',
+            perfect_reference_thumbnail='400px-PNG_transparency_demonstration_1.png',
+            expected_width=400,
+            expected_height=300,
+            expected_ssim=0.97,
+            size_tolerance=1.1
+        )
+
+    def test_filters(self):
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/filters:crop(10,10,20,20)/1Mcolors.png',
+            mediawiki_reference_thumbnail='crop-1Mcolors.png',
+            perfect_reference_thumbnail='crop-1Mcolors.png',
+            expected_width=10,
+            expected_height=10,
+            expected_ssim=0.98,
+            size_tolerance=1.0
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/filters:flip(x)/1Mcolors.png',
+            mediawiki_reference_thumbnail='flipx-1Mcolors.png',
+            perfect_reference_thumbnail='flipx-1Mcolors.png',
+            expected_width=400,
+            expected_height=400,
+            expected_ssim=0.99,
+            size_tolerance=0.89
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/filters:flip(y)/1Mcolors.png',
+            mediawiki_reference_thumbnail='flipy-1Mcolors.png',
+            perfect_reference_thumbnail='flipy-1Mcolors.png',
+            expected_width=400,
+            expected_height=400,
+            expected_ssim=0.99,
+            size_tolerance=0.87
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/filters:rotate(90)/1Mcolors.png',
+            mediawiki_reference_thumbnail='rot90deg-1Mcolors.png',
+            perfect_reference_thumbnail='rot90deg-1Mcolors.png',
+            expected_width=1000,
+            expected_height=1000,
+            expected_ssim=0.99,
+            size_tolerance=0.4
+        )
+
+    def test_tiff(self):
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/filters:format(jpg)/0729.tiff',
+            mediawiki_reference_thumbnail='lossy-page1-400px-0729.tiff.jpg',
+            perfect_reference_thumbnail='lossy-page1-400px-0729.tiff.png',
+            expected_width=400,
+            expected_height=254,
+            expected_ssim=0.95,
+            size_tolerance=0.61,
+        )
+        self.run_and_check_engine(
+            '/thumbor/unsafe/400x/filters:format(jpg):page(3)/International_Convention_for_Regulation_of_Whaling.tiff',
+            mediawiki_reference_thumbnail='lossy-page3-400px-International_Convention_for_Regulation_of_Whaling.tiff.jpg',
+            perfect_reference_thumbnail='lossy-page3-400px-International_Convention_for_Regulation_of_Whaling.tiff.png',
+            expected_width=400,
+            expected_height=566,
+            expected_ssim=0.99,
+            size_tolerance=0.8,
+        )
+
+    def test_webp(self):
+        self.run_and_check_engine(
+            '/thumbor/unsafe/300x/filters:format(png)/Album_en_blanco_y_negro.webp',
+            mediawiki_reference_thumbnail='300px-Album_en_blanco_y_negro.webp.png',
+            perfect_reference_thumbnail='300px-Album_en_blanco_y_negro.webp.png',
+            expected_width=300,
+            expected_height=202,
+            expected_ssim=0.99,
+            size_tolerance=1.06
+        )
+
+    def test_fallback(self):
+        # Formats the engine doesn't handle go to the next engine
+        result = self.fetch('/thumbor/unsafe/400x/Janus.xcf')
+        assert result.headers.get('Thumbor-Engine') == 'wikimedia_thumbor.engine.imagemagick'
@@ -0,0 +1,186 @@
+import io
+import json
+import os
+import tempfile
+
+import pytest
+from PIL import Image
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.exiftool_runner import ExiftoolRunner
+from wikimedia_thumbor.metadata_writer import MetadataWriter, UnsupportedMetadata
+
+
+class WikimediaMetadataWriterTest(WikimediaTestCase):
+    def make_jpeg(self, **kwargs):
+        output = io.BytesIO()
+        Image.new('RGB', (64, 48), (200, 100, 50)).save(output, 'JPEG', **kwargs)
+        return output.getvalue()
+
+    def segment_markers(self, buffer):
+        markers = []
+        position = 2
+
+        while buffer[position + 1] != 0xDA:
+            markers.append(buffer[position + 1])
+            position += 2 + int.from_bytes(buffer[position + 2:position + 4], 'big')
+
+        return markers
+
+    def segments(self, buffer):
+        """(marker, payload) of the segments before the image data."""
+        segments = []
+        position = 2
+
+        while buffer[position + 1] != 0xDA:
+            length = int.from_bytes(buffer[position + 2:position + 4], 'big')
+            segments.append((buffer[position + 1], buffer[position + 4:position + 2 + length]))
+            position += 2 + length
+
+        return segments
+
+    def test_rewrite(self):
+        exif = Image.Exif()
+        exif[0x013B] = 'Original artist'
+        exif[0x0110] = 'Some camera'
+        original = self.make_jpeg(exif=exif.tobytes(), icc_profile=b'old profile', comment=b'comment')
+
+        with open(self.ctx.config.EXIF_TINYRGB_PATH, 'rb') as f:
+            profile = f.read()
+
+        result = MetadataWriter.rewrite_jpeg(
+            original,
+            profile,
+            {'Artist': 'Someone', 'Copyright': 'CC-BY-SA 4.0', 'ImageDescription': ''}
+        )
+
+        # JFIF, the old EXIF, ICC and comment are gone
+        assert self.segment_markers(result)[:2] == [0xE1, 0xE2]
+        assert 0xE0 not in self.segment_markers(result)
+        assert 0xFE not in self.segment_markers(result)
+
+        image = Image.open(io.BytesIO(result))
+        assert image.info['icc_profile'] == profile
+        assert 'comment' not in image.info
+        assert dict(image.getexif()) == {0x013B: 'Someone', 0x8298: 'CC-BY-SA 4.0'}
+
+        # Image data is untouched
+        assert result.endswith(original[original.index(b'\xff\xda'):])
+        assert image.tobytes() == Image.open(io.BytesIO(original)).tobytes()
+
+    def test_rewrite_large_icc_profile(self):
+        profile = bytes(range(256)) * 600
+
+        result = MetadataWriter.rewrite_jpeg(self.make_jpeg(), profile)
+
+        assert self.segment_markers(result).count(0xE2) == 3
+        assert Image.open(io.BytesIO(result)).info['icc_profile'] == profile
+
+    def test_rewrite_keeps_adobe_segment(self):
+        original = self.make_jpeg()
+        adobe = b'\xff\xee\x00\x0eAdobe\x00d\x00\x00\x00\x00\x01'
+        original = original[:2] + adobe + original[2:]
+
+        result = MetadataWriter.rewrite_jpeg(original)
+
+        assert self.segment_markers(result)[0] == 0xEE
+
+    def test_rewrite_unsupported(self):
+        with pytest.raises(UnsupportedMetadata):
+            MetadataWriter.rewrite_jpeg(b'\x89PNG\r\n\x1a\n')
+
+        with pytest.raises(UnsupportedMetadata):
+            MetadataWriter.rewrite_jpeg(self.make_jpeg(), None, {'GPSLatitude': '1'})
+
+        with pytest.raises(UnsupportedMetadata):
+            MetadataWriter.rewrite_jpeg(self.make_jpeg()[:100])
+
+    def make_webp(self, mode='RGB', **kwargs):
+        output = io.BytesIO()
+        Image.new(mode, (64, 48), (200, 100, 50, 128)[:len(mode)]).save(output, 'WEBP', **kwargs)
+        return output.getvalue()
+
+    def test_rewrite_webp(self):
+        with open(self.ctx.config.EXIF_TINYRGB_PATH, 'rb') as f:
+            profile = f.read()
+
+        for mode, lossless in (('RGB', False), ('RGBA', False), ('RGBA', True)):
+            exif = Image.Exif()
+            exif[0x013B] = 'Original artist'
+            original = self.make_webp(mode, lossless=lossless, exif=exif.tobytes(), icc_profile=b'old profile')
+
+            result = MetadataWriter.rewrite(original, profile, {'Artist': 'Someone'})
+
+            assert result[12:16] == b'VP8X'
+            assert int.from_bytes(result[4:8], 'little') == len(result) - 8
+
+            image = Image.open(io.BytesIO(result))
+            assert image.size == (64, 48)
+            assert image.mode == mode
+            assert image.info['icc_profile'] == profile
+            assert dict(image.getexif()) == {0x013B: 'Someone'}
+            assert image.tobytes() == Image.open(io.BytesIO(original)).tobytes()
+
+        # Without metadata, simple files don't need the extended header
+        result = MetadataWriter.rewrite_webp(self.make_webp(icc_profile=b'old profile'))
+        assert result[12:16] == b'VP8 '
+        assert 'icc_profile' not in Image.open(io.BytesIO(result)).info
+
+    def test_rewrite_webp_unsupported(self):
+        with pytest.raises(UnsupportedMetadata):
+            MetadataWriter.rewrite_webp(self.make_jpeg())
+
+        with pytest.raises(UnsupportedMetadata):
+            MetadataWriter.rewrite_webp(self.make_webp()[:-10])
+
+    def test_rewrite_matches_exiftool(self):
+        path = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, 'Physical_map_tagged_AdobeRGB.jpg')
+
+        with open(path, 'rb') as f:
+            original = f.read()
+
+        profile = ExiftoolRunner.command(context=self.ctx, pre=['-icc_profile', '-b'], buffer=original)
+        fields = {'Artist': 'Someone', 'Copyright': 'Public domain'}
+
+        # Both get the same profile
+        with tempfile.NamedTemporaryFile(suffix='.icc') as f:
+            f.write(profile)
+            f.flush()
+
+            exiftool_result = ExiftoolRunner.command(
+                context=self.ctx,
+                pre=['-all=', '-icc_profile<=%s' % f.name, '-Artist=Someone', '-Copyright=Public domain'],
+                post=['-o', '-'],
+                buffer=original
+            )
+
+        result = MetadataWriter.rewrite_jpeg(original, profile, fields)
+
+        read = ['-j', '-G', '-a', '-ICC_Profile:ProfileDescription', '-EXIF:All', '-XMP:All', '-IPTC:All', '-JFIF:All', '-File:Comment']
+        expected = json.loads(ExiftoolRunner.command(context=self.ctx, pre=read, buffer=exiftool_result))[0]
+        found = json.loads(ExiftoolRunner.command(context=self.ctx, pre=read, buffer=result))[0]
+
+        for tags in (expected, found):
+            del tags['SourceFile']
+
+        # exiftool also adds the mandatory tags of a new EXIF block
+        for tag in list(expected):
+            if tag.startswith('EXIF:') and tag not in ('EXIF:Artist', 'EXIF:Copyright'):
+                del expected[tag]
+
+        assert found == expected
+
+        # exiftool's EXIF block has more tags, so the files can't be
+        # identical, but everything else is: the segments, their order,
+        # the ICC chunks and the image data
+        expected_segments = self.segments(exiftool_result)
+        found_segments = self.segments(result)
+
+        assert [marker for marker, _ in found_segments] == [marker for marker, _ in expected_segments]
+        assert [segment for segment in found_segments if segment[0] != 0xE1] \
+            == [segment for segment in expected_segments if segment[0] != 0xE1]
+
+        def image_data(buffer, segments):
+            return buffer[2 + sum(4 + len(payload) for _, payload in segments):]
+
+        assert image_data(result, found_segments) == image_data(exiftool_result, expected_segments)
@@ -0,0 +1,59 @@
+import os
+
+from thumbor.engines import BaseEngine
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.engine import BaseWikimediaEngine
+from wikimedia_thumbor.mime_sniffer import MimeSniffer
+
+
+class WikimediaMimeSnifferTest(WikimediaTestCase):
+    def sniff(self, name):
+        path = os.path.join(os.path.dirname(__file__), 'originals', name)
+
+        with open(path, 'rb') as f:
+            return BaseEngine.get_mimetype(f.read(4096))
+
+    def test_originals(self):
+        # Engines register their formats when the app imports them
+        self.get_app()
+
+        expected = {
+            '0729.tiff': 'image/tiff',
+            'Lejeune.TIF': 'image/tiff',
+            'Internationalisation.pdf': 'application/pdf',
+            'Carrie.jpg': 'image/jpeg',
+            'Quillette.png': 'image/png',
+            'Jokie.gif': 'image/gif',
+            'Album_en_blanco_y_negro.webp': 'image/webp',
+            'Janus.xcf': 'image/xcf',
+            'Tree_edges.svg': 'image/svg+xml',
+            'crystal-NEW.stl': 'application/sla',
+            '4x2brick_0.00interference.STL': 'application/sla',
+            'Aequipotentialflaechen.webm': 'video/webm',
+        }
+
+        for name, mime in expected.items():
+            assert self.sniff(name) == mime, name
+
+    def test_priority(self):
+        # Heuristics can't take over a format with magic bytes
+        BaseWikimediaEngine.add_format('image/x-test', '.test', lambda buffer: True)
+
+        try:
+            assert MimeSniffer.sniff(b'GIF89a') == 'image/gif'
+            assert MimeSniffer.sniff(b'\x00unknown') == 'image/x-test'
+        finally:
+            del MimeSniffer.signatures[('image/x-test', MimeSniffer.HEURISTIC)]
+            MimeSniffer.reindex()
+
+        assert MimeSniffer.sniff(b'\x00unknown') is None
+
+    def test_register_again(self):
+        signatures = len(MimeSniffer.signatures)
+
+        BaseWikimediaEngine.add_format('image/gif', '.gif', magic=b'GIF8')
+
+        assert len(MimeSniffer.signatures) == signatures
+        assert MimeSniffer.sniff(b'MM\x00*') == 'image/tiff'
+        assert MimeSniffer.sniff(b'\xef\xbb\xbf<svg') == 'image/svg+xml'
@@ -0,0 +1,50 @@
+import os
+import threading
+
+from tornado.ioloop import IOLoop
+from tornado.testing import gen_test
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.off_loop import OffLoopFetchMixin
+from wikimedia_thumbor.shell_runner import ShellRunner
+
+
+class RecordingEngine:
+    def __init__(self, context):
+        self.context = context
+        self.calls = []
+
+    def load(self, buffer, extension):
+        returncode, stderr, stdout = ShellRunner.command(['echo', 'loaded'], self.context)
+        self.calls.append((threading.get_ident(), extension, stdout))
+
+
+class WikimediaOffLoopTest(WikimediaTestCase):
+    @gen_test
+    async def test_load_engine(self):
+        self._app.start_worker()
+
+        handler = OffLoopFetchMixin()
+        handler.context = self.ctx
+        engine = RecordingEngine(self.ctx)
+
+        await handler.load_engine(engine, b'', '.png')
+
+        # Loaded in another thread, with the command run on the IOLoop
+        [(thread, extension, stdout)] = engine.calls
+        assert thread != threading.get_ident()
+        assert extension == '.png'
+        assert stdout == b'loaded\n'
+
+    def test_start_worker(self):
+        ShellRunner.io_loop = None
+
+        # Any request will do
+        response = self.fetch('/nothing/here')
+        assert response.code == 404
+
+        assert self._app.worker_pid == os.getpid()
+        assert ShellRunner.io_loop is IOLoop.current()
+        assert self._app.sweeper.is_running()
+
+        self._app.sweeper.stop()
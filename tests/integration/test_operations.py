@@ -0,0 +1,83 @@
+from PIL import Image
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.operations import OperationGraph, Raw, Resize, Crop, Orient, Rotate, Unsharp
+
+
+class WikimediaOperationsTest(WikimediaTestCase):
+    def apply(self, image, operations):
+        transposes = {
+            90: Image.Transpose.ROTATE_270,
+            180: Image.Transpose.ROTATE_180,
+            270: Image.Transpose.ROTATE_90,
+        }
+
+        for operation in operations:
+            if isinstance(operation, Crop):
+                image = image.crop(operation.region)
+            elif isinstance(operation, Orient):
+                if operation.flop:
+                    image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+                if operation.rotation:
+                    image = image.transpose(transposes[operation.rotation])
+
+        return image
+
+    def test_fuse(self):
+        graph = OperationGraph([Orient(90), Orient(flop=True), Orient(90)])
+        assert list(graph.optimize()) == [Orient(flop=True)]
+
+        graph = OperationGraph([Orient(90), Orient(270), Unsharp(0, 0.8, 1, 0)])
+        assert list(graph.optimize()) == [Unsharp(0, 0.8, 1, 0)]
+
+        graph = OperationGraph([Orient(flop=True), Orient.flip()])
+        assert list(graph.optimize()) == [Orient(180)]
+
+    def test_hoist_crop(self):
+        graph = OperationGraph([
+            Resize(400, 400),
+            Raw(['-background', 'none']),
+            Crop(10, 10, 10, 10)
+        ])
+
+        assert list(graph.optimize((1000, 1000))) == [
+            Crop(25, 25, 25, 25),
+            Resize(10, 10),
+            Raw(['-background', 'none'])
+        ]
+
+    def test_hoist_crop_hinted(self):
+        # The loader shrinks the source before the crop could run
+        graph = OperationGraph([Resize(400, 400, hint=(400, 400)), Crop(10, 10, 10, 10)])
+        assert list(graph.optimize((1000, 1000))) == list(graph)
+
+    def test_hoist_crop_orient(self):
+        source = Image.new('RGB', (60, 40))
+        source.putdata([(x, y, 0) for y in range(40) for x in range(60)])
+
+        for rotation in (0, 90, 180, 270):
+            for flop in (False, True):
+                operations = [Orient(rotation, flop), Crop(5, 7, 11, 13)]
+                optimized = list(OperationGraph(operations).optimize(source.size))
+
+                assert isinstance(optimized[0], Crop)
+                assert self.apply(source, optimized).tobytes() == self.apply(source, operations).tobytes()
+
+    def test_drop_noops(self):
+        graph = OperationGraph([Crop(0, 0, 100, 100), Resize(100, 50), Rotate(45)])
+        assert list(graph.optimize((100, 50))) == [Rotate(45)]
+
+    def test_to_convert(self):
+        graph = OperationGraph([
+            Resize(400, 267, hint=(800, 534)),
+            Orient(180),
+            Orient(flop=True),
+            Crop(1, 2, 3, 4),
+        ])
+
+        assert graph.optimize((1600, 1068)).to_convert() == [
+            '-define', 'jpeg:size=800x534',
+            '-resize', '400x267^', '-gravity', 'center', '-extent', '400x267',
+            '-crop', '3x4+1+261', '+repage',
+            '-flip',
+        ]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.engine.imagemagick import Engine as IMEngine
+from wikimedia_thumbor.engine.proxy import Engine
+
+
+class WikimediaProxyEngineTest(WikimediaTestCase):
+    def test_lazy_engines(self):
+        engine = Engine(self.ctx)
+        assert engine.lcl['instances'] == {}
+
+        engine.lcl['extension'] = '.jpg'
+        assert engine.select_engine() == 'wikimedia_thumbor.engine.imagemagick'
+
+        # Engines that can't handle the extension are never instantiated
+        assert list(engine.lcl['instances']) == ['wikimedia_thumbor.engine.imagemagick']
+        assert isinstance(engine.selected(), IMEngine)
+
+        # Attributes are proxied to the selected engine
+        engine.extension = '.jpg'
+        assert engine.selected().extension == '.jpg'
+
+        assert isinstance(engine.selected(), Engine.engine_class('wikimedia_thumbor.engine.imagemagick'))
+        assert Engine(self.ctx).lcl['instances'] == {}
+
+    def test_dispatch(self):
+        engines = self.ctx.config.PROXY_ENGINE_ENGINES
+        index = Engine.dispatch(engines)
+
+        assert index['tiff'] == ['wikimedia_thumbor.engine.vips', 'wikimedia_thumbor.engine.tiff']
+        assert index['jpg'] == ['wikimedia_thumbor.engine.imagemagick']
+        assert 'bmp' not in index
+
+        # Built once per PROXY_ENGINE_ENGINES
+        assert Engine.dispatch(engines) is index
+        assert Engine(self.ctx).lcl['engines'] is index
+
+    def test_thread_usage(self):
+        def spin(seconds):
+            end = time.thread_time() + seconds
+            while time.thread_time() < end:
+                sum(range(10000))
+
+        engine = Engine(self.ctx)
+
+        # A concurrent request's CPU time isn't accounted for
+        other = threading.Thread(target=spin, args=(0.3,))
+        other.start()
+
+        with engine.thread_usage():
+            other.join()
+
+        assert engine.lcl['thread_utime'] < 0.1
+
+        with engine.thread_usage():
+            spin(0.2)
+
+        assert engine.lcl['thread_utime'] >= 0.15
+        assert engine.utime() == engine.lcl['thread_utime']
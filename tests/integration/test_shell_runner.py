@@ -0,0 +1,246 @@
+import asyncio
+import datetime
+import tempfile
+
+import pytest
+from tornado.ioloop import IOLoop
+from tornado.testing import gen_test
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.shell_runner import ShellRunner, CommandTimeoutError
+
+
+class WikimediaShellRunnerTest(WikimediaTestCase):
+    @gen_test
+    async def test_command_async(self):
+        returncode, stderr, stdout = await ShellRunner.command_async(
+            ['echo', 'hello'],
+            self.ctx
+        )
+
+        assert returncode == 0
+        assert stdout == b'hello\n'
+        assert stderr == b''
+
+    @gen_test
+    async def test_command_async_failure(self):
+        returncode, stderr, stdout = await ShellRunner.command_async(
+            ['ls', '/this/path/does/not/exist'],
+            self.ctx
+        )
+
+        assert returncode != 0
+        assert stderr != b''
+
+    @gen_test
+    async def test_command_async_concurrency_limit(self):
+        self.ctx.config.SUBPROCESS_MAX_CONCURRENCY = 1
+
+        start = datetime.datetime.now()
+
+        await asyncio.gather(
+            ShellRunner.command_async(['sleep', '0.5'], self.ctx),
+            ShellRunner.command_async(['sleep', '0.5'], self.ctx),
+        )
+
+        duration = datetime.datetime.now() - start
+
+        assert duration.total_seconds() >= 1, 'Commands ran concurrently: %r' % duration
+
+    @gen_test
+    async def test_command_from_engine_thread(self):
+        # Done by the first request of the worker
+        self._app.start_worker()
+        assert ShellRunner.io_loop is IOLoop.current()
+
+        returncode, stderr, stdout = await IOLoop.current().run_in_executor(
+            None,
+            ShellRunner.command,
+            ['echo', 'threaded'],
+            self.ctx
+        )
+
+        assert returncode == 0
+        assert stdout == b'threaded\n'
+
+    def test_command_usage(self):
+        returncode, stderr, stdout = ShellRunner.command(
+            ['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done'],
+            self.ctx
+        )
+
+        assert returncode == 0
+
+        usage = ShellRunner.usage(self.ctx)['sh']
+        assert usage['utime'] > 0
+        assert usage['maxrss'] > 0
+
+    @gen_test
+    async def test_command_async_usage(self):
+        await ShellRunner.command_async(['echo', 'one'], self.ctx)
+        await ShellRunner.command_async(['echo', 'two'], self.ctx)
+
+        usage = ShellRunner.usage(self.ctx)['echo']
+        assert usage['maxrss'] > 0
+        assert ShellRunner.total_usage(self.ctx, 'utime') == usage['utime']
+
+    def test_command_timeout(self):
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.5
+
+        start = datetime.datetime.now()
+
+        with pytest.raises(CommandTimeoutError):
+            ShellRunner.command(['sleep', '5'], self.ctx)
+
+        assert (datetime.datetime.now() - start).total_seconds() < 5
+
+    def test_command_timeout_kills_process_group(self):
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.5
+        self.ctx.config.SUBPROCESS_TIMEOUT_KILL_AFTER = 0.5
+
+        start = datetime.datetime.now()
+
+        # The shell and its sleeping child both ignore SIGTERM
+        with pytest.raises(CommandTimeoutError):
+            ShellRunner.command(['sh', '-c', 'trap "" TERM; sleep 5; echo done'], self.ctx)
+
+        assert (datetime.datetime.now() - start).total_seconds() < 5
+
+    def test_command_without_timeout(self):
+        self.ctx.config.SUBPROCESS_USE_TIMEOUT = False
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.1
+
+        returncode, stderr, stdout = ShellRunner.command(['sh', '-c', 'sleep 0.5; echo done'], self.ctx)
+
+        assert stdout == b'done\n'
+
+    @gen_test
+    async def test_command_async_timeout(self):
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.5
+        self.ctx.config.SUBPROCESS_TIMEOUT_KILL_AFTER = 0.5
+
+        start = datetime.datetime.now()
+
+        with pytest.raises(CommandTimeoutError):
+            await ShellRunner.command_async(['sh', '-c', 'trap "" TERM; sleep 5; echo done'], self.ctx)
+
+        assert (datetime.datetime.now() - start).total_seconds() < 5
+
+    def test_command_not_found(self):
+        returncode, stderr, stdout = ShellRunner.command(['wrong/path'], self.ctx)
+
+        assert returncode == 127
+        assert b'wrong/path' in stderr
+
+    @gen_test
+    async def test_command_async_not_found(self):
+        returncode, stderr, stdout = await ShellRunner.command_async(['wrong/path'], self.ctx)
+
+        assert returncode == 127
+        assert b'wrong/path' in stderr
+
+    def test_pipeline(self):
+        returncode, stderr, stdout = ShellRunner.pipeline(
+            [
+                ['echo', 'hello'],
+                ['tr', 'a-z', 'A-Z'],
+                ['tr', 'L', 'l'],
+            ],
+            self.ctx
+        )
+
+        assert returncode == 0
+        assert stdout == b'HEllO\n'
+        assert stderr == b''
+
+        usage = ShellRunner.usage(self.ctx)
+        assert 'echo' in usage
+        assert 'tr' in usage
+
+    @gen_test
+    async def test_pipeline_concurrency_limit(self):
+        self._app.start_worker()
+        self.ctx.config.SUBPROCESS_MAX_CONCURRENCY = 1
+
+        start = datetime.datetime.now()
+
+        # Pipelines run from engine threads share the cap with commands
+        # run on the IOLoop
+        results = await asyncio.gather(
+            IOLoop.current().run_in_executor(
+                None,
+                ShellRunner.pipeline,
+                [['sleep', '0.5'], ['cat']],
+                self.ctx
+            ),
+            ShellRunner.command_async(['sleep', '0.5'], self.ctx),
+        )
+
+        duration = datetime.datetime.now() - start
+
+        assert [returncode for returncode, _, _ in results] == [0, 0]
+        assert duration.total_seconds() >= 1, 'Commands ran concurrently: %r' % duration
+
+        # The slot is given back
+        returncode, stderr, stdout = await ShellRunner.command_async(['true'], self.ctx)
+        assert returncode == 0
+
+    def test_pipeline_to_file(self):
+        with tempfile.TemporaryFile() as output:
+            returncode, stderr, stdout = ShellRunner.pipeline(
+                [
+                    ['sh', '-c', 'echo hello; echo warning >&2'],
+                    ['cat'],
+                ],
+                self.ctx,
+                stdout=output
+            )
+
+            output.seek(0)
+
+            assert returncode == 0
+            assert stdout == b''
+            assert stderr == b'warning\n'
+            assert output.read() == b'hello\n'
+
+    def test_pipeline_failure(self):
+        returncode, stderr, stdout = ShellRunner.pipeline(
+            [
+                ['ls', '/this/path/does/not/exist'],
+                ['cat'],
+            ],
+            self.ctx
+        )
+
+        assert returncode != 0
+        assert stderr != b''
+
+    def test_pipeline_not_found(self):
+        returncode, stderr, stdout = ShellRunner.pipeline(
+            [
+                ['sleep', '5'],
+                ['wrong/path'],
+            ],
+            self.ctx
+        )
+
+        assert returncode == 127
+        assert b'wrong/path' in stderr
+
+    def test_pipeline_timeout(self):
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.5
+        self.ctx.config.SUBPROCESS_TIMEOUT_KILL_AFTER = 0.5
+
+        start = datetime.datetime.now()
+
+        # Every command of the pipeline is taken down, not just the last one
+        with pytest.raises(CommandTimeoutError):
+            ShellRunner.pipeline(
+                [
+                    ['sh', '-c', 'trap "" TERM; sleep 5; echo done'],
+                    ['cat'],
+                ],
+                self.ctx
+            )
+
+        assert (datetime.datetime.now() - start).total_seconds() < 5
@@ -0,0 +1,35 @@
+from thumbor.context import RequestParameters
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.size_ladder import SizeLadder
+
+
+class WikimediaSizeLadderTest(WikimediaTestCase):
+    def test_parse(self):
+        assert SizeLadder.parse('320,220, 640,220') == [220, 320, 640]
+        assert SizeLadder.parse('') == []
+        assert SizeLadder.parse('220,foo') == []
+
+    def test_save_path(self):
+        assert SizeLadder.save_path(
+            'thumbor/d/d3/1Mcolors.png/400px-1Mcolors.png',
+            220
+        ) == 'thumbor/d/d3/1Mcolors.png/220px-1Mcolors.png'
+
+        assert SizeLadder.save_path(
+            'thumb/a/ab/800px-Foo.jpg/qlow-lang-de-800px-800px-Foo.jpg',
+            220
+        ) == 'thumb/a/ab/800px-Foo.jpg/qlow-lang-de-220px-800px-Foo.jpg'
+
+    def test_widths(self):
+        self.ctx.config.SIZE_LADDER_WIDTHS = [120, 220, 320, 640, 800, 1024]
+        self.ctx.config.SIZE_LADDER_MAX_WIDTHS = 3
+        self.ctx.request = RequestParameters(width=320, height=0)
+
+        assert SizeLadder.widths(self.ctx, 1000) == []
+
+        self.ctx.wikimedia_size_ladder = [100, 120, 220, 320, 640, 800, 1024]
+        assert SizeLadder.widths(self.ctx, 1000) == [220, 640, 800]
+
+        self.ctx.request = RequestParameters(width=320, height=200)
+        assert SizeLadder.widths(self.ctx, 1000) == []
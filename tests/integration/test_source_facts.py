@@ -0,0 +1,48 @@
+import os
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.source_facts import SourceFacts
+from wikimedia_thumbor.source_handle import SourceHandle
+
+
+class WikimediaSourceFactsTest(WikimediaTestCase):
+    def excerpt(self, name):
+        path = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, name)
+
+        with open(path, 'rb') as f:
+            return f.read(self.ctx.config.LOADER_EXCERPT_LENGTH)
+
+    def test_facts(self):
+        buffer = self.excerpt('Cincinnati_Bell_logo.png')
+        facts = SourceFacts.of(self.ctx, buffer)
+
+        assert facts.mime == 'image/png'
+        assert facts.format == 'PNG'
+        assert facts.pages == 1
+        assert facts.animated is False
+        assert facts.dimensions() == (facts.header.width, facts.header.height)
+
+        # Found once per excerpt
+        assert SourceFacts.of(self.ctx, buffer) is facts
+        assert SourceFacts.of(self.ctx, self.excerpt('Tower.jpg')) is not facts
+
+    def test_animated(self):
+        facts = SourceFacts.of(self.ctx, self.excerpt('Jokie.gif'))
+
+        assert facts.format == 'GIF'
+        assert facts.animated is True
+
+    def test_original(self):
+        # The excerpt doesn't contain the whole IFD chain
+        path = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, '0729.tiff')
+        buffer = self.excerpt('0729.tiff')[:8]
+
+        self.ctx.wikimedia_original_file = SourceHandle.link(self.ctx, path)
+
+        try:
+            facts = SourceFacts.of(self.ctx, buffer)
+        finally:
+            self.ctx.wikimedia_original_file.close()
+
+        assert facts.format == 'TIFF'
+        assert facts.size is not None
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.source_handle import SourceHandle
+
+
+class WikimediaSourceHandleTest(WikimediaTestCase):
+    def setUp(self):
+        super(WikimediaSourceHandleTest, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.original = os.path.join(self.temp_dir, 'original')
+
+        with open(self.original, 'wb') as f:
+            f.write(b'original' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(WikimediaSourceHandleTest, self).tearDown()
+
+    def test_link(self):
+        handle = SourceHandle.link(self.ctx, self.original)
+
+        with open(handle.name, 'rb') as f:
+            assert f.read() == b'original' * 1000
+
+        # The handle outlives the original
+        os.unlink(self.original)
+
+        assert handle.size == 8000
+        assert handle.read(8, 8) == b'original'
+        assert handle.mmap()[:16] == b'original' * 2
+
+        directory = os.path.dirname(handle.name)
+        handle.close()
+        handle.close()
+
+        assert handle.closed
+        assert not os.path.exists(directory)
+
+    def test_clone(self):
+        target = os.path.join(self.temp_dir, 'clone')
+
+        assert SourceHandle.clone(self.original, target) in ('reflink', 'copy')
+
+        with open(target, 'rb') as f:
+            assert f.read() == b'original' * 1000
+
+    def test_anonymous(self):
+        for memfd in (True, False):
+            self.ctx.config.SOURCE_HANDLE_USE_MEMFD = memfd
+
+            handle = SourceHandle.from_bytes(self.ctx, b'body' * 1000)
+
+            # Command line tools open it by name
+            with open(handle.name, 'rb') as f:
+                assert f.read() == b'body' * 1000
+
+            mapped = handle.mmap()
+            handle.close()
+
+            assert handle.closed
+            assert mapped[-4:] == b'body'
+
+    def test_discard(self):
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.close()
+
+        SourceHandle.discard(temp_file)
+        assert not os.path.exists(temp_file.name)
+
+        handle = SourceHandle.from_bytes(self.ctx, b'body')
+        SourceHandle.discard(handle)
+        assert handle.closed
@@ -0,0 +1,75 @@
+import base64
+import os
+from tempfile import NamedTemporaryFile
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.source_metadata import SourceMetadata
+
+
+class WikimediaSourceMetadataTest(WikimediaTestCase):
+    def test_parse(self):
+        profile = b'\x00\x00\x02HADBE\x02\x10\x00\x00mntrRGB XYZ '
+
+        metadata = SourceMetadata(
+            {
+                'SourceFile': '/tmp/source',
+                'ImageSize': '1200x800',
+                'Orientation': 6,
+                'FileType': 'JPEG',
+                'ProfileDescription': 'Adobe RGB (1998)',
+                'ICC_Profile': 'base64:' + base64.b64encode(profile).decode(),
+                'Artist': 'Someone',
+            },
+            ['Artist', 'Copyright']
+        )
+
+        assert metadata.size == (1200, 800)
+        assert metadata.orientation == 6
+        assert metadata.rotated
+        assert metadata.ratio == 800 / 1200
+        assert metadata.file_type == 'JPEG'
+        assert metadata.profile_description == 'Adobe RGB (1998)'
+        assert metadata.icc_profile == profile
+        assert metadata.kept_fields == {'Artist': 'Someone'}
+        assert not metadata.has_alpha
+
+    def test_parse_alpha(self):
+        assert SourceMetadata({'ImageSize': '1x1', 'ColorType': 'RGB with Alpha'}).has_alpha
+        assert SourceMetadata({'ImageSize': '1x1', 'WebP_Flags': 'Alpha, EXIF'}).has_alpha
+        assert SourceMetadata({'ImageSize': '1x1', 'Transparency': '(Binary data 1 bytes)'}).has_alpha
+        assert not SourceMetadata({'ImageSize': '1x1', 'ColorType': 'RGB'}).has_alpha
+
+    def test_probe(self):
+        path = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, 'Physical_map_tagged_AdobeRGB.jpg')
+
+        with open(path, 'rb') as f, NamedTemporaryFile() as temp_file:
+            temp_file.write(f.read())
+            temp_file.flush()
+
+            metadata = SourceMetadata.probe(self.ctx, temp_file)
+
+        assert metadata.file_type == 'JPEG'
+        assert metadata.profile_description == 'Adobe RGB (1998)'
+        assert metadata.icc_profile.startswith(b'\x00\x00\x02HADBE')
+
+    def test_pages(self):
+        assert SourceMetadata({'ImageSize': '1x1', 'FileType': 'PDF', 'PageCount': 3}).pages == 3
+        assert SourceMetadata({'ImageSize': '1x1', 'FileType': 'JPEG'}).pages == 1
+        assert SourceMetadata({'ImageSize': '1x1', 'FileType': 'TIFF'}).pages is None
+
+        metadata = SourceMetadata({'ImageSize': '1x1', 'FileType': 'PDF', 'PageCount': 3})
+        assert metadata.page(2) == 2
+        assert metadata.page(3) == 0
+
+        # Unknown page counts are left to the engine
+        assert SourceMetadata({'ImageSize': '1x1', 'FileType': 'TIFF'}).page(7) == 7
+
+    def test_tiff_pages(self):
+        root = self.ctx.config.FILE_LOADER_ROOT_PATH
+
+        assert SourceMetadata.tiff_pages(os.path.join(root, 'International_Convention_for_Regulation_of_Whaling.tiff')) == 3
+        assert SourceMetadata.tiff_pages(os.path.join(root, '0729.tiff')) == 1
+        assert SourceMetadata.tiff_pages(os.path.join(root, 'Physical_map_tagged_AdobeRGB.jpg')) is None
+
+        # Counted without exiftool
+        assert SourceMetadata.page_count(self.ctx, os.path.join(root, '0729.tiff')) == 1
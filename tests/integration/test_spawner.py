@@ -0,0 +1,117 @@
+import datetime
+import os
+
+import pytest
+from tornado.testing import gen_test
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.shell_runner import ShellRunner, CommandTimeoutError
+from wikimedia_thumbor.spawner import Spawner, SpawnedPopen
+
+
+class WikimediaSpawnerTest(WikimediaTestCase):
+    def get_config(self):
+        cfg = super(WikimediaSpawnerTest, self).get_config()
+        cfg.SUBPROCESS_SPAWNER = True
+
+        return cfg
+
+    def setUp(self):
+        super(WikimediaSpawnerTest, self).setUp()
+        # Done by the first request of the worker
+        self._app.start_worker()
+
+    def tearDown(self):
+        Spawner.stop()
+        super(WikimediaSpawnerTest, self).tearDown()
+
+    def test_spawner_running(self):
+        assert Spawner.running()
+
+        proc = ShellRunner.popen(['true'], self.ctx)
+        proc.communicate()
+
+        assert isinstance(proc, SpawnedPopen)
+        assert proc.returncode == 0
+
+    def test_spawner_per_worker(self):
+        helper = Spawner.process.pid
+
+        # A worker forked from this one would start its own helper
+        pid = os.fork()
+
+        if pid == 0:  # pragma: no cover
+            Spawner.stop()
+            os._exit(0 if not Spawner.running() else 1)
+
+        assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+        assert Spawner.running()
+        assert Spawner.process.pid == helper
+
+    def test_command(self):
+        returncode, stderr, stdout = ShellRunner.command(
+            ['sh', '-c', 'echo hello; echo warning >&2; exit 3'],
+            self.ctx
+        )
+
+        assert returncode == 3
+        assert stdout == b'hello\n'
+        assert stderr == b'warning\n'
+
+        usage = ShellRunner.usage(self.ctx)['sh']
+        assert usage['maxrss'] > 0
+
+    def test_command_env(self):
+        returncode, stderr, stdout = ShellRunner.command(
+            ['sh', '-c', 'echo $LC_ALL'],
+            self.ctx,
+            env={'LC_ALL': 'fr'}
+        )
+
+        assert stdout == b'fr\n'
+
+    def test_command_not_found(self):
+        returncode, stderr, stdout = ShellRunner.command(['wrong/path'], self.ctx)
+
+        assert returncode == 127
+        assert b'wrong/path' in stderr
+
+    def test_command_timeout_kills_process_group(self):
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.5
+        self.ctx.config.SUBPROCESS_TIMEOUT_KILL_AFTER = 0.5
+
+        start = datetime.datetime.now()
+
+        with pytest.raises(CommandTimeoutError):
+            ShellRunner.command(['sh', '-c', 'trap "" TERM; sleep 5; echo done'], self.ctx)
+
+        assert (datetime.datetime.now() - start).total_seconds() < 5
+
+    @gen_test
+    async def test_command_async(self):
+        returncode, stderr, stdout = await ShellRunner.command_async(
+            ['echo', 'hello'],
+            self.ctx
+        )
+
+        assert returncode == 0
+        assert stdout == b'hello\n'
+
+    def test_pipeline(self):
+        returncode, stderr, stdout = ShellRunner.pipeline(
+            [
+                ['echo', 'hello'],
+                ['tr', 'a-z', 'A-Z'],
+            ],
+            self.ctx
+        )
+
+        assert returncode == 0
+        assert stdout == b'HELLO\n'
+
+    def test_fallback(self):
+        Spawner.stop()
+
+        returncode, stderr, stdout = ShellRunner.command(['echo', 'hello'], self.ctx)
+
+        assert stdout == b'hello\n'
@@ -1,12 +1,18 @@
+import io
 import os
 from swiftclient.client import Connection
 from swiftclient.exceptions import ClientException
+from PIL import Image
 from thumbor.config import Config
+from tornado import gen
+from tornado.httputil import HTTPHeaders
 from tornado.simple_httpclient import SimpleAsyncHTTPClient
 from tornado.httpclient import HTTPResponse
+from tornado.testing import gen_test
 
 
 from . import WikimediaTestCase
+from wikimedia_thumbor.result_storage.swift import Storage
 
 
 class WikimediaSwiftTestCase(WikimediaTestCase):
@@ -141,3 +147,131 @@ class WikimediaSwiftTestCase(WikimediaTestCase):
         self.fetch(
             '/wikipedia/en/thumb/d/d3/1Mcolors.png/400px-1Mcolors.png'
         )
+
+
+class WikimediaSwiftSizeLadderTestCase(WikimediaSwiftTestCase):
+    def setUp(self):
+        super(WikimediaSwiftSizeLadderTestCase, self).setUp()
+
+        # The test client goes through the same HTTP client as the loader
+        mocked_fetch_impl = SimpleAsyncHTTPClient.fetch_impl
+        original_fetch_impl = self.original_fetch_impl
+        local_url = self.get_url('/')
+
+        def fetch_impl(client, request, callback):
+            if request.url.startswith(local_url):
+                return original_fetch_impl(client, request, callback)
+
+            return mocked_fetch_impl(client, request, callback)
+
+        SimpleAsyncHTTPClient.fetch_impl = fetch_impl
+
+        self.put_objects = {}
+        self.put_content_types = {}
+
+    def get_config(self):
+        swift_cfg = super(WikimediaSwiftSizeLadderTestCase, self).get_config()
+
+        # Rendered by the engines, rather than thumbor's default one
+        cfg = WikimediaTestCase.get_config(self)
+
+        for option in (
+            'RESULT_STORAGE', 'RESULT_STORAGE_STORES_UNSAFE', 'SWIFT_HOST', 'SWIFT_API_PATH',
+            'SWIFT_AUTH_PATH', 'SWIFT_USER', 'SWIFT_KEY', 'SWIFT_SHARDED_CONTAINERS',
+            'SWIFT_PATH_PREFIX', 'SWIFT_CONNECTION_TIMEOUT', 'SWIFT_RETRIES', 'LOADER',
+            'PROXY_LOADER_LOADERS', 'SWIFT_THUMBNAIL_EXPIRY_SECONDS',
+            'SWIFT_THUMBNAIL_EXPIRY_SAMPLING_FACTOR'
+        ):
+            setattr(cfg, option, getattr(swift_cfg, option))
+
+        cfg.COMMUNITY_EXTENSIONS = [
+            'wikimedia_thumbor.handler.images',
+            'wikimedia_thumbor.handler.ladder'
+        ]
+        cfg.SIZE_LADDER_WIDTHS = [120, 250, 400, 2000]
+
+        return cfg
+
+    def mock_put_object(self, container, obj, contents, content_length=None,
+                        etag=None, chunk_size=None, content_type=None,
+                        headers=None, query_string=None, response_dict=None):
+        self.put_object_calls += 1
+        self.put_objects[obj] = contents
+        self.put_content_types[obj] = content_type
+
+        assert container == 'wikipedia-en-local-thumb.d3', \
+            'Unexpected swift container: %r' % container
+        assert headers == {'Content-Disposition': 'inline;filename*=UTF-8\'\'1Mcolors.png', 'Xkey': 'File:1Mcolors.png', 'X-Delete-After': 60}, \
+            'Unexpected swift headers: %r' % headers
+
+    def mock_get_object(self, container, obj, resp_chunk_size=None,
+                        query_string=None, response_dict=None, headers=None):
+        self.get_object_calls += 1
+
+        if container == 'wikipedia-en-local-thumb.d3':
+            raise ClientException('Object not found')
+
+        assert container == 'wikipedia-en-local-public.d3', \
+            'Unexpected swift container: %r' % container
+        assert obj == 'd/d3/1Mcolors.png', \
+            'Unexpected swift obj: %r' % obj
+
+        path = os.path.join(
+            os.path.dirname(__file__),
+            'originals',
+            '1Mcolors.png'
+        )
+        with open(path, 'rb') as f:
+            return {}, f.read()
+
+    def test_size_ladder(self):
+        result = self.fetch(
+            '/ladder/wikipedia/en/thumb/d/d3/1Mcolors.png/400px-1Mcolors.png?widths=120,250,999,2000'
+        )
+
+        assert result.code == 200, 'Unexpected response: %r' % result.code
+        assert Image.open(result.buffer).size == (400, 400)
+
+        # Results are stored once the response has been sent
+        for attempt in range(50):
+            if len(self.put_objects) >= 3:
+                break
+
+            self.io_loop.run_sync(lambda: gen.sleep(0.1))
+
+        # Widths that aren't configured, or larger than the original, are ignored
+        assert sorted(self.put_objects) == [
+            'thumbor/d/d3/1Mcolors.png/120px-1Mcolors.png',
+            'thumbor/d/d3/1Mcolors.png/250px-1Mcolors.png',
+            'thumbor/d/d3/1Mcolors.png/400px-1Mcolors.png',
+        ]
+
+        for width in (120, 250):
+            ladder = Image.open(io.BytesIO(self.put_objects['thumbor/d/d3/1Mcolors.png/%dpx-1Mcolors.png' % width]))
+            assert ladder.size == (width, width)
+
+    @gen_test
+    async def test_put(self):
+        class RequestHandler:
+            _headers = HTTPHeaders({
+                'Content-Type': 'image/png',
+                'Content-Disposition': 'inline;filename*=UTF-8\'\'1Mcolors.png',
+                'Xkey': 'File:1Mcolors.png',
+            })
+
+        self.ctx.private = False
+        self.ctx.request_handler = RequestHandler()
+        self.ctx.wikimedia_thumbnail_container = 'wikipedia-en-local-thumb.d3'
+        self.ctx.wikimedia_thumbnail_save_path = 'thumbor/d/d3/1Mcolors.png/400px-1Mcolors.png'
+        self.ctx.wikimedia_size_ladder_results = {250: b'250px', 120: b'120px'}
+
+        await Storage(self.ctx).put(b'400px')
+
+        # The requested width, then every ladder width, with the same headers
+        assert self.put_objects == {
+            'thumbor/d/d3/1Mcolors.png/400px-1Mcolors.png': b'400px',
+            'thumbor/d/d3/1Mcolors.png/120px-1Mcolors.png': b'120px',
+            'thumbor/d/d3/1Mcolors.png/250px-1Mcolors.png': b'250px',
+        }
+        assert list(self.put_objects)[0].endswith('/400px-1Mcolors.png')
+        assert set(self.put_content_types.values()) == {'image/png'}
@@ -0,0 +1,170 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import gen_test
+
+from . import WikimediaTestCase
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena, TempArenaQuotaExceeded
+
+
+class WikimediaTempArenaTest(WikimediaTestCase):
+    def setUp(self):
+        super(WikimediaTempArenaTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.ctx.config.TEMP_ARENA_PATH = self.root
+        self.ctx.config.TEMP_ARENA_MAX_SIZE = None
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(WikimediaTempArenaTest, self).tearDown()
+
+    def test_arena(self):
+        assert TempArena.dir(self.ctx) is None
+
+        self.ctx.wikimedia_temp_arena = arena = TempArena(self.ctx)
+        directory = arena.directory
+
+        assert os.path.dirname(directory) == self.root
+
+        temp_file = TempArena.named_temporary_file(self.ctx, delete=False)
+        temp_file.write(b'a' * 10000)
+        temp_file.close()
+
+        temp_dir = TempArena.mkdtemp(self.ctx)
+
+        assert os.path.dirname(temp_file.name) == directory
+        assert os.path.dirname(temp_dir) == directory
+
+        released = []
+        TempArena.release_later(self.ctx, lambda: released.append(True))
+
+        arena.close()
+        arena.close()
+
+        assert released == [True]
+        assert arena.peak >= 10000
+        assert not os.path.exists(directory)
+        assert TempArena.dir(self.ctx) is None
+
+    def test_quota(self):
+        self.ctx.config.TEMP_ARENA_MAX_SIZE = 8192
+        self.ctx.wikimedia_temp_arena = arena = TempArena(self.ctx)
+
+        with TempArena.named_temporary_file(self.ctx) as temp_file:
+            temp_file.write(b'a' * 10000)
+            temp_file.flush()
+
+            with self.assertRaises(TempArenaQuotaExceeded):
+                TempArena.mkdtemp(self.ctx)
+
+        # Space is given back once the file is gone
+        TempArena.mkdtemp(self.ctx)
+
+        arena.close()
+
+    def test_quota_shared_files(self):
+        self.ctx.config.TEMP_ARENA_MAX_SIZE = 8192
+        self.ctx.wikimedia_temp_arena = arena = TempArena(self.ctx)
+
+        original = os.path.join(self.root, 'original')
+
+        with open(original, 'wb') as f:
+            f.write(b'a' * 10000)
+
+        # Hardlinked, the original doesn't use any more space
+        handle = SourceHandle.link(self.ctx, original)
+        TempArena.mkdtemp(self.ctx)
+
+        # Until the handle is all that's left of it
+        os.unlink(original)
+
+        with self.assertRaises(TempArenaQuotaExceeded):
+            TempArena.mkdtemp(self.ctx)
+
+        handle.close()
+
+        # Reflinks are left out explicitly
+        with TempArena.named_temporary_file(self.ctx) as temp_file:
+            temp_file.write(b'a' * 10000)
+            temp_file.flush()
+
+            TempArena.share(self.ctx, temp_file.name)
+            TempArena.mkdtemp(self.ctx)
+
+        arena.close()
+
+    def test_sweep(self):
+        arena = TempArena(self.ctx)
+
+        worker = subprocess.Popen(['true'])
+        worker.wait()
+
+        dead = os.path.join(self.root, 'arena-%d-abc' % worker.pid)
+        stuck = os.path.join(self.root, 'arena-%d-abc' % os.getppid())
+        recent = os.path.join(self.root, 'arena-%d-def' % os.getppid())
+        other = os.path.join(self.root, 'other')
+
+        for path in (dead, stuck, recent, other):
+            os.mkdir(path)
+
+        past = time.time() - 7200
+        os.utime(stuck, (past, past))
+
+        assert sorted(TempArena.sweep(self.ctx.config)) == sorted([dead, stuck])
+        assert os.path.exists(arena.directory)
+        assert os.path.exists(recent)
+        assert os.path.exists(other)
+
+        # Arenas of this worker that were never torn down
+        arena.close()
+        os.mkdir(os.path.join(self.root, 'arena-%d-ghi' % os.getpid()))
+
+        assert len(TempArena.sweep(self.ctx.config)) == 1
+
+    @gen_test
+    async def test_release_later_off_loop(self):
+        self._app.start_worker()
+        self.ctx.config.HTTP_LOADER_TEMP_FILE_TIMEOUT = 0.1
+
+        released = []
+
+        # Without an arena, from an engine thread
+        await IOLoop.current().run_in_executor(
+            None,
+            TempArena.release_later,
+            self.ctx,
+            lambda: released.append(True)
+        )
+        await gen.sleep(0.3)
+
+        assert released == [True]
+
+    def test_mkdtemp_in(self):
+        tmpfs = tempfile.mkdtemp(dir=self.root)
+        self.ctx.config.VIPS_ENGINE_TEMPORARY_PATH = tmpfs
+        self.ctx.wikimedia_temp_arena = arena = TempArena(self.ctx)
+
+        directory = TempArena.mkdtemp_in(self.ctx, tmpfs)
+
+        assert os.path.dirname(directory) == tmpfs
+        assert os.path.basename(directory).startswith('arena-%d-' % os.getpid())
+
+        # Left alone while in use, swept like arenas otherwise
+        worker = subprocess.Popen(['true'])
+        worker.wait()
+        dead = os.path.join(tmpfs, 'arena-%d-abc' % worker.pid)
+        os.mkdir(dead)
+
+        assert TempArena.sweep(self.ctx.config) == [dead]
+        assert os.path.exists(directory)
+
+        arena.close()
+
+        assert not os.path.exists(directory)
+        assert directory not in TempArena.live
@@ -1,6 +1,13 @@
 import os
+import shutil
+import stat
+import tempfile
+
+from thumbor.loaders import LoaderResult
+from tornado.testing import gen_test
 
 from . import WikimediaTestCase
+from wikimedia_thumbor.loader import video
 
 
 class WikimediaVideoTest(WikimediaTestCase):
@@ -10,6 +17,68 @@ class WikimediaVideoTest(WikimediaTestCase):
 
         return cfg
 
+    def command(self, name, script):
+        path = os.path.join(self.bin, name)
+
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + script)
+
+        os.chmod(path, stat.S_IRWXU)
+
+        return path
+
+    def slow_commands(self, ffprobe, ffmpeg):
+        """Stands in for ffprobe and ffmpeg, with scripts that can take
+        longer than the subprocess timeout."""
+        self.bin = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.bin)
+
+        self.arena = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.arena)
+        self.ctx.config.TEMP_ARENA_PATH = self.arena
+
+        self.ctx.config.SUBPROCESS_TIMEOUT = 0.5
+        self.ctx.config.FFPROBE_PATH = self.command('ffprobe', ffprobe)
+        self.ctx.config.FFMPEG_PATH = self.command('ffmpeg', ffmpeg)
+
+    def arena_files(self):
+        return [files for _, _, files in os.walk(self.arena) if files]
+
+    @gen_test
+    async def test_ffprobe_timeout(self):
+        self.slow_commands('exec sleep 5\n', 'exit 1\n')
+
+        result = await video.load(self.ctx, 'http://localhost/video.webm')
+
+        assert not result.successful
+        assert result.error == LoaderResult.ERROR_TIMEOUT
+
+    @gen_test
+    async def test_ffmpeg_timeout(self):
+        self.slow_commands('echo 10\n', 'exec sleep 5\n')
+
+        result = await video.load(self.ctx, 'http://localhost/video.webm')
+
+        assert not result.successful
+        assert result.error == LoaderResult.ERROR_TIMEOUT
+        assert self.arena_files() == []
+
+    @gen_test
+    async def test_ffmpeg_timeout_with_seek(self):
+        # Seeking times out, the first frame doesn't
+        self.slow_commands(
+            'echo 10\n',
+            '[ "$2" = 0 ] || exec sleep 5\n'
+            'for output; do :; done\n'
+            'echo frame > "$output"\n'
+        )
+
+        result = await video.load(self.ctx, 'http://localhost/video.webm')
+
+        assert result.successful
+        assert result.buffer == b'frame\n'
+        assert self.arena_files() == []
+
     def test_ogv(self):
         path = os.path.join(
             os.path.dirname(__file__),
@@ -1,7 +1,17 @@
 import pytest
 import logging
+import os
+import shutil
+import tempfile
 from shutil import which
+
+from thumbor.context import RequestParameters
+
 from . import WikimediaTestCase
+from .test_header_sniffer import pyramid_tiff
+from wikimedia_thumbor.engine.vips import Engine
+from wikimedia_thumbor.header_sniffer import HeaderSniffer
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 class WikimediaVipsTest(WikimediaTestCase):
@@ -173,6 +183,57 @@ class WikimediaVipsTest(WikimediaTestCase):
             size_tolerance=0.88,
         )
 
+    def test_intermediate_dir(self):
+        engine = Engine(self.ctx)
+        tmpfs = tempfile.mkdtemp()
+
+        try:
+            self.ctx.config.VIPS_ENGINE_TEMPORARY_PATH = tmpfs
+            self.ctx.wikimedia_temp_arena = arena = TempArena(self.ctx)
+
+            temp_dir = engine.intermediate_dir()
+            assert os.path.dirname(temp_dir) == tmpfs
+
+            # Named like arenas, for the sweeper
+            assert os.path.basename(temp_dir).startswith(TempArena.prefix)
+
+            # Left behind by a failed request
+            arena.close()
+            assert not os.path.exists(temp_dir)
+
+            self.ctx.config.VIPS_ENGINE_TEMPORARY_PATH = None
+            assert os.path.dirname(engine.intermediate_dir()) == tempfile.gettempdir()
+        finally:
+            shutil.rmtree(tmpfs)
+
+    def test_pyramid_level(self):
+        engine = Engine(self.ctx)
+        engine.source = '/tmp/source_file'
+        self.ctx.vips = {
+            'width': 4000,
+            'height': 3000,
+            'pages': 3,
+            'levels': HeaderSniffer.sniff(pyramid_tiff()).levels,
+        }
+
+        def select(width, height=0, page=1):
+            self.ctx.request = RequestParameters(width=width, height=height)
+            self.ctx.request.page = page
+            return engine.select_source()
+
+        assert select(400) == ('/tmp/source_file[subifd=0]', 1000)
+        assert select(1000, 800) == ('/tmp/source_file[page=1]', 2000)
+        assert select(3000) == ('/tmp/source_file', 4000)
+        assert select(400, page=3) == ('/tmp/source_file[page=2]', 800)
+
+        # Out of range pages get the first one
+        assert select(400, page=5) == ('/tmp/source_file[subifd=0]', 1000)
+
+        # Without levels, the page is loaded at full resolution
+        self.ctx.vips['levels'] = None
+        engine.source = os.path.join(self.ctx.config.FILE_LOADER_ROOT_PATH, '0729.tiff')
+        assert select(400, page=2) == (engine.source, 5174)
+
     @pytest.mark.usefixtures("inject_fixtures")
     def test_vips_commanderror_raise(self):
         with self.caplog.at_level(logging.ERROR):
@@ -181,3 +242,26 @@ class WikimediaVipsTest(WikimediaTestCase):
 
             assert result.code == 500
             assert "CommandError: ([\'wrong/path\'" in self.caplog.text
+
+
+class WikimediaVipsThumbnailTest(WikimediaVipsTest):
+    def get_config(self):
+        cfg = super(WikimediaVipsThumbnailTest, self).get_config()
+        cfg.VIPS_ENGINE_THUMBNAIL = True
+
+        return cfg
+
+    def test_thumbnail_arguments(self):
+        engine = Engine(self.ctx)
+        self.ctx.request = RequestParameters(width=400, height=0)
+        self.ctx.vips = {'width': 6000, 'height': 4000, 'pages': 1}
+
+        assert engine.thumbnail_arguments() == ['400', '--size', 'down', '--export-profile', 'srgb']
+
+        self.ctx.request = RequestParameters(width=0, height=300)
+        assert engine.thumbnail_arguments()[:3] == ['6000', '--height', '300']
+
+        # Cropped, or not shrunk
+        for width, height in ((400, 300), (8000, 0)):
+            self.ctx.request = RequestParameters(width=width, height=height)
+            assert engine.thumbnail_arguments() is None
@@ -6,11 +6,13 @@
 # Copyright (c) 2016 Wikimedia Foundation
 
 import manhole
+import os
 import os.path
 import tempfile
 from shutil import which
 
 import thumbor.engines
+import tornado.ioloop
 
 from thumbor.utils import logger
 
@@ -18,6 +20,11 @@ from thumbor.handlers import ContextHandler
 from tc_core import Extensions
 from tc_core.app import App as CommunityCoreApp
 
+from wikimedia_thumbor.engine.proxy import Engine as ProxyEngine
+from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.spawner import Spawner
+from wikimedia_thumbor.temp_arena import TempArena
+
 
 class App(CommunityCoreApp):
     def __init__(self, context):
@@ -38,8 +45,44 @@ class App(CommunityCoreApp):
         # imagemagick engine instead.
         thumbor.engines.METADATA_AVAILABLE = False
 
+        # Imports the proxied engines and indexes them by extension once,
+        # rather than on the first request
+        if context.config.get("PROXY_ENGINE_ENGINES", None):
+            ProxyEngine.dispatch(context.config.PROXY_ENGINE_ENGINES)
+
+        # Thumbor forks its workers after creating the app, see start_worker
+        self.worker_pid = None
+        self.sweeper = None
+
         super(App, self).__init__(context)
 
+    def start_worker(self):
+        """Sets up the current worker process, on its IOLoop. Runs on the
+        first request the worker handles."""
+        if self.worker_pid == os.getpid():
+            return
+
+        self.worker_pid = os.getpid()
+
+        # Lets engines, loaded outside of the IOLoop, run their commands on
+        # it, see ShellRunner.command
+        ShellRunner.io_loop = tornado.ioloop.IOLoop.current()
+
+        config = self.context.config
+
+        # Each worker gets its own helper
+        if config.get("SUBPROCESS_SPAWNER", False) and not Spawner.running():
+            Spawner.start(config.get("SUBPROCESS_CGROUP_TASKS_PATH", None))
+
+        # Removes the temporary files of crashed workers, on this worker's
+        # IOLoop
+        self.sweeper = TempArena.start_sweeper(config)
+
+    def find_handler(self, request, **kwargs):
+        self.start_worker()
+
+        return super(App, self).find_handler(request, **kwargs)
+
     # We override this to avoid the catch-all ImagingHandler from
     # Thumbor which prevents us from 404ing properly on completely
     # broken URLs.
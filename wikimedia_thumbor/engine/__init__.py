@@ -14,12 +14,13 @@
 import shutil
 import os
 
-from tempfile import mkdtemp
 from thumbor.utils import logger
 
 from wikimedia_thumbor.shell_runner import ShellRunner
 from wikimedia_thumbor.engine.imagemagick import Engine as IMEngine
 from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 class CommandError(Exception):
@@ -42,21 +43,24 @@ class BaseWikimediaEngine(IMEngine):
     def prepare_source(self, buffer):
         if hasattr(self.context, 'wikimedia_original_file'):
             self.debug('[BWE] Found source file in context')
-            self.source = self.context.wikimedia_original_file.name
+            self.source_handle = self.context.wikimedia_original_file
+            self.source = self.source_handle.name
             del self.context.wikimedia_original_file
             return
 
         self.debug('[BWE] Create source file from buffer')
         # Put temp files into their own temp folder to avoid
         # exploits where converters might access other files in the same folder
-        self.temp_dir = mkdtemp()
+        self.temp_dir = TempArena.mkdtemp(self.context)
         self.source = os.path.join(self.temp_dir, 'source_file')
 
         with open(self.source, 'wb') as source:
             source.write(buffer)
 
     def cleanup_source(self):
-        if hasattr(self, 'source'):
+        if hasattr(self, 'source_handle'):
+            SourceHandle.discard(self.source_handle)
+        elif hasattr(self, 'source'):
             ShellRunner.rm_f(self.source)
         if hasattr(self, 'temp_dir'):
             shutil.rmtree(self.temp_dir, True)
@@ -83,5 +87,47 @@ class BaseWikimediaEngine(IMEngine):
 
         return stdout
 
+    def pipeline(self, commands, env=None, clean_on_error=True, clean_on_success=True):
+        """Runs commands piped into each other and streams the output of the
+        last one into a temp file, which is returned closed along with the
+        stderr of the commands."""
+        output = TempArena.named_temporary_file(self.context, delete=False)
+
+        try:
+            returncode, stderr, stdout = ShellRunner.pipeline(
+                commands,
+                self.context,
+                env=env,
+                stdout=output
+            )
+        except Exception:
+            ShellRunner.rm_f(output.name)
+            if clean_on_error:
+                self.cleanup_source()
+            raise
+        finally:
+            output.close()
+
+        if returncode != 0:
+            ShellRunner.rm_f(output.name)
+            if clean_on_error:
+                self.cleanup_source()
+            # Reported the way a shell would show the pipeline
+            command = commands[0]
+            for next_command in commands[1:]:
+                command = command + ['|'] + next_command
+
+            raise CommandError(
+                command,
+                stdout,
+                stderr,
+                returncode
+            )
+
+        if clean_on_success:
+            self.cleanup_source()
+
+        return output, stderr
+
     def debug(self, message):
         logger.debug(message, extra=log_extra(self.context))
@@ -17,7 +17,9 @@ from wikimedia_thumbor.engine import BaseWikimediaEngine
 BaseWikimediaEngine.add_format(
     'image/vnd.djvu',
     '.djvu',
-    lambda buffer: buffer[4:8] == b'FORM' and buffer[12:16] in (b'DJVU', b'DJVM', b'PM44', b'BM44')
+    lambda buffer: buffer[12:16] in (b'DJVU', b'DJVM', b'PM44', b'BM44'),
+    magic=b'FORM',
+    offset=4
 )
 
 
@@ -38,6 +40,8 @@ class Engine(BaseWikimediaEngine):
             '-'
         ]
 
-        ppm = self.command(command)
+        # Full-resolution pages can weigh hundreds of MB as PPM, they're
+        # streamed to disk rather than read back
+        ppm, stderr = self.pipeline([command])
 
-        return super(Engine, self).create_image(ppm)
+        return self.open_image(ppm)
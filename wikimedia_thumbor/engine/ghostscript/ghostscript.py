@@ -11,15 +11,14 @@
 
 # Ghostscript engine
 
-from wikimedia_thumbor.engine import BaseWikimediaEngine, CommandError
+import os
+
+from wikimedia_thumbor.engine import BaseWikimediaEngine
 from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.source_metadata import SourceMetadata
 
 
-BaseWikimediaEngine.add_format(
-    "application/pdf",
-    ".pdf",
-    lambda buffer: buffer[:4] == b'%PDF'
-)
+BaseWikimediaEngine.add_format("application/pdf", ".pdf", magic=b'%PDF')
 
 
 class Engine(BaseWikimediaEngine):
@@ -33,19 +32,30 @@ class Engine(BaseWikimediaEngine):
 
         self.prepare_source(buffer)
 
+        # Out of range pages get the first one, without rendering them first
+        pages = None
+
+        if page > 1:
+            pages = SourceMetadata.page_count(self.context, self.source)
+            self.debug('[GS] Page count: %r' % pages)
+
+            if pages is not None and page > pages:
+                page = 1
+
         jpg, stderr = self.get_jpg_for_page(buffer, page, dpi)
 
         # GS is being unhelpful and outputting that error to stderr
         # with a 0 exit status
         error = b'No pages will be processed (FirstPage > LastPage)'
-        if len(jpg) < 200 and stderr.find(error) != -1:
+        if pages is None and os.path.getsize(jpg.name) < 200 and stderr.find(error) != -1:
+            ShellRunner.rm_f(jpg.name)
             jpg, stderr = self.get_jpg_for_page(buffer, 1, dpi)
 
         self.cleanup_source()
 
         self.extension = ".jpg"
 
-        return super(Engine, self).create_image(jpg)
+        return self.open_image(jpg)
 
     def get_jpg_for_page(self, buffer, page, dpi):
         # We use the command and not the python bindings because those can't
@@ -54,6 +64,7 @@ class Engine(BaseWikimediaEngine):
         # bindings' set_stdio().
         # Using the bindings would therefore force us to use a second temporary
         # file for the destination.
+        # %stdout is streamed straight into the file ImageMagick reads from.
         command = [
             self.context.config.GHOSTSCRIPT_PATH,
             "-sDEVICE=jpeg",
@@ -71,8 +82,4 @@ class Engine(BaseWikimediaEngine):
             "-f%s" % self.source,
         ]
 
-        returncode, stderr, stdout = ShellRunner.command(command, self.context)
-        if returncode != 0:
-            raise CommandError(command, stdout, stderr, returncode)
-
-        return stdout, stderr
+        return self.pipeline([command], clean_on_success=False)
@@ -13,16 +13,13 @@
 # This makes GIF handling compatible with the wikimedia https loader
 # Actual processing is handled by the Thumbor built-in gifsicle-based engine
 
+import mmap
+
 from thumbor.engines.gif import Engine as BaseEngine
 from thumbor.utils import logger
 from wikimedia_thumbor.engine import BaseWikimediaEngine
-from wikimedia_thumbor.shell_runner import ShellRunner
 
-BaseWikimediaEngine.add_format(
-    'image/gif',
-    '.gif',
-    lambda buffer: buffer[:4] == b'GIF8'
-)
+BaseWikimediaEngine.add_format('image/gif', '.gif', magic=b'GIF8')
 
 
 class Engine(BaseEngine):
@@ -38,10 +35,11 @@ class Engine(BaseEngine):
 
     def load(self, buffer, extension):
         if hasattr(self.context, 'wikimedia_original_file'):
-            fname = self.context.wikimedia_original_file.name
-            with open(fname, 'rb') as content_file:
-                buffer = content_file.read()
-            ShellRunner.rm_f(fname)
+            # Gifsicle reads the mapping straight from the page cache
+            handle = self.context.wikimedia_original_file
+            buffer = handle.mmap()
+            handle.close()
+            del self.context.wikimedia_original_file
 
         super(Engine, self).load(buffer, extension)
 
@@ -53,3 +51,15 @@ class Engine(BaseEngine):
             if self.frame_count > 1 and self.image_size[0] * self.image_size[1] * self.frame_count > config.MAX_ANIMATED_GIF_AREA:
                 logger.debug('[GIF] GIF is animated and greater than max animated area, keeping first frame')
                 self.operations.append("#0")
+
+    def flush_operations(self, update_image=True):
+        buffer = super(Engine, self).flush_operations(update_image)
+
+        # Without any operation, this is still the mapped original
+        if isinstance(buffer, mmap.mmap):
+            buffer = buffer[:]
+
+            if update_image:
+                self.buffer = buffer
+
+        return buffer
@@ -11,9 +11,7 @@
 
 # ImageMagick engine
 
-import json
-from tempfile import NamedTemporaryFile
-from pyexiv2 import ImageMetadata, ExifValueError
+import math
 
 from thumbor.utils import logger
 from thumbor.engines import BaseEngine
@@ -21,6 +19,14 @@ from thumbor.engines import BaseEngine
 from wikimedia_thumbor.shell_runner import ShellRunner
 from wikimedia_thumbor.exiftool_runner import ExiftoolRunner
 from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.mime_sniffer import MimeSniffer
+from wikimedia_thumbor.source_metadata import SourceMetadata
+from wikimedia_thumbor.metadata_writer import MetadataWriter, UnsupportedMetadata
+from wikimedia_thumbor.icc_cache import IccProfileCache
+from wikimedia_thumbor.operations import OperationGraph, Raw, Resize, Crop, Orient, Rotate, Unsharp
+from wikimedia_thumbor.size_ladder import SizeLadder
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
 from decimal import Decimal, ROUND_HALF_DOWN
 
 
@@ -32,131 +38,97 @@ class Engine(BaseEngine):
     exiftool = ExiftoolRunner()
 
     @classmethod
-    def add_format(cls, mime, ext, fn):
-        # Unfortunately there is no elegant way to extend Thumbor to support
-        # a new MIME type, which is why this monkey-patching is done here
+    def add_format(cls, mime, ext, fn=None, **signature):
+        # Thumbor has no way to register a new MIME type, its extension is
+        # added here and detection goes through MimeSniffer.register
         from thumbor.utils import EXTENSION
         EXTENSION[mime] = ext
-        from thumbor.engines import BaseEngine
-        old_get_mimetype = BaseEngine.get_mimetype
-
-        @classmethod
-        def new_get_mimetype(cls, buffer):
-            if fn(buffer):
-                return mime
-
-            return old_get_mimetype(buffer)
-
-        BaseEngine.get_mimetype = new_get_mimetype
+        MimeSniffer.register(mime, test=fn, **signature)
 
     def create_image(self, buffer):
-        # This should be enough for now, if memory blows up on huge files we
-        # can could use an mmap here
         if hasattr(self.context, 'wikimedia_original_file'):
             self.debug('[IM] Grabbing filename from context')
             temp_file = self.context.wikimedia_original_file
         else:
             self.debug('[IM] Dumping buffer into temp file')
-            temp_file = NamedTemporaryFile(delete=False)
+            temp_file = TempArena.named_temporary_file(self.context, delete=False)
             temp_file.write(buffer)
             temp_file.close()
 
-        self.exif_dict = {}
-        self.operators = []
+        return self.open_image(temp_file)
+
+    def open_image(self, temp_file):
+        # Engines that convert their source with another tool first hand
+        # the converted file over directly, rather than a buffer
+        self.operations = OperationGraph()
 
         try:
             self.page = self.context.request.page - 1
         except AttributeError:
             self.page = 0
 
-        # Read EXIF data from file first. This will get us the
+        # Read metadata from file first. This will get us the
         # size if we need it for the jpeg:size option, as well as the
-        # ICC profile name in case we need to do profile swapping and
+        # ICC profile in case we need to do profile swapping and
         # the various EXIF fields we want to keep
         self.read_exif(temp_file)
 
-        return temp_file
-
-    def jpeg_size(self):
-        exif_image_size = self.exif_dict['ImageSize']
-        buffer_size = exif_image_size.split('x')
-        buffer_size = [float(x) for x in buffer_size]
-        buffer_ratio = buffer_size[0] / buffer_size[1]
-
-        if 'Pyexiv2Orientation' in self.exif_dict:
-            if self.exif_dict['Pyexiv2Orientation'] in (6, 8):
-                buffer_ratio = buffer_size[1] / buffer_size[0]
-
-        # If the JPEG size hint is too close to the target size,
-        # We can end up with rounding errors on the final output size,
-        # with width being different than the requested width.
-        # Therefore, we make the hint twice the target size
+        # Out of range pages get the cover, without trying them first
+        self.page = self.source_metadata.page(self.page)
 
-        width = self.context.request.width * 2
-        height = self.context.request.height * 2
-
-        if width == 0:
-            width = Decimal(height * buffer_ratio).quantize(0, ROUND_HALF_DOWN)
+        return temp_file
 
-        if height == 0:
-            height = Decimal(width / buffer_ratio).quantize(0, ROUND_HALF_DOWN)
+    # libjpeg-turbo decodes JPEGs at M/8 of their size, straight from the
+    # DCT coefficients. ImageMagick asks for 1/N, which libjpeg rounds up to
+    # the nearest M/8, so only these denominators are worth trying.
+    jpeg_scale_denominators = (8, 4, 3, 2)
 
-        jpeg_size = '%dx%d' % (width, height)
-        self.debug('[IM] jpeg:size hint: %r' % jpeg_size)
+    @classmethod
+    def jpeg_scale(cls, source_size, target_size):
+        """The largest 1/N to decode source_size at while staying at least
+        as large as target_size, both in stored orientation."""
+        for denominator in cls.jpeg_scale_denominators:
+            numerator = math.ceil(8 / denominator)
+
+            if all(
+                math.ceil(source * numerator / 8) >= target
+                for source, target in zip(source_size, target_size)
+            ):
+                return denominator
+
+        return 1
+
+    def jpeg_size(self, target_size):
+        """The jpeg:size hint making ImageMagick decode straight to the
+        smallest size larger than target_size, given once oriented. The
+        resize then only has a small resample left to do."""
+        if self.source_metadata.size is None:
+            return None
+
+        width, height = target_size
+
+        # The hint applies to the stored image, before it gets oriented
+        if self.source_metadata.rotated:
+            width, height = height, width
+
+        source_width, source_height = self.source_metadata.size
+        denominator = self.jpeg_scale((source_width, source_height), (width, height))
+
+        # ImageMagick picks floor(source / hint) as N
+        jpeg_size = (
+            max(1, source_width // denominator),
+            max(1, source_height // denominator)
+        )
+        self.debug('[IM] jpeg:size hint: %r (1/%d)' % (jpeg_size, denominator))
         return jpeg_size
 
     def read_exif(self, input_temp_file):
-        fields = [
-            'ImageSize',
-            'ProfileDescription',
-            'ColorType',
-            'WebP_Flags',
-            'FileType',
-            'Transparency'
-        ]
-
-        fields += self.context.config.EXIF_FIELDS_TO_KEEP
-
-        command = [
-            '-j'
-        ]
-
-        command += ['-{0}'.format(i) for i in fields]
-
-        # T172556 We read EXIF Orientation with pyexiv2 because exiftool is
-        # unreliable for that field (overzealous in the way it interprets the field).
-        # We can't replace all use of exiftool with pyexiv2 because ICC profile
-        # support was only introduced in exiv2 0.26 (not available on Jessie yet)
-        # and it can only extract the ICC profile, not get its name/description upfront.
-        # Which would make the sRGB replacement more difficult (it's unclear how many
-        # variations of the binary content for that family of profiles there are).
+        self.source_metadata = SourceMetadata.probe(self.context, input_temp_file)
 
-        metadata = ImageMetadata(input_temp_file.name)
-        try:
-            metadata.read()
-
-            if 'Exif.Image.Orientation' in metadata.exif_keys:
-                # Distinctive key name to avoid colliding with EXIF_FIELDS_TO_KEEP
-                self.exif_dict['Pyexiv2Orientation'] = metadata.get('Exif.Image.Orientation').value
-        except (IOError, ExifValueError, TypeError, ValueError):
-            # T381594: py3exiv2 can be more picky about some things than the other tools,
-            # but we can safely ignore all exceptions from it because we only use it
-            # for Orientation.
-            self.debug('[IM] Could not read EXIF with py3exiv2')
-
-        stdout = Engine.exiftool.command(
-            context=self.context,
-            pre=command,
-            input_temp_file=input_temp_file
-        )
-
-        # index at 0 because we're processing a single file
-        self.exif_dict.update(json.loads(stdout.decode('utf-8'))[0])
+        self.debug('[IM] Metadata: %r' % self.source_metadata)
 
-        self.debug('[IM] EXIF: %r' % self.exif_dict)
-
-        if 'ImageSize' in self.exif_dict:
-            self.internal_size = [int(x) for x in self.exif_dict['ImageSize'].split('x')]
+        if self.source_metadata.size is not None:
+            self.internal_size = list(self.source_metadata.size)
         else:
             # Have not been able to find a test file where that EXIF field comes up unpopulated
             self.internal_size = (1, 1)  # pragma: no cover
@@ -164,12 +136,12 @@ class Engine(BaseEngine):
         # If we encounter any non-sRGB ICC profile, we save it to re-apply
         # it to the result
 
-        if 'ProfileDescription' not in self.exif_dict:
+        if self.source_metadata.profile_description is None:
             self.debug('[IM] File has no ICC profile')
             return
 
         expected_profile = self.context.config.EXIF_TINYRGB_ICC_REPLACE.lower()
-        profile = self.exif_dict['ProfileDescription'].lower()
+        profile = self.source_metadata.profile_description.lower()
 
         if profile == expected_profile:
             self.icc_profile_path = self.context.config.EXIF_TINYRGB_PATH
@@ -178,41 +150,57 @@ class Engine(BaseEngine):
 
         self.debug('[IM] File has non-sRGB profile')
 
-        command = [
-            '-icc_profile',
-            '-b',
-        ]
-
-        self.icc_profile_saved = Engine.exiftool.command(
-            context=self.context,
-            pre=command,
-            input_temp_file=input_temp_file
-        )
+        if self.source_metadata.icc_profile is not None:
+            self.icc_profile_saved = self.source_metadata.icc_profile
 
     def process_exif(self, buffer):
         self.debug('[IM] Processing EXIF')
 
+        if hasattr(self, 'icc_profile_saved'):
+            icc_profile = self.icc_profile_saved
+        elif hasattr(self, 'icc_profile_path'):
+            with open(self.icc_profile_path, 'rb') as profile_file:
+                icc_profile = profile_file.read()
+        else:
+            icc_profile = None
+
+        try:
+            return MetadataWriter.rewrite(
+                buffer,
+                icc_profile,
+                self.source_metadata.kept_fields
+            )
+        except UnsupportedMetadata as e:
+            self.debug('[IM] Falling back to exiftool for EXIF: %s' % e)
+
+        return self.process_exif_with_exiftool(buffer)
+
+    def process_exif_with_exiftool(self, buffer):
         command = [
             '-all=',  # Strip all existing metadata
         ]
 
-        # Create the temp file when we need it
+        profile_temp_path = None
+
         if hasattr(self, 'icc_profile_saved'):
-            self.debug('[IM] Putting saved ICC profile into temp file')
-            profile_file = NamedTemporaryFile(delete=False)
-            profile_file.write(self.icc_profile_saved)
-            profile_file.close()
-            self.icc_profile_path = profile_file.name
-            del self.icc_profile_saved
+            if IccProfileCache.enabled(self.context):
+                icc_profile_path = IccProfileCache.path(self.context, self.icc_profile_saved)
+            else:
+                # Create the temp file when we need it
+                self.debug('[IM] Putting saved ICC profile into temp file')
+                profile_file = TempArena.named_temporary_file(self.context, delete=False)
+                profile_file.write(self.icc_profile_saved)
+                profile_file.close()
+                icc_profile_path = profile_temp_path = profile_file.name
+        else:
+            icc_profile_path = getattr(self, 'icc_profile_path', None)
 
         # Copy the ICC profile
-        if hasattr(self, 'icc_profile_path'):
-            command += ['-icc_profile<=%s' % self.icc_profile_path]
+        if icc_profile_path is not None:
+            command += ['-icc_profile<=%s' % icc_profile_path]
 
-        for field in self.context.config.EXIF_FIELDS_TO_KEEP:
-            if field in self.exif_dict:
-                value = self.exif_dict[field]
-                command += ['-%s=%s' % (field, value)]
+        for field, value in self.source_metadata.kept_fields.items():
+            command += ['-%s=%s' % (field, value)]
 
         postCommand = [
             '-o',
@@ -226,34 +214,24 @@ class Engine(BaseEngine):
             buffer=buffer
         )
 
-        tinyrgb_path = self.context.config.EXIF_TINYRGB_PATH
-
         # Clean up saved non-sRGB profile if needed
-        if (hasattr(self, 'icc_profile_path')
-                and self.icc_profile_path != tinyrgb_path):
-            ShellRunner.rm_f(self.icc_profile_path)
-            del self.icc_profile_path
+        if profile_temp_path is not None:
+            ShellRunner.rm_f(profile_temp_path)
 
         return stdout
 
     def process_read_parameters(self, extension, quality):
         extension = extension.lstrip('.')
-        original_quality = quality
-
-        if extension == 'webp':
-            lossless = ('FileType' in self.exif_dict and self.exif_dict['FileType'] in ['SVG', 'PNG'])
-
-            # We need to use a JPG as an intermediary for WebP conversion in order to
-            # be able to apply the EXIF filtering
-            if 'FileType' in self.exif_dict and self.exif_dict['FileType'] == 'JPEG':
-                extension = 'jpg'
-                quality = 100
-            else:
-                extension = 'png32'
 
-            self.webp = {'quality': original_quality, 'lossless': lossless}
-        else:
-            self.webp = False
+        # WebP is written directly, its metadata is filtered afterwards
+        # like for JPG
+        if extension == 'webp' and self.source_metadata.file_type in ['SVG', 'PNG']:
+            self.queue_operators([
+                '-define',
+                'webp:lossless=true',
+                '-define',
+                'webp:exact=true'
+            ])
 
         # -quality in ImageMagick has a different meaning for PNG
         # See https://www.imagemagick.org/script/command-line-options.php#quality
@@ -292,15 +270,28 @@ class Engine(BaseEngine):
 
         self.queue_operators(operators)
 
-        last_operators = [
-            '%s[%d]' % (self.image.name, self.page),
-            '%s:-' % extension,
-        ]
+        ladder = self.size_ladder(extension)
+
+        if ladder:
+            returncode, stderr, result = self.run_ladder(extension, ladder)
+
+            # The requested thumbnail matters more than the extra widths
+            if returncode != 0:
+                self.debug('[IM] Size ladder failed: %s' % stderr)
+                self.remove_ladder(ladder)
+                ladder = {}
+
+        if not ladder:
+            last_operators = [
+                '%s[%d]' % (self.image.name, self.page),
+                '%s:-' % extension,
+            ]
 
-        returncode, stderr, result = self.run_operators(last_operators)
+            returncode, stderr, result = self.run_operators(last_operators)
 
-        # If the requested page failed, try the cover
-        if returncode != 0 and self.page > 0:
+        # If the requested page failed and we couldn't tell how many
+        # pages there are, try the cover
+        if returncode != 0 and self.page > 0 and self.source_metadata.pages is None:
             self.page = 0
             last_operators = [
                 '%s[%d]' % (self.image.name, self.page),
@@ -309,22 +300,22 @@ class Engine(BaseEngine):
             returncode, stderr, result = self.run_operators(last_operators)
 
         if returncode != 0:
-            ShellRunner.rm_f(self.image.name)  # pragma: no cover
+            SourceHandle.discard(self.image)  # pragma: no cover
             raise ImageMagickException('Failed to convert image %s' % stderr)  # pragma: no cover
 
-        self.operators = []
+        if ladder:
+            self.read_ladder(extension, ladder)
+
+        self.operations = OperationGraph()
 
         # Going forward, we're dealing with a single page document
         if self.page > 0:
             self.page = 0
 
-        if extension == 'jpg':
+        if extension in ('jpg', 'webp'):
             result = self.process_exif(result)
 
-        if hasattr(self, 'webp') and self.webp:
-            result = self.maybe_convert_to_webp(result)
-
-        ShellRunner.rm_f(self.image.name)
+        SourceHandle.discard(self.image)
 
         return result
 
@@ -343,89 +334,66 @@ class Engine(BaseEngine):
             )
         )
 
-        width = int(crop_right) - int(crop_left)
-        height = int(crop_bottom) - int(crop_top)
-
-        operators = [
-            '-crop',
-            '%dx%d+%d+%d' % (width, height, crop_left, crop_top)
-        ]
-
-        self.queue_operators(operators)
+        self.queue_operation(Crop(
+            crop_left,
+            crop_top,
+            int(crop_right) - int(crop_left),
+            int(crop_bottom) - int(crop_top)
+        ))
 
     def resize(self, width, height):
         self.debug('[IM] resize: %r %r' % (width, height))
 
         self.internal_size = (width, height)
 
-        operators = []
-
-        if self.extension == '.jpg':
-            operators += [
-                '-define',
-                'jpeg:size=%s' % self.jpeg_size(),
-            ]
-
-        exif_image_size = self.exif_dict['ImageSize']
-        buffer_size = exif_image_size.split('x')
-        buffer_size = [float(x) for x in buffer_size]
-        buffer_ratio = buffer_size[0] / buffer_size[1]
-
-        if 'Pyexiv2Orientation' in self.exif_dict:
-            if self.exif_dict['Pyexiv2Orientation'] in (6, 8):
-                buffer_ratio = buffer_size[1] / buffer_size[0]
+        buffer_ratio = self.source_metadata.ratio
 
         # We have a slightly different calculation/rounding strategy than Thumbor
         # when it comes to calculate target width/height when only one dimension
         # is provided
         if self.context.request.height == 0 and self.context.request.width > 0:
-            target_size = '%dx%d' % (int(width), Decimal(width / buffer_ratio).quantize(0, ROUND_HALF_DOWN))
+            target_size = (int(width), Decimal(width / buffer_ratio).quantize(0, ROUND_HALF_DOWN))
         elif self.context.request.height > 0 and self.context.request.width == 0:
-            target_size = '%dx%d' % (Decimal(height * buffer_ratio).quantize(0, ROUND_HALF_DOWN), int(height))
+            target_size = (Decimal(height * buffer_ratio).quantize(0, ROUND_HALF_DOWN), int(height))
         else:
-            target_size = '%dx%d' % (int(width), int(height))
-
-        # The ^ + gravity + extent trick is necessary to ensure that we get a thumbnail
-        # of exactly the width we've requested. In some edge cases a tiny fraction
-        # of the image might be cropped out. This is unavoidable with ImageMagick
-        # See http://www.imagemagick.org/Usage/resize/ for details
-
-        operators += [
-            '-resize',
-            '%s^' % target_size,
-            '-gravity',
-            'center',
-            '-extent',
-            target_size
-        ]
+            target_size = (int(width), int(height))
+
+        hint = None
+
+        if self.extension == '.jpg':
+            hint = self.jpeg_size(target_size)
+
+        self.queue_operation(Resize(*target_size, hint=hint))
 
         # T198370 T283646 "-background none" is necessary to preserve transparency of PNG and WEBP thumbnails.
         # Only apply to RGBA and Palette (indexed)
         # PNGs, because otherwise it would turn thumbnails of RGB PNGs into RGBA, thumbnails
         # increasing their file size significantly.
-        if (
-            ( 'WebP_Flags' in self.exif_dict and 'Alpha' in self.exif_dict['WebP_Flags'] )
-            or ( 'ColorType' in self.exif_dict and self.exif_dict['ColorType'] in ['RGB with Alpha', 'Grayscale with Alpha', 'Palette'] )
-            or 'Transparency' in self.exif_dict
-        ):
-            operators += ['-background', 'none']
-
-        self.queue_operators(operators)
+        if self.source_metadata.has_alpha:
+            self.queue_operators(['-background', 'none'])
 
     def flip_horizontally(self):
         self.debug('[IM] flip_horizontally')
 
-        self.queue_operators(['-flop'])
+        self.queue_operation(Orient(flop=True))
 
     def flip_vertically(self):
         self.debug('[IM] flip_vertically')
 
-        self.queue_operators(['-flip'])
+        self.queue_operation(Orient.flip())
 
     def rotate(self, degrees):
         self.debug('[IM] rotate: %r' % degrees)
 
-        self.queue_operators(['-rotate', '%s' % degrees])
+        if float(degrees) % 90 == 0:
+            self.queue_operation(Orient(float(degrees)))
+        else:
+            self.queue_operation(Rotate(degrees))
+
+    def unsharp(self, radius, sigma, amount, threshold):
+        self.debug('[IM] unsharp: %r %r %r %r' % (radius, sigma, amount, threshold))
+
+        self.queue_operation(Unsharp(radius, sigma, amount, threshold))
 
     def reorientate(self):
         self.debug('[IM] reorientate')
@@ -433,76 +401,219 @@ class Engine(BaseEngine):
         # T173804 Avoid ImageMagick -auto-orient which is overzealous
         # in interpreting various EXIF fields instead of just Orientation
 
-        if 'Pyexiv2Orientation' in self.exif_dict:
-            if self.exif_dict['Pyexiv2Orientation'] == 6:
-                self.queue_operators(['-rotate', '90'])
-            elif self.exif_dict['Pyexiv2Orientation'] == 8:
-                self.queue_operators(['-rotate', '270'])
-            elif self.exif_dict['Pyexiv2Orientation'] == 3:
-                self.queue_operators(['-rotate', '180'])
+        orientation = self.source_metadata.orientation
+
+        if orientation == 6:
+            self.queue_operation(Orient(90))
+        elif orientation == 8:
+            self.queue_operation(Orient(270))
+        elif orientation == 3:
+            self.queue_operation(Orient(180))
 
     @property
     def size(self):
         return self.internal_size
 
     def queue_operators(self, operators):
-        self.operators += operators
+        self.queue_operation(Raw(operators))
 
-        self.debug('[IM] Queued operators: %r' % self.operators)
+    def queue_operation(self, operation):
+        self.operations.append(operation)
 
-    def run_operators(self, extra_operators):
-        command = [
-            self.context.config.CONVERT_PATH,
-            '-define',
-            'tiff:exif-properties=no'  # Otherwise IM treats a bunch of warnings as errors
-        ]
+        self.debug('[IM] Queued operations: %r' % self.operations)
 
-        command += self.operators
+    def size_ladder(self, extension):
+        """Temporary files to write the extra widths of the size ladder to,
+        by width."""
+        if extension not in ('jpg', 'png', 'webp'):
+            return {}
 
-        command += extra_operators
+        # The other widths are only the same image at a different size
+        # if nothing but the resize depends on the width
+        resizes = [operation for operation in self.operations if isinstance(operation, Resize)]
 
-        returncode, stderr, result = ShellRunner.command(
-            command,
-            self.context
-        )
+        if len(resizes) != 1 or any(isinstance(operation, (Crop, Rotate)) for operation in self.operations):
+            return {}
 
-        return returncode, stderr, result
+        width, height = self.source_metadata.size
 
-    def maybe_convert_to_webp(self, jpg_result):
-        temp_file = NamedTemporaryFile(delete=False)
+        if self.source_metadata.rotated:
+            width = height
 
-        with open(temp_file.name, 'wb') as tmp:
-            tmp.write(jpg_result)
+        widths = SizeLadder.widths(self.context, width)
 
-        command = [
-            self.context.config.CWEBP_PATH,
-            temp_file.name,
-            '-metadata',
-            'all'
-        ]
+        # conditional_sharpen only sharpens below a resize ratio, which
+        # smaller widths are under if the requested one is, and larger
+        # ones are above if it isn't
+        if any(isinstance(operation, Unsharp) for operation in self.operations):
+            widths = [ladder_width for ladder_width in widths if ladder_width < self.context.request.width]
+        elif 'conditional_sharpen' in (self.context.request.filters or ''):
+            widths = [ladder_width for ladder_width in widths if ladder_width > self.context.request.width]
 
-        if self.webp['lossless']:
-            command += ['-lossless', '-exact']
-        else:
-            command += ['-q', '%s' % self.webp['quality']]
+        ladder = {}
 
-        self.webp = False
+        for ladder_width in widths:
+            ladder_file = TempArena.named_temporary_file(self.context, delete=False, suffix='.' + extension)
+            ladder_file.close()
+            ladder[ladder_width] = ladder_file.name
 
-        command += [
-            '-quiet',
-            '-o',
-            '-'
+        return ladder
+
+    def ladder_operations(self, width=None):
+        """The queued operations, resized to width if given. The loader
+        hint is dropped, run_ladder sets one large enough for all widths."""
+        operations = OperationGraph()
+
+        for operation in self.operations:
+            if isinstance(operation, Resize):
+                if width is None:
+                    operation = Resize(operation.width, operation.height)
+                else:
+                    height = Decimal(width / self.source_metadata.ratio).quantize(0, ROUND_HALF_DOWN)
+                    operation = Resize(width, height)
+
+            operations.append(operation)
+
+        return operations.optimize(self.source_metadata.size).to_convert()
+
+    def run_ladder(self, extension, ladder):
+        resize = next(operation for operation in self.operations if isinstance(operation, Resize))
+        hint = None
+
+        if resize.hint is not None:
+            # Large enough for the largest width
+            width = max([resize.width] + list(ladder))
+            height = Decimal(width / self.source_metadata.ratio).quantize(0, ROUND_HALF_DOWN)
+            hint = self.jpeg_size((width, height))
+
+        command = self.convert_command(hint)
+
+        if hint is not None:
+            command += ['-define', 'jpeg:size=%dx%d' % hint]
+
+        # The source is decoded once, each width is rendered from a clone
+        command.append('%s[%d]' % (self.image.name, self.page))
+
+        for width, path in sorted(ladder.items()):
+            command += ['(', '+clone']
+            command += self.ladder_operations(width)
+            command += ['-write', '%s:%s' % (extension, path), '+delete', ')']
+
+        command += self.ladder_operations()
+        command.append('%s:-' % extension)
+
+        return ShellRunner.command(command, self.context, self.convert_environment())
+
+    def read_ladder(self, extension, ladder):
+        results = {}
+
+        for width, path in ladder.items():
+            with open(path, 'rb') as ladder_file:
+                result = ladder_file.read()
+
+            if extension in ('jpg', 'webp'):
+                result = self.process_exif(result)
+
+            results[width] = result
+
+        self.remove_ladder(ladder)
+
+        if self.context.metrics is not None:
+            self.context.metrics.incr('size_ladder.rendered', len(results))
+
+        self.context.wikimedia_size_ladder_results = results
+
+    def remove_ladder(self, ladder):
+        for path in ladder.values():
+            ShellRunner.rm_f(path)
+
+    def decoded_size(self, hint=None):
+        """Size of the source once decoded, given the jpeg:size hint."""
+        size = self.source_metadata.size
+
+        if size is None or hint is None:
+            return size
+
+        # See jpeg_size
+        denominator = max(1, min(size[0] // hint[0], size[1] // hint[1]))
+        numerator = math.ceil(8 / denominator)
+
+        return tuple(math.ceil(side * numerator / 8) for side in size)
+
+    def convert_limits(self, size):
+        """ImageMagick resource limits for a render of an image of size.
+
+        Each worker gets IMAGEMAGICK_MEMORY_BUDGET bytes, images larger than
+        that fit in have their pixel cache moved to IMAGEMAGICK_TEMPORARY_PATH.
+        Small images are rendered on a single thread, larger ones get one
+        more per IMAGEMAGICK_PIXELS_PER_THREAD pixels, up to
+        IMAGEMAGICK_MAX_THREADS."""
+        config = self.context.config
+        limits = {}
+
+        budget = getattr(config, 'IMAGEMAGICK_MEMORY_BUDGET', None)
+
+        if budget:
+            limits['memory'] = budget
+            limits['map'] = budget
+            # Q16 pixels are 4 channels of 2 bytes
+            limits['area'] = budget // 8
+
+        max_threads = getattr(config, 'IMAGEMAGICK_MAX_THREADS', None)
+
+        if max_threads:
+            pixels = size[0] * size[1] if size is not None else 0
+            per_thread = getattr(config, 'IMAGEMAGICK_PIXELS_PER_THREAD', 4000000)
+            limits['thread'] = max(1, min(max_threads, math.ceil(pixels / per_thread)))
+
+        if limits:
+            self.debug('[IM] Limits for %r: %r' % (size, limits))
+
+            if self.context.request_handler is not None:
+                self.context.request_handler.add_header(
+                    'Thumbor-Convert-Limits',
+                    ','.join('%s=%d' % limit for limit in sorted(limits.items()))
+                )
+
+        return limits
+
+    def convert_command(self, hint=None):
+        command = [self.context.config.CONVERT_PATH]
+
+        for resource, limit in sorted(self.convert_limits(self.decoded_size(hint)).items()):
+            command += ['-limit', resource, '%d' % limit]
+
+        return command + [
+            '-define',
+            'tiff:exif-properties=no'  # Otherwise IM treats a bunch of warnings as errors
         ]
 
-        returncode, stderr, webp_result = ShellRunner.command(command,  self.context)
+    def convert_environment(self):
+        temporary_path = getattr(self.context.config, 'IMAGEMAGICK_TEMPORARY_PATH', None)
 
-        ShellRunner.rm_f(temp_file.name)
+        if not temporary_path:
+            return None
 
-        # If we fail to convert the JPG thumbnail to a WEBP, serve the JPG
-        if returncode != 0:
-            return jpg_result
+        return {'MAGICK_TEMPORARY_PATH': temporary_path}
+
+    def run_operators(self, extra_operators):
+        operations = self.operations.optimize(self.source_metadata.size)
+        self.debug('[IM] Optimized operations: %r' % operations)
 
-        return webp_result
+        hint = next((operation.hint for operation in operations if isinstance(operation, Resize)), None)
+
+        command = self.convert_command(hint)
+        command += operations.to_convert()
+
+        command += extra_operators
+
+        returncode, stderr, result = ShellRunner.command(
+            command,
+            self.context,
+            self.convert_environment()
+        )
+
+        return returncode, stderr, result
 
     def debug(self, message):
         logger.debug(message, extra=log_extra(self.context))
@@ -511,10 +622,7 @@ class Engine(BaseEngine):
 Engine.add_format(
     'image/webp',
     '.webp',
-    lambda buffer: buffer[:4] == b'RIFF' and buffer[8:12] == b'WEBP'
-)
-Engine.add_format(
-    'image/xcf',
-    '.xcf',
-    lambda buffer: buffer[:8] == b'gimp xcf'
+    lambda buffer: buffer[8:12] == b'WEBP',
+    magic=b'RIFF'
 )
+Engine.add_format('image/xcf', '.xcf', magic=b'gimp xcf')
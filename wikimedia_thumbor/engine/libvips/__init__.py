@@ -0,0 +1,3 @@
+from .libvips import Engine
+
+__all__ = ['Engine']
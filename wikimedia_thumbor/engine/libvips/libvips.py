@@ -0,0 +1,434 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# libvips engine
+#
+# Renders JPEG, PNG, TIFF and WebP thumbnails in-process with pyvips,
+# without running convert, vips or exiftool. Like the ImageMagick engine,
+# operations are queued as Thumbor calls the engine and only run when the
+# thumbnail is read. The resize is done with vips_thumbnail, which lets
+# the loaders shrink while decoding (JPEG DCT scaling, WebP scaling, TIFF
+# pyramid levels) and streams the rest of the source through the pipeline
+# rather than decoding it whole.
+#
+# The queued operations are the same OperationGraph the ImageMagick engine
+# compiles to convert arguments, this engine applies it in-process.
+
+import struct
+from decimal import Decimal, ROUND_HALF_DOWN
+
+import pyvips
+from thumbor.engines import BaseEngine
+from thumbor.utils import logger
+
+from wikimedia_thumbor.icc_cache import IccProfileCache
+from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.metadata_writer import MetadataWriter, UnsupportedMetadata
+from wikimedia_thumbor.operations import OperationGraph, Resize, Crop, Orient, Rotate, Unsharp
+from wikimedia_thumbor.source_facts import SourceFacts
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
+
+
+# Every request works on a different original, caching operations across
+# requests would only hold on to memory and file descriptors
+pyvips.cache_set_max(0)
+
+
+class Engine(BaseEngine):
+    formats = ['JPEG', 'PNG', 'TIFF', 'WEBP']
+
+    def should_run(self, buffer):
+        facts = SourceFacts.of(self.context, buffer)
+
+        if facts.format not in self.formats:
+            self.debug('[LIBVIPS] Unsupported source: %r' % facts.header)
+            return False
+
+        self.source_format = facts.format
+
+        return True
+
+    def create_image(self, buffer):
+        self.operations = OperationGraph()
+
+        if hasattr(self.context, 'wikimedia_original_file'):
+            self.debug('[LIBVIPS] Grabbing filename from context')
+            self.source = self.context.wikimedia_original_file
+        else:
+            self.debug('[LIBVIPS] Dumping buffer into temp file')
+            self.source = TempArena.named_temporary_file(self.context, delete=False)
+            self.source.write(buffer)
+            self.source.close()
+
+        # Only reads the header
+        image = pyvips.Image.new_from_file(self.source.name, access='sequential')
+
+        try:
+            page = self.context.request.page - 1
+        except AttributeError:
+            page = 0
+
+        # Out of bounds pages fall back to the first one, like in the other engines
+        if page > 0 and page < self.metadata(image, 'n-pages', 1):
+            self.load_options = {'page': page}
+            image = pyvips.Image.new_from_file(self.source.name, access='sequential', page=page)
+        else:
+            self.load_options = {}
+
+        self.internal_size = (image.width, image.height)
+        self.source_size = self.internal_size
+        self.orientation = self.metadata(image, 'orientation', 1)
+        self.icc_profile = self.metadata(image, 'icc-profile-data')
+        self.kept_fields = self.exif_fields(
+            self.metadata(image, 'exif-data'),
+            self.context.config.EXIF_FIELDS_TO_KEEP
+        )
+
+        self.debug('[LIBVIPS] Source: %dx%d orientation=%r pages=%r' % (
+            image.width,
+            image.height,
+            self.orientation,
+            self.metadata(image, 'n-pages', 1)
+        ))
+
+        return image
+
+    @classmethod
+    def metadata(cls, image, field, default=None):
+        if image.get_typeof(field) == 0:
+            return default
+
+        return image.get(field)
+
+    @classmethod
+    def exif_fields(cls, exif_data, fields):
+        """Reads the ASCII IFD0 fields we keep from a raw EXIF block."""
+        tags = {
+            MetadataWriter.exif_ascii_tags[field]: field
+            for field in fields
+            if field in MetadataWriter.exif_ascii_tags
+        }
+
+        if not exif_data or not tags:
+            return {}
+
+        if exif_data[:6] == b'Exif\x00\x00':
+            exif_data = exif_data[6:]
+
+        kept_fields = {}
+
+        try:
+            endian = '<' if exif_data[:2] == b'II' else '>'
+            offset = struct.unpack(endian + 'I', exif_data[4:8])[0]
+            count = struct.unpack(endian + 'H', exif_data[offset:offset + 2])[0]
+
+            for index in range(count):
+                entry = offset + 2 + index * 12
+                tag, field_type, length = struct.unpack(endian + 'HHI', exif_data[entry:entry + 8])
+
+                if tag not in tags or field_type != 2:
+                    continue
+
+                if length > 4:
+                    value_offset = struct.unpack(endian + 'I', exif_data[entry + 8:entry + 12])[0]
+                    value = exif_data[value_offset:value_offset + length]
+                else:
+                    value = exif_data[entry + 8:entry + 8 + length]
+
+                kept_fields[tags[tag]] = value.split(b'\x00')[0].decode('utf-8', 'replace')
+        except struct.error:
+            return {}
+
+        return kept_fields
+
+    @property
+    def size(self):
+        return self.internal_size
+
+    def queue_operation(self, operation):
+        self.operations.append(operation)
+
+        self.debug('[LIBVIPS] Queued operations: %r' % self.operations)
+
+    def crop(self, crop_left, crop_top, crop_right, crop_bottom):
+        # Same as the ImageMagick engine, Thumbor's pre-crop is ignored
+        pass
+
+    def realcrop(self, crop_left, crop_top, crop_right, crop_bottom):
+        self.debug(
+            '[LIBVIPS] crop: %r %r %r %r' % (
+                crop_left,
+                crop_top,
+                crop_right,
+                crop_bottom
+            )
+        )
+
+        self.queue_operation(Crop(
+            crop_left,
+            crop_top,
+            int(crop_right) - int(crop_left),
+            int(crop_bottom) - int(crop_top)
+        ))
+
+    def resize(self, width, height):
+        self.debug('[LIBVIPS] resize: %r %r' % (width, height))
+
+        source_width, source_height = self.internal_size
+        buffer_ratio = source_width / source_height
+
+        # Same rounding as the ImageMagick engine, so that thumbnails are
+        # exactly the width requested
+        if self.context.request.height == 0 and self.context.request.width > 0:
+            target_size = (int(width), int(Decimal(width / buffer_ratio).quantize(0, ROUND_HALF_DOWN)))
+        elif self.context.request.height > 0 and self.context.request.width == 0:
+            target_size = (int(Decimal(height * buffer_ratio).quantize(0, ROUND_HALF_DOWN)), int(height))
+        else:
+            target_size = (int(width), int(height))
+
+        self.internal_size = target_size
+
+        # JPEG and WebP are shrunk while decoding, crops can't go ahead
+        # of the resize without losing that
+        hint = target_size if self.source_format in ('JPEG', 'WEBP') else None
+
+        self.queue_operation(Resize(*target_size, hint=hint))
+
+    def flip_horizontally(self):
+        self.debug('[LIBVIPS] flip_horizontally')
+
+        self.queue_operation(Orient(flop=True))
+
+    def flip_vertically(self):
+        self.debug('[LIBVIPS] flip_vertically')
+
+        self.queue_operation(Orient.flip())
+
+    def rotate(self, degrees):
+        self.debug('[LIBVIPS] rotate: %r' % degrees)
+
+        # Clockwise, like ImageMagick's -rotate
+        if float(degrees) % 90 == 0:
+            operation = Orient(float(degrees))
+        else:
+            operation = Rotate(degrees)
+
+        self.queue_operation(operation)
+        self.internal_size = operation.output_size(self.internal_size)
+
+    def reorientate(self):
+        self.debug('[LIBVIPS] reorientate')
+
+        # T173804 Only the IFD0 Orientation, and only the orientations
+        # the ImageMagick engine handles
+        if self.orientation == 6:
+            self.rotate(90)
+        elif self.orientation == 8:
+            self.rotate(270)
+        elif self.orientation == 3:
+            self.rotate(180)
+
+    def unsharp(self, radius, sigma, amount, threshold):
+        self.debug('[LIBVIPS] unsharp: %r %r %r %r' % (radius, sigma, amount, threshold))
+
+        self.queue_operation(Unsharp(radius, sigma, amount, threshold))
+
+    def has_transparency(self):
+        return self.image.hasalpha()
+
+    def render(self):
+        operations = list(self.operations.optimize(self.source_size))
+        self.debug('[LIBVIPS] Optimized operations: %r' % operations)
+
+        resize = next((i for i, operation in enumerate(operations) if isinstance(operation, Resize)), None)
+
+        # Rotations and flips queued before the resize are done after it,
+        # on the smaller image. Anything else means loading the whole image.
+        if resize is not None and all(isinstance(operation, Orient) for operation in operations[:resize]):
+            width, height = operations[resize].width, operations[resize].height
+
+            if any(operation.rotation in (90, 270) for operation in operations[:resize]):
+                width, height = height, width
+
+            self.debug('[LIBVIPS] Thumbnailing to %dx%d' % (width, height))
+
+            image = pyvips.Image.thumbnail(
+                self.source.name,
+                width,
+                height=height,
+                crop='centre',
+                no_rotate=True,
+                option_string=','.join('%s=%s' % option for option in self.load_options.items())
+            )
+
+            operations = operations[:resize] + operations[resize + 1:]
+
+            # Rotations and vertical flips read the image out of order,
+            # the thumbnail is small enough to hold in memory
+            if operations:
+                image = image.copy_memory()
+        else:
+            image = pyvips.Image.new_from_file(self.source.name, **self.load_options)
+
+        # vips_thumbnail converts CMYK to sRGB, the full image doesn't get
+        # converted by itself
+        if image.interpretation == 'cmyk':
+            image = image.icc_transform('srgb', embedded=True, input_profile='cmyk')
+
+        for operation in operations:
+            image = getattr(self, 'apply_' + type(operation).__name__.lower())(image, operation)
+
+        return image
+
+    def apply_resize(self, image, operation):
+        return image.thumbnail_image(operation.width, height=operation.height, crop='centre', no_rotate=True)
+
+    def apply_crop(self, image, operation):
+        width, height = operation.output_size((image.width, image.height))
+
+        return image.crop(operation.left, operation.top, width, height)
+
+    def apply_orient(self, image, operation):
+        if operation.flop:
+            image = image.flip('horizontal')
+
+        if operation.rotation:
+            image = image.rot('d%d' % operation.rotation)
+
+        return image
+
+    def apply_rotate(self, image, operation):
+        return image.similarity(angle=float(operation.degrees))  # pragma: no cover
+
+    def apply_raw(self, image, operation):
+        # ImageMagick settings, nothing to do here
+        return image  # pragma: no cover
+
+    def apply_unsharp(self, image, operation):
+        # Same as ImageMagick's -unsharp, on the colour channels only
+        sigma, amount, threshold = operation.sigma, operation.amount, operation.threshold
+
+        if sigma <= 0:
+            return image
+
+        bands = image.bands - 1 if image.hasalpha() else image.bands
+        colour = image.extract_band(0, n=bands)
+
+        difference = colour - colour.gaussblur(sigma)
+
+        if threshold > 0:
+            quantum = 65535 if image.format == 'ushort' else 255
+            difference = (abs(difference) > threshold * quantum).ifthenelse(difference, 0)
+
+        result = (colour + difference * amount).cast(image.format)
+
+        if bands < image.bands:
+            result = result.bandjoin(image.extract_band(bands))
+
+        return result.copy(interpretation=image.interpretation)
+
+    def output_profile(self):
+        """The ICC profile to embed in the thumbnail, with sRGB swapped for
+        the smaller TinyRGB. Thumbnails of CMYK sources are sRGB."""
+        if self.icc_profile is None:
+            return None
+
+        # CMYK sources are rendered in sRGB, see render
+        if self.icc_profile[16:20] not in (b'RGB ', b'GRAY'):
+            self.debug('[LIBVIPS] File has a %r profile, converted to sRGB' % self.icc_profile[16:20])
+
+            with open(self.context.config.EXIF_TINYRGB_PATH, 'rb') as profile_file:
+                return profile_file.read()
+
+        description = IccProfileCache.description(self.icc_profile)
+        expected_profile = self.context.config.EXIF_TINYRGB_ICC_REPLACE
+
+        if description is not None and description.lower() == expected_profile.lower():
+            self.debug('[LIBVIPS] File has sRGB profile')
+
+            with open(self.context.config.EXIF_TINYRGB_PATH, 'rb') as profile_file:
+                return profile_file.read()
+
+        self.debug('[LIBVIPS] File has non-sRGB profile: %r' % description)
+
+        return self.icc_profile
+
+    @classmethod
+    def strip_metadata(cls, image, icc_profile=None):
+        image = image.copy()
+
+        for field in image.get_fields():
+            if field in ('icc-profile-data', 'exif-data', 'xmp-data', 'iptc-data', 'orientation') or field.startswith('exif-'):
+                image.remove(field)
+
+        if icc_profile is not None:
+            image.set_type(pyvips.GValue.blob_type, 'icc-profile-data', icc_profile)
+
+        return image
+
+    def read(self, extension=None, quality=None):
+        if self.context.request.format is not None:
+            extension = self.context.request.format
+        elif extension is None or extension.lstrip('.') not in ('jpg', 'jpeg', 'png', 'webp'):
+            self.debug('[LIBVIPS] Defaulting to .jpg')
+            extension = 'jpg'
+
+        extension = extension.lstrip('.')
+
+        if quality is None:
+            quality = self.context.config.QUALITY
+
+        self.debug('[LIBVIPS] read: %s %d' % (extension, quality))
+
+        image = self.render()
+        icc_profile = self.output_profile()
+
+        if image.interpretation in ('rgb16', 'grey16') and extension != 'png':
+            image = image.colourspace('srgb' if image.interpretation == 'rgb16' else 'b-w')
+
+        if extension == 'png':
+            result = self.strip_metadata(image, icc_profile).pngsave_buffer(compression=9)
+        elif extension == 'webp':
+            lossless = self.source_format == 'PNG'
+
+            result = image.webpsave_buffer(Q=quality, lossless=lossless, exact=lossless, strip=True)
+        else:
+            if image.hasalpha():
+                image = image.flatten(background=255)
+
+            config = self.context.config
+            options = {'Q': quality, 'strip': True}
+
+            if getattr(config, 'CHROMA_SUBSAMPLING', None) == '4:2:0':
+                options['subsample_mode'] = 'on'
+            elif getattr(config, 'CHROMA_SUBSAMPLING', None) == '4:4:4':
+                options['subsample_mode'] = 'off'
+
+            if config.PROGRESSIVE_JPEG:
+                options['interlace'] = True
+
+            result = image.jpegsave_buffer(**options)
+
+        if extension != 'png':
+            try:
+                result = MetadataWriter.rewrite(result, icc_profile, self.kept_fields)
+            except UnsupportedMetadata as e:
+                self.debug('[LIBVIPS] Could not write metadata: %s' % e)
+
+        self.operations = OperationGraph()
+
+        SourceHandle.discard(self.source)
+
+        return result
+
+    def debug(self, message):
+        logger.debug(message, extra=log_extra(self.context))
@@ -11,27 +11,40 @@
 
 # Proxy engine, redirects requests to other engines
 # according to configurable logic
-
+#
+# PROXY_ENGINE_ENGINES lists the engines with the extensions they handle,
+# by order of preference. It's turned into an index of the candidate
+# engines for each extension once per process. Candidates that have a
+# should_run method get to decide if they run, based on the facts about
+# the original shared through the context.
+
+import contextlib
 import datetime
 import importlib
 import resource
 import math
-from collections import OrderedDict
 
 from thumbor.utils import logger
 from thumbor.engines import BaseEngine
 from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.shell_runner import ShellRunner
 
 
-def utime():
-    return resource.getrusage(resource.RUSAGE_SELF).ru_utime \
-        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_utime
+def thread_utime():
+    # RUSAGE_SELF and RUSAGE_CHILDREN would mix in concurrent requests and
+    # their children. Only the thread running the engine counts, threads
+    # libvips starts for itself aren't accounted for.
+    return resource.getrusage(resource.RUSAGE_THREAD).ru_utime
 
 
 class Engine(BaseEngine):
-    def __init__(self, context):
-        engines = OrderedDict(context.config.PROXY_ENGINE_ENGINES)
+    # Engine classes by module, imported once per process
+    classes = {}
+
+    # PROXY_ENGINE_ENGINES and its index of engines by extension
+    indexes = {}
 
+    def __init__(self, context):
         # Create an object that will store local values
         # Setting it this way avoids hitting the __setattr__
         # proxying
@@ -39,16 +52,53 @@ class Engine(BaseEngine):
         super(Engine, self).__setattr__('multiple_engine', None)
 
         self.lcl['context'] = context
-        self.lcl['engines'] = engines
+        self.lcl['engines'] = self.dispatch(context.config.PROXY_ENGINE_ENGINES)
+        # Engines are only instantiated once they're needed
+        self.lcl['instances'] = {}
+        self.lcl['loaded'] = set()
+        # The engine the calls are proxied to, bound by load
+        self.lcl['engine'] = None
+        self.lcl['selected_engine'] = None
+        self.lcl['extension'] = None
+        self.lcl['buffer'] = None
+        # User CPU time spent in engine calls, by the threads running them
+        self.lcl['thread_utime'] = 0
+
+    @classmethod
+    def dispatch(cls, engines):
+        """Candidate engines for each extension, in order of preference."""
+        key = id(engines)
+
+        if key not in cls.indexes or cls.indexes[key][0] is not engines:
+            index = {}
+
+            for module, extensions in engines:
+                # Importing the engines registers the formats they handle,
+                # which the MIME detection needs before any engine is selected
+                cls.engine_class(module)
+
+                for extension in extensions:
+                    index.setdefault(extension, []).append(module)
 
-        for engine in engines:
-            self.init_engine(context, engine)
+            cls.indexes[key] = (engines, index)
 
-    def init_engine(self, context, module):
-        mod = importlib.import_module(module)
-        klass = getattr(mod, 'Engine')
+        return cls.indexes[key][1]
 
-        self.lcl[module] = klass(context)
+    @classmethod
+    def engine_class(cls, module):
+        if module not in cls.classes:
+            logger.debug('[Proxy] Importing: %s' % module)
+            cls.classes[module] = getattr(importlib.import_module(module), 'Engine')
+
+        return cls.classes[module]
+
+    def init_engine(self, module):
+        instances = self.lcl['instances']
+
+        if module not in instances:
+            instances[module] = self.engine_class(module)(self.lcl['context'])
+
+        return instances[module]
 
     def select_engine(self):
         if self.lcl['selected_engine'] is not None:
@@ -61,22 +111,35 @@ class Engine(BaseEngine):
 
         logger.debug('[Proxy] Looking for a %s engine' % ext)
 
-        for enginename, extensions in self.lcl['engines'].items():
-            engine = self.lcl[enginename]
+        metrics = self.lcl['context'].metrics
+
+        for enginename in self.lcl['engines'].get(ext, ()):
+            engine = self.init_engine(enginename)
 
-            if ext in extensions:
-                if hasattr(engine, 'should_run'):
-                    if engine.should_run(self.lcl['buffer']):
-                        self.lcl['selected_engine'] = enginename
-                        return enginename
-                else:
-                    self.lcl['selected_engine'] = enginename
-                    return enginename
+            if not hasattr(engine, 'should_run') or engine.should_run(self.lcl['buffer']):
+                self.lcl['selected_engine'] = enginename
+
+                if metrics is not None:
+                    metrics.incr('engine.selected.' + enginename)
+
+                return enginename
+
+            if metrics is not None:
+                metrics.incr('engine.declined.' + enginename)
 
         raise Exception(
             'Unable to find a suitable engine, tried %r' % self.lcl['engines']
         )  # pragma: no cover
 
+    def selected(self):
+        """The engine calls are proxied to."""
+        engine = self.lcl['engine']
+
+        if engine is None:
+            engine = self.init_engine(self.select_engine())
+
+        return engine
+
     def record_timing(self, timing, header, end):
         duration = end - self.lcl[timing]
 
@@ -102,41 +165,79 @@ class Engine(BaseEngine):
             duration
         )
 
+    @contextlib.contextmanager
+    def thread_usage(self):
+        """Accounts for the user CPU time of the current thread."""
+        start = thread_utime()
+
+        try:
+            yield
+        finally:
+            self.lcl['thread_utime'] += thread_utime() - start
+
+    def utime(self):
+        """User CPU time of the request's engine calls and of the children
+        ShellRunner ran for it, in seconds."""
+        return self.lcl['thread_utime'] \
+            + ShellRunner.total_usage(self.lcl['context'], 'utime') / 1000
+
     # This is our entry point for the proxy, it's the first call to the engine
     def load(self, buffer, extension):
         logger.debug('[Proxy] load: %r' % extension)
         self.lcl['processing_time'] = datetime.datetime.now()
-        self.lcl['processing_utime'] = utime()
+        self.lcl['processing_utime'] = self.utime()
 
+        with self.thread_usage():
+            self.bind_engine(buffer, extension)
+
+    def bind_engine(self, buffer, extension):
         # buffer and extension are needed by select_engine
         self.lcl['extension'] = extension
         self.lcl['buffer'] = buffer
         self.lcl['selected_engine'] = None
 
+        self.lcl['engine'] = None
+
         enginename = self.select_engine()
 
-        # Now that we'll select the right engine, let's initialize it
         self.lcl['context'].request_handler.set_header(
             'Thumbor-Engine',
             enginename
         )
 
-        self.lcl[enginename].__init__(self.lcl['context'])
-        self.lcl[enginename].load(buffer, extension)
+        engine = self.init_engine(enginename)
+
+        # Engines are fresh the first time around, but have to be reset
+        # if the same proxy loads another image
+        if enginename in self.lcl['loaded']:
+            engine.__init__(self.lcl['context'])
+
+        self.lcl['loaded'].add(enginename)
+
+        # From now on, calls go straight to the engine
+        self.lcl['engine'] = engine
+        engine.load(buffer, extension)
 
     def __getattr__(self, name):
-        return getattr(self.lcl[self.select_engine()], name)
+        # Hot path, once the engine is bound
+        engine = self.lcl['engine']
+
+        if engine is None:
+            engine = self.selected()
+
+        return getattr(engine, name)
 
     def __delattr__(self, name):  # pragma: no cover
-        return delattr(self.lcl[self.select_engine()], name)
+        return delattr(self.selected(), name)
 
     def __setattr__(self, name, value):
-        return setattr(self.lcl[self.select_engine()], name, value)
+        return setattr(self.selected(), name, value)
 
     # This is the exit point for requests, where the generated image is
     # converted to the target format
     def read(self, extension=None, quality=None):
-        ret = self.__getattr__('read')(extension, quality)
+        with self.thread_usage():
+            ret = self.__getattr__('read')(extension, quality)
 
         # The original can be re-read during the request
         if quality is None:
@@ -151,11 +252,30 @@ class Engine(BaseEngine):
         self.record_timing(
             'processing_utime',
             'Thumbor-Processing-Utime',
-            utime()
+            self.utime()
         )
 
+        self.record_subprocess_usage()
+
         return ret
 
+    def record_subprocess_usage(self):
+        context = self.lcl['context']
+        enginename = self.select_engine()
+
+        for field in ('utime', 'stime', 'inblock', 'oublock'):
+            context.metrics.timing(
+                'engine.subprocess_%s.%s' % (field, enginename),
+                ShellRunner.total_usage(context, field)
+            )
+
+        usage = ShellRunner.usage(context).values()
+        if usage:
+            context.metrics.timing(
+                'engine.subprocess_maxrss.' + enginename,
+                max(command_usage['maxrss'] for command_usage in usage)
+            )
+
     # The following have to be redefined because their fallbacks in BaseEngine
     # don't have the right amount of parameters
     # They call __getattr__ because the calls still need to be proxied
@@ -192,7 +312,6 @@ class Engine(BaseEngine):
         return self.__getattr__('size')
 
     def cleanup(self):  # pragma: no cover
-        # Call cleanup on all the engines
-        for enginename, extensions in self.lcl['engines'].items():
-            engine = self.lcl[enginename]
+        # Call cleanup on all the engines that were instantiated
+        for engine in self.lcl['instances'].values():
             engine.cleanup()
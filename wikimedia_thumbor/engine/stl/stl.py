@@ -13,12 +13,9 @@
 
 import struct
 import os
-import tempfile
 import math
 
 from wikimedia_thumbor.engine import BaseWikimediaEngine
-from wikimedia_thumbor.shell_runner import ShellRunner
-from wikimedia_thumbor.engine import CommandError
 
 BaseWikimediaEngine.add_format(
     'application/sla',
@@ -73,11 +70,8 @@ class Engine(BaseWikimediaEngine):
         # the value which will be rounded are used.
         height = math.floor(self.context.request.width / (640 / 480) + 0.5)
 
-        tmpfile, tmppng = tempfile.mkstemp(suffix='.stl.png', prefix='tmpthumb')
-
-        # We don't need the file actually, just the filename
-        os.close(tmpfile)
-
+        # 3d2png only writes to a path, it's given its stdout, which is
+        # streamed into the file ImageMagick reads from
         command = [
             self.context.config.XVFB_RUN_PATH,
             '-a',
@@ -88,18 +82,9 @@ class Engine(BaseWikimediaEngine):
             self.context.config.THREED2PNG_PATH,
             self.source,
             '%dx%d' % (self.context.request.width, height),
-            tmppng
+            '/dev/stdout'
         ]
 
-        try:
-            self.command(command)
-        except CommandError as e:
-            ShellRunner.rm_f(tmppng)
-            raise e
-
-        tmpfile = open(tmppng, 'rb')
-        png = tmpfile.read()
-        tmpfile.close()
-        ShellRunner.rm_f(tmppng)
+        png, stderr = self.pipeline([command])
 
-        return super(Engine, self).create_image(png)
+        return self.open_image(png)
@@ -14,17 +14,15 @@
 import codecs
 import locale
 import logging
-import os
 import re
-import tempfile
 
-from wikimedia_thumbor.engine import BaseWikimediaEngine, CommandError
-from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.engine import BaseWikimediaEngine
 
 BaseWikimediaEngine.add_format(
     'image/svg+xml',
     '.svg',
-    lambda buffer: Engine.is_svg(buffer)
+    lambda buffer: Engine.is_svg(buffer),
+    prefixes=[b'<', codecs.BOM_UTF8[:1]]
 )
 
 
@@ -45,18 +43,12 @@ class Engine(BaseWikimediaEngine):
     def create_image(self, buffer):
         self.prepare_source(buffer)
 
-        tmp_handle, tmp_name = tempfile.mkstemp()
-        # tempfile opens the file on create
-        os.close(tmp_handle)
-
         command = [
             self.context.config.RSVG_CONVERT_PATH,
             self.source,
             '-u',
             '-f',
-            'png',
-            '-o',
-            tmp_name
+            'png'
         ]
 
         if self.context.request.width > 0:
@@ -97,17 +89,11 @@ class Engine(BaseWikimediaEngine):
         else:
             env = {'LC_ALL': "en"}
 
-        try:
-            self.command(command, env)
-        except CommandError as e:
-            ShellRunner.rm_f(tmp_name)
-            raise e
-
-        with open(tmp_name, 'rb') as tmpfile:
-            png = tmpfile.read()
-        ShellRunner.rm_f(tmp_name)
+        # rsvg-convert writes the PNG to stdout, which goes straight into
+        # the file ImageMagick reads from
+        png, stderr = self.pipeline([command], env)
 
-        return super(Engine, self).create_image(png)
+        return self.open_image(png)
 
     # Disable this method in BaseEngine, do the conversion in create_image
     # instead
@@ -11,53 +11,35 @@
 
 # VIPS engine
 
-import json
 import os
 import shutil
-from tempfile import mkdtemp
 
 from wikimedia_thumbor.engine import BaseWikimediaEngine
 from wikimedia_thumbor.engine import CommandError
+from wikimedia_thumbor.header_sniffer import HeaderSniffer
 from wikimedia_thumbor.shell_runner import ShellRunner  # noqa
+from wikimedia_thumbor.source_facts import SourceFacts
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
 
 
-BaseWikimediaEngine.add_format(
-    'image/tiff',
-    '.tiff',
-    lambda buffer: buffer[:7] in (b'II*\x00', 'MM\x00*')
-)
+BaseWikimediaEngine.add_format('image/tiff', '.tiff', magic=(b'II*\x00', b'MM\x00*'))
 
 
 class Engine(BaseWikimediaEngine):
     def should_run(self, buffer):
-        self.context.vips = {}
+        # Usually known from the headers found in the loader excerpt
+        facts = SourceFacts.of(self.context, buffer)
+        width, height = facts.dimensions()
 
-        command = [
-            '-ImageSize',
-            '-j'
-        ]
-
-        if hasattr(self.context, 'wikimedia_original_file'):
-            stdout = Engine.exiftool.command(
-                pre=command,
-                context=self.context,
-                input_temp_file=self.context.wikimedia_original_file
-            )
-        else:
-            stdout = Engine.exiftool.command(
-                pre=command,
-                context=self.context,
-                buffer=buffer
-            )
+        self.context.vips = {
+            'width': width,
+            'height': height,
+            'pages': facts.pages,
+            'levels': facts.levels,
+        }
 
-        # index with 0 because we're reading a single file
-        exif_dict = json.loads(stdout.decode('utf-8'))[0]
-        size = exif_dict["ImageSize"].split('x')
-
-        self.context.vips['width'] = int(size[0])
-        self.context.vips['height'] = int(size[1])
-
-        pixels = self.context.vips['width'] * self.context.vips['height']
+        pixels = width * height
 
         if self.context.config.VIPS_ENGINE_MIN_PIXELS is None:
             return True  # pragma: no cover
@@ -74,71 +56,193 @@ class Engine(BaseWikimediaEngine):
         if not hasattr(self.context.request, 'extension'):
             return super(Engine, self).create_image(buffer)
 
+        arguments = None
+
+        if getattr(self.context.config, 'VIPS_ENGINE_THUMBNAIL', False):
+            arguments = self.thumbnail_arguments()
+
+        if arguments is None:
+            # T218272: If shrink_factor == 1, VIPS doesn't scale the image.
+            # Don't bother running the command and just let ImageMagick handle it.
+            if self.shrink_factor(self.context.vips['width']) == 1:
+                return super(Engine, self).create_image(buffer)
+
+        self.prepare_source(buffer)
+        source, width = self.select_source()
+
+        if arguments is not None:
+            return self.open_image(self.shrink(source, 'thumbnail', arguments))
+
+        shrink_factor = self.shrink_factor(width)
+
+        # The pyramid level is small enough already
+        if shrink_factor == 1:
+            return self.open_image(self.shrink(source, 'copy', []))
+
+        return self.open_image(self.shrink(source, 'shrink', ["%d" % shrink_factor, "%d" % shrink_factor]))
+
+    def shrink_factor(self, width):
         # We shrink to roughly twice the size we need, then the rest of the resizing is done
         # by Imagemagick. We can't resize straight to the size we need since the shrink factor
         # in this version of VIPS is an integer
-        shrink_factor = max(1, int(
-            self.context.vips['width']
+        return max(1, int(
+            width
             //
             (2 * self.context.request.width)
         ))
 
-        # T218272: If shrink_factor == 1, VIPS doesn't scale the image.
-        # Don't bother running the command and just let ImageMagick handle it.
-        if shrink_factor == 1:
-            return super(Engine, self).create_image(buffer)
+    def select_source(self):
+        """The source with the page and pyramid level to load, and the
+        width of that level."""
+        try:
+            page = self.context.request.page - 1
+        except AttributeError:
+            page = 0
 
-        result = self.shrink(buffer, shrink_factor)
+        pages = self.context.vips.get('pages')
+        levels = self.context.vips.get('levels')
 
-        return super(Engine, self).create_image(result)
+        if pages is None or levels is None:
+            header = HeaderSniffer.sniff_file(self.source)
 
-    def shrink(self, buffer, shrink_factor):
-        self.debug('[VIPS] Shrinking with command')
-        self.prepare_source(buffer)
+            if header is not None and header.format == 'TIFF':
+                pages = header.pages
+                levels = header.levels
 
-        try:
-            source = "%s[page=%d]" % (
-                self.source,
-                self.context.request.page - 1
-            )
-        except AttributeError:
-            source = self.source
+        # Out of range pages get the first one, without trying them first
+        if page < 0 or (pages is not None and page >= pages):
+            page = 0
+
+        width = self.context.vips['width']
+        options = {'page': page} if page > 0 else {}
+        level = self.pyramid_level(levels, page)
+
+        if level is not None:
+            width, height, options = level
 
-        output_args = ""
+            if self.context.metrics is not None and width < levels[page][0][0]:
+                self.context.metrics.incr('vips.pyramid_level')
+
+            self.debug('[VIPS] Loading %dx%d level %r' % (width, height, options))
+
+        if not options:
+            return self.source, width
+
+        return "%s[%s]" % (
+            self.source,
+            ",".join("%s=%d" % option for option in sorted(options.items()))
+        ), width
+
+    def pyramid_level(self, levels, page):
+        """The smallest level of page at least as large as requested, None
+        if the levels are unknown or all smaller."""
+        if levels is None or page >= len(levels):
+            return None
+
+        width = self.context.request.width
+        height = self.context.request.height
+
+        # Levels keep the proportions of the page, so the one large enough
+        # for the requested width and height is large enough for the resize
+        # covering them, which crops get cut from
+        candidates = [level for level in levels[page] if level[0] >= width and level[1] >= height]
+
+        if not candidates:
+            return None
+
+        return candidates[-1]
+
+    def thumbnail_arguments(self):
+        """Arguments of vips thumbnail for the requested width or height,
+        None if the request has both or neither, or doesn't shrink."""
+        width = self.context.request.width
+        height = self.context.request.height
+        source_width = self.context.vips['width']
+        source_height = self.context.vips['height']
+
+        if width > 0 and height == 0:
+            if width >= source_width:
+                return None
+
+            arguments = ["%d" % width]
+        elif height > 0 and width == 0:
+            if height >= source_height:
+                return None
+
+            # vips thumbnail always wants a width, this one never binds
+            arguments = ["%d" % max(source_width, source_height), '--height', "%d" % height]
+        else:
+            return None
+
+        # The source is shrunk while it's decoded, rotated according to its
+        # orientation and converted to sRGB. The other side is rounded by
+        # vips, ImageMagick then finds the thumbnail at the size requested
+        # and only has to encode it
+        return arguments + [
+            '--size',
+            'down',
+            '--export-profile',
+            'srgb'
+        ]
+
+    def shrink(self, source, operation, arguments):
+        self.debug('[VIPS] Shrinking with command')
+
+        # The intermediate PNG is read once by ImageMagick and thrown away,
+        # deflating it only costs time, seconds for the largest ones. Unlike
+        # PPM or the VIPS format, PNG keeps the ICC profile and ImageMagick
+        # reads it
+        output_options = ["compression=0"]
 
         for i in range(3):
             try:
-                return self.shrink_for_page(source, shrink_factor, output_args)
+                return self.shrink_for_page(source, operation, arguments, output_options)
             except CommandError as e:
                 if "does not contain page" in e.args[2].decode('utf-8'):
                     # The page is probably out of bounds, try again without
-                    # specifying a page
+                    # specifying a page or level
                     source = self.source
                 elif "profile" in e.args[2].decode('utf-8') and "vips2png: unable to write" in e.args[2].decode('utf-8'):
                     # libpng doesn't want to write files with ICC profiles
                     # that it doesn't like. Force those images to use TinyRGB
                     self.debug('[VIPS] Forcing TinyRGB profile')
-                    output_args = "[profile=%s]" % self.context.config.EXIF_TINYRGB_PATH
+                    output_options = ["compression=0", "profile=%s" % self.context.config.EXIF_TINYRGB_PATH]
                 elif i >= 1:
                     # Tried at least twice, but failed and we're out of ideas
                     self.cleanup_source()
                     raise e
 
-    def shrink_for_page(self, source, shrink_factor, output_args=""):
-        temp_dir = mkdtemp()
+    def intermediate_dir(self):
+        """Directory for the intermediate PNG, on VIPS_ENGINE_TEMPORARY_PATH
+        (ideally a tmpfs) if set."""
+        path = getattr(self.context.config, 'VIPS_ENGINE_TEMPORARY_PATH', None)
+
+        if not path:
+            return TempArena.mkdtemp(self.context)
+
+        # Removed with the handle, released with the arena in case the
+        # request fails first
+        return TempArena.mkdtemp_in(self.context, path)
+
+    def shrink_for_page(self, source, operation, arguments, output_options=()):
+        """Runs the vips operation, returns a handle on its result."""
+        temp_dir = self.intermediate_dir()
         destination = os.path.join(
             temp_dir,
             'vips_result.png'
         )
 
+        output_args = "[%s]" % ",".join(output_options) if output_options else ""
+
         command = [
             self.context.config.VIPS_PATH,
-            'shrink',
+            operation,
             source,
-            destination + output_args,
-            "%d" % shrink_factor,
-            "%d" % shrink_factor
-        ]
+            destination + output_args
+        ] + arguments
+
+        if self.context.metrics is not None:
+            self.context.metrics.incr('vips.%s' % operation)
 
         try:
             self.command(command, clean_on_error=False)
@@ -147,11 +251,8 @@ class Engine(BaseWikimediaEngine):
             shutil.rmtree(temp_dir, True)
             raise e
 
-        with open(destination, 'rb') as f:
-            result = f.read()
-
         self.cleanup_source()
-        ShellRunner.rm_f(destination)
-        shutil.rmtree(temp_dir, True)
 
-        return result
+        # ImageMagick reads the file vips wrote, which goes away along
+        # with the handle once the thumbnail is rendered
+        return SourceHandle(path=destination, directory=temp_dir)
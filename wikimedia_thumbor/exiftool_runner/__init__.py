@@ -13,21 +13,115 @@
 #
 #
 # They can either run as one-off commands or using a long-running
-# exiftool process started with the -stay_open option.
+# exiftool process started with the -stay_open option, which saves
+# starting Perl and loading exiftool for every command. The latter is
+# enabled with EXIFTOOL_STAY_OPEN.
 #
-# Since Thumbor is single-threaded, there is no need for locking
-# nor having multiple exiftool processes.
+# There is a single long-running process per worker. Commands run from
+# the engine thread pool while it's busy, or containing arguments that
+# can't be passed to it, are run as one-off commands. So are commands
+# that come after it hung or crashed, until it has been restarted.
 
-
-from tempfile import NamedTemporaryFile
+import datetime
+import selectors
+import subprocess
+import threading
+import time
 
 from thumbor.utils import logger
 
 from wikimedia_thumbor.shell_runner import ShellRunner
 from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.temp_arena import TempArena
+
+
+class ExiftoolDaemonError(Exception):
+    pass
+
+
+class ExiftoolDaemon:
+    def __init__(self, context):
+        self.sequence = 0
+
+        # Arguments are read from stdin, one per line, until -execute
+        self.proc = ShellRunner.popen(
+            [context.config.EXIFTOOL_PATH, '-stay_open', 'True', '-@', '-'],
+            context,
+            stdin=subprocess.PIPE
+        )
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def stop(self, kill=False):
+        if kill:
+            self.proc.kill()
+        elif self.alive():
+            try:
+                self.proc.stdin.write(b'-stay_open\nFalse\n')
+                self.proc.stdin.flush()
+            except BrokenPipeError:  # pragma: no cover
+                pass
+
+        self.proc.stdin.close()
+
+        try:
+            self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:  # pragma: no cover
+            self.proc.kill()
+            self.proc.wait()
+
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+
+    def execute(self, args, timeout=None):
+        """Runs a command, returning its (stderr, stdout)."""
+        self.sequence += 1
+
+        # exiftool signals the end of the output of every command with
+        # {readyN} on stdout. -echo4 writes the same marker to stderr once
+        # the command is done, letting us know where its stderr ends.
+        ready = '{ready%d}' % self.sequence
+        args = args + ['-echo4', ready, '-execute%d' % self.sequence]
+
+        try:
+            self.proc.stdin.write(('\n'.join(args) + '\n').encode())
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            raise ExiftoolDaemonError('exiftool went away')
+
+        marker = ('%s\n' % ready).encode()
+        output = {self.proc.stdout: b'', self.proc.stderr: b''}
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with selectors.DefaultSelector() as selector:
+            for pipe in output:
+                selector.register(pipe, selectors.EVENT_READ)
+
+            while not all(data.endswith(marker) for data in output.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+
+                if remaining is not None and remaining <= 0:
+                    raise ExiftoolDaemonError('exiftool timed out')
+
+                for key, events in selector.select(remaining):
+                    data = key.fileobj.raw.read(65536)
+
+                    if not data:
+                        raise ExiftoolDaemonError('exiftool went away')
+
+                    output[key.fileobj] += data
+
+        return (
+            output[self.proc.stderr][:-len(marker)],
+            output[self.proc.stdout][:-len(marker)]
+        )
 
 
 class ExiftoolRunner:
+    daemon = None
+    daemon_lock = threading.Lock()
+
     @classmethod
     def command(
         cls,
@@ -37,25 +131,97 @@ class ExiftoolRunner:
         buffer='',
         input_temp_file=None
     ):
-        if not input_temp_file:
-            input_temp_file = NamedTemporaryFile()
+        created_temp_file = not input_temp_file
+
+        if created_temp_file:
+            input_temp_file = TempArena.named_temporary_file(context)
             input_temp_file.write(buffer)
             input_temp_file.flush()
 
-        command = [context.config.EXIFTOOL_PATH]
-        command += pre
+        args = list(pre)
         # Avoids warnings going to stdout or stderr
-        command += ['-m', '-q', '-q']
-        command.append(input_temp_file.name)
-        command += post
+        args += ['-m', '-q', '-q']
+        args.append(input_temp_file.name)
+        args += post
+
+        stdout = cls.run(context, args)
+
+        if created_temp_file:
+            input_temp_file.close()
+
+        return stdout
+
+    @classmethod
+    def run(cls, context, args):
+        command = [context.config.EXIFTOOL_PATH] + args
 
         logger.debug('[ExiftoolRunner] command: %r' % command, extra=log_extra(context))
 
-        code, stderr, stdout = ShellRunner.command(command, context)
+        result = None
+
+        if (getattr(context.config, 'EXIFTOOL_STAY_OPEN', False)
+                and cls.daemon_safe(args)
+                and cls.daemon_lock.acquire(blocking=False)):
+            try:
+                result = cls.run_in_daemon(context, command, args)
+            finally:
+                cls.daemon_lock.release()
 
-        input_temp_file.close()
+        if result is None:
+            code, stderr, stdout = ShellRunner.command(command, context)
+        else:
+            stderr, stdout = result
 
         if stderr:
             logger.error('[ExiftoolRunner] error: %r' % stderr, extra=log_extra(context))
 
         return stdout
+
+    @classmethod
+    def daemon_safe(cls, args):
+        """Whether the long-running process would get args unchanged. It
+        reads one argument per line, stripped of leading and trailing
+        whitespace, and skips empty lines and lines starting with #."""
+        return all(
+            arg and '\n' not in arg and arg == arg.strip() and not arg.startswith('#')
+            for arg in args
+        )
+
+    @classmethod
+    def run_in_daemon(cls, context, command, args):
+        if cls.daemon is not None and not cls.daemon.alive():
+            logger.error('[ExiftoolRunner] exiftool daemon died, restarting it', extra=log_extra(context))
+            cls.stop()
+
+        if cls.daemon is None:
+            try:
+                cls.daemon = ExiftoolDaemon(context)
+            except OSError as e:
+                logger.error('[ExiftoolRunner] Could not start exiftool daemon: %r' % e, extra=log_extra(context))
+                return None
+
+        timeouts = ShellRunner.timeouts(context)
+        start = datetime.datetime.now()
+
+        try:
+            stderr, stdout = cls.daemon.execute(args, None if timeouts is None else timeouts[0])
+        except ExiftoolDaemonError as e:
+            # Whatever state the process is in, it can't be trusted to
+            # match its output to our commands anymore
+            logger.error('[ExiftoolRunner] %s, falling back to a one-off command' % e, extra=log_extra(context))
+
+            if context.metrics is not None:
+                context.metrics.incr('exiftool.daemon.restart')
+
+            cls.stop(kill=True)
+            return None
+
+        ShellRunner.report(command, context, start, 0, stderr, stdout)
+
+        return stderr, stdout
+
+    @classmethod
+    def stop(cls, kill=False):
+        if cls.daemon is not None:
+            cls.daemon.stop(kill)
+            cls.daemon = None
@@ -54,10 +54,6 @@ class Filter(BaseFilter):
 
         if resize_ratio < resize_ratio_threshold:
             logger.debug('[conditional_sharpen] apply unsharp mask')
-            operators = [
-                '-unsharp',
-                '%fx%f+%f+%f' % (radius, sigma, amount, threshold)
-            ]
-            self.engine.queue_operators(operators)
+            self.engine.unsharp(radius, sigma, amount, threshold)
         else:
             logger.debug('[conditional_sharpen] skip, ratio below limit')
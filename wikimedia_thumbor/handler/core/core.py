@@ -12,8 +12,10 @@ from libthumbor.url import Url
 
 from thumbor.handlers.imaging import ImagingHandler
 
+from wikimedia_thumbor.off_loop import OffLoopFetchMixin
 
-class CoreHandler(ImagingHandler):
+
+class CoreHandler(OffLoopFetchMixin, ImagingHandler):
     @classmethod
     def regex(cls):
         return r'/thumbor/(?P<request>.*)'
@@ -24,8 +24,10 @@ from thumbor.handlers import BaseHandler
 from thumbor.handlers.imaging import ImagingHandler
 from thumbor.utils import logger
 
+from wikimedia_thumbor.off_loop import OffLoopFetchMixin
 from wikimedia_thumbor.poolcounter import PoolCounter
 from wikimedia_thumbor.logging import record_timing, log_extra
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 BaseHandler._old_error = BaseHandler._error
@@ -135,7 +137,7 @@ class TranslateError(Exception):
     pass
 
 
-class ImagesHandler(ImagingHandler):
+class ImagesHandler(OffLoopFetchMixin, ImagingHandler):
     @classmethod
     def regex(cls):
         return (
@@ -497,6 +499,9 @@ class ImagesHandler(ImagingHandler):
 
         record_timing(self.context, self.poolcounter_time, 'poolcounter.time', 'Thumbor-Poolcounter-Time')
 
+        # Torn down in on_finish, whatever happens to the request
+        self.context.wikimedia_temp_arena = TempArena(self.context)
+
         await self.execute_image_operations()
 
     def on_finish(self):
@@ -510,6 +515,9 @@ class ImagesHandler(ImagingHandler):
         if mc:
             mc.disconnect_all()
 
+        if hasattr(self.context, 'wikimedia_temp_arena'):
+            self.context.wikimedia_temp_arena.close()
+
         self.context.metrics.incr('response.status.' + str(self.get_status()))
 
         super(ImagesHandler, self).on_finish()
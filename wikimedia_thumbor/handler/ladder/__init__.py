@@ -0,0 +1,10 @@
+from tc_core import Extension, Extensions
+from .ladder import LadderHandler
+
+
+__all__ = ['LadderHandler']
+
+extension = Extension('wikimedia_thumbor.handler.ladder')
+extension.add_handler(LadderHandler.regex(), LadderHandler)
+
+Extensions.register(extension)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, thumbor-community, Wikimedia Foundation
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+#
+# This handler renders a mediawiki thumbnail url like the images handler,
+# along with other widths of the same original, which are stored in Swift
+# next to it. The widths are passed as a comma separated list in the
+# widths query parameter, otherwise SIZE_LADDER_WIDTHS are all rendered.
+
+from wikimedia_thumbor.handler.images import ImagesHandler
+from wikimedia_thumbor.size_ladder import SizeLadder
+
+
+class LadderHandler(ImagesHandler):
+    @classmethod
+    def regex(cls):
+        return r'/ladder' + super(LadderHandler, cls).regex()
+
+    def translate(self, kw):
+        translated = super(LadderHandler, self).translate(kw)
+
+        widths = self.get_query_argument('widths', None)
+
+        if widths is None:
+            self.context.wikimedia_size_ladder = sorted(self.context.config.get('SIZE_LADDER_WIDTHS', []))
+        else:
+            self.context.wikimedia_size_ladder = SizeLadder.parse(widths)
+
+        return translated
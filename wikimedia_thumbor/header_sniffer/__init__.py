@@ -0,0 +1,387 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Reads basic image information from the first bytes of a file
+#
+# The loaders give engines an excerpt of the original, which is usually
+# enough to find the dimensions, colour type, alpha channel and presence of
+# an ICC profile in the headers of JPEG, PNG, GIF, WebP, TIFF and XCF files.
+# When it isn't, sniff() returns None. If the whole file is available,
+# sniff_file() can follow offsets through it without reading it all,
+# otherwise callers fall back to exiftool.
+#
+# For TIFF files, the pages are counted by following the chain of IFDs, if
+# the buffer contains all of it. The resolutions each page is stored at are
+# listed along the way: pyramidal TIFFs hold reduced versions of a page in
+# its SubIFDs, or in the IFDs following it, marked as reduced-resolution.
+
+import mmap
+import struct
+
+
+class HeaderInfo:
+    def __init__(self, format, width, height, color_type=None, has_alpha=False, has_icc=False, pages=1, levels=None):
+        self.format = format
+        self.width = width
+        self.height = height
+        self.color_type = color_type
+        self.has_alpha = has_alpha
+        self.has_icc = has_icc
+        # None when unknown
+        self.pages = pages
+        # By page, (width, height, load options) from the largest down.
+        # None when unknown
+        self.levels = levels
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    def __repr__(self):
+        return '<HeaderInfo %s %dx%d color_type=%r alpha=%r icc=%r pages=%r>' % (
+            self.format,
+            self.width,
+            self.height,
+            self.color_type,
+            self.has_alpha,
+            self.has_icc,
+            self.pages
+        )
+
+
+class HeaderSniffer:
+    png_color_types = {
+        0: 'Grayscale',
+        2: 'RGB',
+        3: 'Palette',
+        4: 'Grayscale with Alpha',
+        6: 'RGB with Alpha',
+    }
+
+    jpeg_color_types = {
+        1: 'Grayscale',
+        3: 'YCbCr',
+        4: 'CMYK',
+    }
+
+    xcf_color_types = {
+        0: 'RGB',
+        1: 'Grayscale',
+        2: 'Indexed',
+    }
+
+    @classmethod
+    def sniff(cls, buffer):
+        """Returns a HeaderInfo, or None if the format isn't supported or
+        the buffer doesn't contain enough of the file."""
+        try:
+            if buffer[:3] == b'\xff\xd8\xff':
+                return cls.jpeg(buffer)
+            if buffer[:8] == b'\x89PNG\r\n\x1a\n':
+                return cls.png(buffer)
+            if buffer[:6] in (b'GIF87a', b'GIF89a'):
+                return cls.gif(buffer)
+            if buffer[:4] == b'RIFF' and buffer[8:12] == b'WEBP':
+                return cls.webp(buffer)
+            if buffer[:4] in (b'II*\x00', b'MM\x00*'):
+                return cls.tiff(buffer)
+            if buffer[:9] == b'gimp xcf ':
+                return cls.xcf(buffer)
+        except (struct.error, IndexError):
+            # Truncated header
+            return None
+
+        return None
+
+    @classmethod
+    def sniff_file(cls, path):
+        with open(path, 'rb') as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return None
+
+        with buffer:
+            return cls.sniff(buffer)
+
+    @classmethod
+    def jpeg(cls, buffer):
+        position = 2
+        has_icc = False
+
+        while True:
+            if buffer[position] != 0xFF:
+                return None
+
+            marker = buffer[position + 1]
+
+            if marker == 0xFF:
+                position += 1
+                continue
+
+            if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                position += 2
+                continue
+
+            if marker in (0xD9, 0xDA):
+                return None
+
+            length = struct.unpack('>H', buffer[position + 2:position + 4])[0]
+
+            if marker == 0xE2 and buffer[position + 4:position + 16] == b'ICC_PROFILE\x00':
+                has_icc = True
+
+            # Start of frame, except DHT, JPG and DAC which share the range
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width, components = struct.unpack('>HHB', buffer[position + 5:position + 10])
+
+                # The height can be defined later by a DNL marker
+                if height == 0 or width == 0:
+                    return None
+
+                return HeaderInfo(
+                    'JPEG',
+                    width,
+                    height,
+                    cls.jpeg_color_types.get(components),
+                    False,
+                    has_icc
+                )
+
+            position += 2 + length
+
+    @classmethod
+    def png(cls, buffer):
+        length, chunk = struct.unpack('>I4s', buffer[8:16])
+
+        if chunk != b'IHDR':
+            return None
+
+        width, height, bit_depth, color_type = struct.unpack('>IIBB', buffer[16:26])
+        has_alpha = color_type in (4, 6)
+        has_icc = False
+
+        # Ancillary chunks we care about all come before IDAT
+        position = 8 + 12 + length
+
+        while True:
+            length, chunk = struct.unpack('>I4s', buffer[position:position + 8])
+
+            if chunk == b'iCCP':
+                has_icc = True
+            elif chunk == b'tRNS':
+                has_alpha = True
+            elif chunk in (b'IDAT', b'IEND'):
+                break
+
+            position += 12 + length
+
+        return HeaderInfo(
+            'PNG',
+            width,
+            height,
+            cls.png_color_types.get(color_type),
+            has_alpha,
+            has_icc
+        )
+
+    @classmethod
+    def gif(cls, buffer):
+        width, height = struct.unpack('<HH', buffer[6:10])
+
+        # Transparency is defined per frame, in graphic control extensions
+        # Only look at the first frames, the buffer could be a whole file
+        has_alpha = False
+        end = min(len(buffer), 65536)
+        position = buffer.find(b'\x21\xf9\x04', 0, end)
+
+        while position != -1 and not has_alpha:
+            has_alpha = bool(buffer[position + 3] & 1)
+            position = buffer.find(b'\x21\xf9\x04', position + 1, end)
+
+        return HeaderInfo('GIF', width, height, 'Palette', has_alpha, False)
+
+    @classmethod
+    def webp(cls, buffer):
+        chunk = buffer[12:16]
+        data = buffer[20:]
+
+        if chunk == b'VP8 ':
+            # Key frame start code, followed by 14 bit dimensions
+            if data[3:6] != b'\x9d\x01\x2a':
+                return None
+
+            width, height = struct.unpack('<HH', data[6:10])
+            return HeaderInfo('WEBP', width & 0x3FFF, height & 0x3FFF, 'RGB')
+
+        if chunk == b'VP8L':
+            if data[0] != 0x2F:
+                return None
+
+            bits = struct.unpack('<I', data[1:5])[0]
+            width = (bits & 0x3FFF) + 1
+            height = ((bits >> 14) & 0x3FFF) + 1
+            has_alpha = bool((bits >> 28) & 1)
+            return HeaderInfo('WEBP', width, height, 'RGB', has_alpha)
+
+        if chunk == b'VP8X':
+            flags = data[0]
+            width = struct.unpack('<I', data[4:7] + b'\x00')[0] + 1
+            height = struct.unpack('<I', data[7:10] + b'\x00')[0] + 1
+            return HeaderInfo('WEBP', width, height, 'RGB', bool(flags & 0x10), bool(flags & 0x20))
+
+        return None
+
+    @classmethod
+    def tiff(cls, buffer):
+        endian = '<' if buffer[:2] == b'II' else '>'
+        offset = struct.unpack(endian + 'I', buffer[4:8])[0]
+        tags = cls.tiff_tags(buffer, endian, offset)
+
+        if 256 not in tags or 257 not in tags:
+            return None
+
+        photometric = tags.get(262, (None, 0))[0]
+        color_type = {0: 'Grayscale', 1: 'Grayscale', 2: 'RGB', 3: 'Palette', 5: 'CMYK', 6: 'YCbCr'}.get(photometric)
+
+        return HeaderInfo(
+            'TIFF',
+            tags[256][0],
+            tags[257][0],
+            color_type,
+            # ExtraSamples
+            338 in tags,
+            # ICC profile
+            34675 in tags,
+            cls.tiff_pages(buffer, endian, offset),
+            cls.tiff_levels(buffer, endian, offset)
+        )
+
+    @classmethod
+    def tiff_tags(cls, buffer, endian, offset):
+        """Tags of the IFD at offset, as (value, count). Only SHORT, LONG
+        and IFD values are read."""
+        count = struct.unpack(endian + 'H', buffer[offset:offset + 2])[0]
+
+        tags = {}
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            tag, field_type, values = struct.unpack(endian + 'HHI', buffer[entry:entry + 8])
+
+            # SHORT, or LONG and IFD
+            if field_type == 3:
+                tags[tag] = (struct.unpack(endian + 'H', buffer[entry + 8:entry + 10])[0], values)
+            elif field_type in (4, 13):
+                tags[tag] = (struct.unpack(endian + 'I', buffer[entry + 8:entry + 12])[0], values)
+            else:
+                tags[tag] = (None, values)
+
+        return tags
+
+    @classmethod
+    def tiff_pages(cls, buffer, endian, offset):
+        """Number of IFDs in the chain starting at offset, None if the
+        buffer ends before the chain does."""
+        seen = set()
+
+        while offset != 0:
+            # Malformed files can loop back to an earlier IFD
+            if offset in seen:
+                break
+
+            seen.add(offset)
+
+            if offset + 2 > len(buffer):
+                return None
+
+            count = struct.unpack(endian + 'H', buffer[offset:offset + 2])[0]
+            next_offset = offset + 2 + count * 12
+
+            if next_offset + 4 > len(buffer):
+                return None
+
+            offset = struct.unpack(endian + 'I', buffer[next_offset:next_offset + 4])[0]
+
+        return len(seen)
+
+    @classmethod
+    def tiff_levels(cls, buffer, endian, offset):
+        """Resolutions of each page of the chain starting at offset, see
+        HeaderInfo.levels. None if the buffer ends before the chain does."""
+        levels = []
+        seen = set()
+        page = None
+
+        try:
+            while offset != 0 and offset not in seen:
+                seen.add(offset)
+
+                if offset + 2 > len(buffer):
+                    return None
+
+                tags = cls.tiff_tags(buffer, endian, offset)
+                index = len(levels)
+                options = {'page': index} if index > 0 else {}
+                levels.append([(tags[256][0], tags[257][0], options)])
+
+                # NewSubfileType, reduced-resolution version of the last
+                # full page
+                if page is not None and tags.get(254, (0, 0))[0] & 1:
+                    levels[page].append((tags[256][0], tags[257][0], options))
+                else:
+                    page = index
+
+                for subifd, subifd_offset in enumerate(cls.tiff_subifds(buffer, endian, tags)):
+                    subifd_tags = cls.tiff_tags(buffer, endian, subifd_offset)
+                    levels[index].append((
+                        subifd_tags[256][0],
+                        subifd_tags[257][0],
+                        dict(options, subifd=subifd)
+                    ))
+
+                count = struct.unpack(endian + 'H', buffer[offset:offset + 2])[0]
+                next_offset = offset + 2 + count * 12
+
+                if next_offset + 4 > len(buffer):
+                    return None
+
+                offset = struct.unpack(endian + 'I', buffer[next_offset:next_offset + 4])[0]
+        except (struct.error, KeyError):
+            # Truncated, or levels without dimensions
+            return None
+
+        for page_levels in levels:
+            page_levels.sort(key=lambda level: level[0], reverse=True)
+
+        return levels
+
+    @classmethod
+    def tiff_subifds(cls, buffer, endian, tags):
+        """Offsets of the SubIFDs listed in tags."""
+        offset, count = tags.get(330, (None, 0))
+
+        if offset is None or count == 0:
+            return []
+
+        # A single offset is stored in the entry itself
+        if count == 1:
+            return [offset]
+
+        return list(struct.unpack(endian + '%dI' % count, buffer[offset:offset + count * 4]))
+
+    @classmethod
+    def xcf(cls, buffer):
+        # "gimp xcf file" or "gimp xcf vNNN", NUL terminated
+        width, height, base_type = struct.unpack('>III', buffer[14:26])
+
+        # Layers can be transparent whatever the base type
+        return HeaderInfo('XCF', width, height, cls.xcf_color_types.get(base_type), True, False)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Content-addressed store of ICC profiles, shared by the workers of a host
+#
+# A few hundred distinct profiles cover almost all non-sRGB originals.
+# Rather than writing the profile of every such original to a temporary
+# file, ICC_PROFILE_CACHE_PATH keeps one read-only file per profile, named
+# after its SHA-1, which can be passed to exiftool or convert as-is.
+#
+# Files are touched when used and the least recently used ones are evicted
+# once the store grows past ICC_PROFILE_CACHE_MAX_SIZE bytes. Files used
+# in the last eviction_grace seconds are never evicted, since another
+# worker may be about to read them.
+
+import hashlib
+import os
+import struct
+import tempfile
+import time
+
+from thumbor.utils import logger
+
+from wikimedia_thumbor.logging import log_extra
+
+
+class IccProfileCache:
+    suffix = '.icc'
+    eviction_grace = 60
+
+    @classmethod
+    def enabled(cls, context):
+        return bool(getattr(context.config, 'ICC_PROFILE_CACHE_PATH', None))
+
+    @classmethod
+    def path(cls, context, icc_profile):
+        """Returns the path of a read-only file containing icc_profile,
+        storing it first if needed."""
+        directory = context.config.ICC_PROFILE_CACHE_PATH
+        digest = hashlib.sha1(icc_profile).hexdigest()
+        path = os.path.join(directory, digest + cls.suffix)
+
+        try:
+            # Bumps the file in the LRU order
+            os.utime(path)
+            cls.incr(context, 'icc_cache.hit')
+            return path
+        except FileNotFoundError:
+            pass
+
+        cls.incr(context, 'icc_cache.miss')
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Written under a temporary name, so that other workers never see
+        # a partial profile
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp', suffix=cls.suffix)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(icc_profile)
+
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:  # pragma: no cover
+                pass
+            raise
+
+        logger.debug('[IccProfileCache] Stored %s' % path, extra=log_extra(context))
+
+        cls.evict(context)
+
+        return path
+
+    @classmethod
+    def evict(cls, context):
+        directory = context.config.ICC_PROFILE_CACHE_PATH
+        max_size = getattr(context.config, 'ICC_PROFILE_CACHE_MAX_SIZE', 32 * 1024 * 1024)
+
+        entries = []
+        total = 0
+
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.name.endswith(cls.suffix):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # pragma: no cover
+                    # Evicted by another worker in the meantime
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= max_size:
+            return
+
+        threshold = time.time() - cls.eviction_grace
+
+        for mtime, size, path in sorted(entries):
+            if total <= max_size or mtime > threshold:
+                break
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:  # pragma: no cover
+                pass
+
+            total -= size
+            cls.incr(context, 'icc_cache.evicted')
+            logger.debug('[IccProfileCache] Evicted %s' % path, extra=log_extra(context))
+
+    @classmethod
+    def description(cls, icc_profile):
+        """Returns the description found in the desc tag of a profile, or
+        None if there isn't a readable one."""
+        try:
+            count = struct.unpack('>I', icc_profile[128:132])[0]
+
+            for index in range(count):
+                entry = 132 + index * 12
+                signature, offset, size = struct.unpack('>4sII', icc_profile[entry:entry + 12])
+
+                if signature != b'desc':
+                    continue
+
+                tag = icc_profile[offset:offset + size]
+
+                # ICC v2 textDescriptionType, ASCII
+                if tag[:4] == b'desc':
+                    length = struct.unpack('>I', tag[8:12])[0]
+                    return tag[12:12 + length].split(b'\x00')[0].decode('latin-1')
+
+                # ICC v4 multiLocalizedUnicodeType, use the first record
+                if tag[:4] == b'mluc':
+                    length, record_offset = struct.unpack('>II', tag[20:28])
+                    return tag[record_offset:record_offset + length].decode('utf-16-be')
+
+                return None
+        except (struct.error, UnicodeDecodeError):
+            return None
+
+        return None
+
+    @classmethod
+    def incr(cls, context, metric):
+        if context.metrics is not None:
+            context.metrics.incr(metric)
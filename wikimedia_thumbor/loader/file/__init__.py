@@ -10,29 +10,22 @@
 # Copyright (c) 2018 Wikimedia Foundation
 
 # File loader. Unlike the stock Thumbor one, passes an excerpt
-# in the buffer and passes the file location via context, to mimick
+# in the buffer and passes a handle on the file via context, to mimick
 # what the other custom loaders do.
 
 from datetime import datetime
 from os import fstat
 from os.path import join, exists, abspath
-from tempfile import NamedTemporaryFile
-import tornado.simple_httpclient
-from functools import partial
-
 from thumbor.loaders import LoaderResult
 
-from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 def should_run(url):  # pragma: no cover
     return True
 
 
-def cleanup_temp_file(path):
-    ShellRunner.rm_f(path)
-
-
 async def load(context, path):
     file_path = join(context.config.FILE_LOADER_ROOT_PATH.rstrip('/'), path.lstrip('/'))
     file_path = abspath(file_path)
@@ -46,25 +39,14 @@ async def load(context, path):
             stats = fstat(f.fileno())
 
             result.successful = True
-            response = f.read()
 
             excerpt_length = context.config.LOADER_EXCERPT_LENGTH
-            result.buffer = response[:excerpt_length]
+            result.buffer = f.read(excerpt_length)
 
             if len(result.buffer) == excerpt_length:
-                temp = NamedTemporaryFile(delete=False)
-                temp.write(response)
-                temp.close()
-
-                context.wikimedia_original_file = temp
-
-                tornado.ioloop.IOLoop.instance().call_later(
-                    context.config.HTTP_LOADER_TEMP_FILE_TIMEOUT,
-                    partial(
-                        cleanup_temp_file,
-                        context.wikimedia_original_file.name
-                    )
-                )
+                context.wikimedia_original_file = SourceHandle.link(context, file_path)
+
+                TempArena.release_later(context, context.wikimedia_original_file.close)
 
             result.metadata.update(
                 size=stats.st_size,
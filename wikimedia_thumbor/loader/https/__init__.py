@@ -14,47 +14,42 @@
 
 import re
 from functools import partial
-from tempfile import NamedTemporaryFile
 import tornado.simple_httpclient
 
 
 from thumbor.loaders import http_loader
 from thumbor.utils import logger
 
-from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 def should_run(url):  # pragma: no cover
     return True
 
 
-def cleanup_temp_file(path):
-    logger.debug('[HTTPS] cleanup_temp_file: %s' % path)
-    ShellRunner.rm_f(path)
+def cleanup_temp_file(handle):
+    logger.debug('[HTTPS] cleanup_temp_file: %r' % handle)
+    handle.close()
 
 
 def return_contents(response, url, context, f):  # pragma: no cover
     excerpt_length = context.config.LOADER_EXCERPT_LENGTH
 
-    f.seek(0)
     body = f.read(excerpt_length)
-    f.close()
 
     # First kb of the body for MIME detection
     response._body = body
 
     if len(body) == excerpt_length:
-        logger.debug('[HTTPS] return_contents: %s' % f.name)
+        logger.debug('[HTTPS] return_contents: %r' % f)
         context.wikimedia_original_file = f
 
-        tornado.ioloop.IOLoop.instance().call_later(
-            context.config.HTTP_LOADER_TEMP_FILE_TIMEOUT,
-            partial(cleanup_temp_file, context.wikimedia_original_file.name)
-        )
+        TempArena.release_later(context, partial(cleanup_temp_file, context.wikimedia_original_file))
     else:
-        # If the body is small we can delete the temp file immediately
+        # If the body is small we can release the handle immediately
         logger.debug('[HTTPS] return_contents: small body')
-        cleanup_temp_file(f.name)
+        cleanup_temp_file(f)
 
     return http_loader.return_contents(response, url, context)
 
@@ -89,7 +84,7 @@ async def load(context, url):
     if user_agent is None:
         user_agent = context.config.HTTP_LOADER_DEFAULT_USER_AGENT
 
-    f = NamedTemporaryFile(delete=False)
+    f = SourceHandle.anonymous(context)
 
     url = _normalize_url(url)
 
@@ -112,7 +107,11 @@ async def load(context, url):
         streaming_callback=partial(stream_contents, f=f)
     )
 
-    response = await client.fetch(req)
+    try:
+        response = await client.fetch(req)
+    except Exception:
+        cleanup_temp_file(f)
+        raise
 
     return return_contents(response, url, context, f)
 
@@ -14,7 +14,6 @@
 import datetime
 import requests
 from functools import partial
-from tempfile import NamedTemporaryFile
 from swiftclient import client
 from swiftclient.exceptions import ClientException
 import tornado.simple_httpclient
@@ -23,17 +22,18 @@ import tornado.simple_httpclient
 from thumbor.loaders import LoaderResult
 from thumbor.utils import logger
 
-from wikimedia_thumbor.shell_runner import ShellRunner
 from wikimedia_thumbor.logging import record_timing, log_extra
+from wikimedia_thumbor.source_handle import SourceHandle
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 def should_run(url):  # pragma: no cover
     return True
 
 
-def cleanup_temp_file(context, path):
-    logger.debug('[SWIFT_LOADER] cleanup_temp_file: %s' % path, extra=log_extra(context))
-    ShellRunner.rm_f(path)
+def cleanup_temp_file(context, handle):
+    logger.debug('[SWIFT_LOADER] cleanup_temp_file: %r' % handle, extra=log_extra(context))
+    handle.close()
 
 
 def swift(context):
@@ -96,14 +96,6 @@ async def load(context, url):
         extension = path[-4:].lower()
         isSTL = extension == '.stl'
 
-        f = NamedTemporaryFile(delete=False)
-        logger.debug(
-            '[SWIFT_LOADER] writing %d bytes to temp file' % len(response),
-            extra=log_extra(context)
-        )
-        f.write(response)
-        f.close()
-
         excerpt_length = context.config.LOADER_EXCERPT_LENGTH
 
         # First kb of the body for MIME detection
@@ -115,21 +107,24 @@ async def load(context, url):
         if isSTL:
             body = 'solid'.encode() + body[5:]
 
+        # Small bodies are entirely in the excerpt and don't need a handle
         if len(body) == excerpt_length:
-            logger.debug('[SWIFT_LOADER] return_contents: %s' % f.name, extra=log_extra(context))
-            context.wikimedia_original_file = f
+            logger.debug(
+                '[SWIFT_LOADER] writing %d bytes to source handle' % len(response),
+                extra=log_extra(context)
+            )
+            context.wikimedia_original_file = SourceHandle.from_bytes(context, response)
 
-            tornado.ioloop.IOLoop.instance().call_later(
-                context.config.HTTP_LOADER_TEMP_FILE_TIMEOUT,
+            TempArena.release_later(
+                context,
                 partial(
                     cleanup_temp_file,
                     context,
-                    context.wikimedia_original_file.name
+                    context.wikimedia_original_file
                 )
             )
         else:
             logger.debug('[SWIFT_LOADER] return_contents: small body')
-            cleanup_temp_file(context, f.name)
 
         result.buffer = body
     except ClientException as e:
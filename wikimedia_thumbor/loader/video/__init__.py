@@ -17,17 +17,15 @@
 import errno
 import re
 import os
-from tempfile import NamedTemporaryFile
 
 from thumbor.loaders import LoaderResult
 from thumbor.utils import logger
 
-from tornado.process import Subprocess
 
-
-from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.shell_runner import ShellRunner, CommandTimeoutError
 from wikimedia_thumbor.logging import log_extra
 from wikimedia_thumbor.loader.swift import swift
+from wikimedia_thumbor.temp_arena import TempArena
 
 
 swiftconn = None
@@ -75,19 +73,18 @@ async def load(context, url):
 
     command += ['%s' % normalized_url]
 
-    command = ShellRunner.wrap_command(command, context)
-
     logger.debug('[Video] load: %r' % command)
 
-    process = Subprocess(
-        command,
-        stdout=Subprocess.STREAM,
-        stderr=Subprocess.STREAM
-    )
+    try:
+        status, stderr, stdout = await ShellRunner.command_async(command, context)
+    except CommandTimeoutError:
+        result = LoaderResult()
+        result.successful = False
+        result.error = LoaderResult.ERROR_TIMEOUT
 
-    status = await process.wait_for_exit(False)
+        return result
 
-    return await _parse_time_status(context, normalized_url, process, status)
+    return await _parse_time_status(context, normalized_url, stderr, stdout, status)
 
 
 def get_swift_token(context):
@@ -95,16 +92,9 @@ def get_swift_token(context):
     return token
 
 
-def _http_code_from_stderr(context, process, result, normalized_url):
+def _http_code_from_stderr(context, stderr, result, normalized_url):
     result.successful = False
 
-    stderr = bytearray(4096)
-    nread = process.stderr.read_from_fd(stderr)
-    # read_from_fd writes into the buffer but doesn't resize it; truncate to
-    # the number of bytes actually read so we don't log thousands of trailing
-    # null bytes.
-    stderr = stderr[:nread] if nread else bytearray()
-
     extra = log_extra(context)
     extra['stderr'] = stderr
     extra['normalized_url'] = normalized_url
@@ -112,7 +102,7 @@ def _http_code_from_stderr(context, process, result, normalized_url):
     logger.error(f'[Video] Fprobe/ffmpeg errored: {stderr}', extra=extra)
     http_error_re = re.compile(r'.*Server returned (\d\d\d).*', re.MULTILINE)
     code = None
-    for stderr_line in stderr.decode('utf-8').split("\n"):
+    for stderr_line in stderr.decode('utf-8', 'replace').split("\n"):
         code_match = http_error_re.match(stderr_line)
         if code_match:
             code = code_match
@@ -128,22 +118,15 @@ def _http_code_from_stderr(context, process, result, normalized_url):
         result.error = LoaderResult.ERROR_UPSTREAM
 
 
-async def _parse_time_status(context, normalized_url, process, status):
+async def _parse_time_status(context, normalized_url, stderr, stdout, status):
     if status != 0:
         result = LoaderResult()
 
-        _http_code_from_stderr(context, process, result, normalized_url)
-        process.stdout.close()
-        process.stderr.close()
+        _http_code_from_stderr(context, stderr, result, normalized_url)
 
         return result
     else:
-        output = await process.stdout.read_until_close()
-
-        process.stdout.close()
-        process.stderr.close()
-
-        return await _parse_time(context, normalized_url, output)
+        return await _parse_time(context, normalized_url, stdout)
 
 
 async def _parse_time(context, normalized_url, output):
@@ -163,7 +146,7 @@ async def _parse_time(context, normalized_url, output):
 
 
 async def seek_and_screenshot(context, normalized_url, seek):
-    output_file = NamedTemporaryFile(delete=False)
+    output_file = TempArena.named_temporary_file(context, delete=False)
 
     command = [
         context.config.FFMPEG_PATH,
@@ -196,28 +179,28 @@ async def seek_and_screenshot(context, normalized_url, seek):
         output_file.name
     ]
 
-    command = ShellRunner.wrap_command(command, context)
-
     logger.debug('[Video] _parse_time: %r' % command)
 
-    process = Subprocess(
-        command,
-        stdout=Subprocess.STREAM,
-        stderr=Subprocess.STREAM
-    )
+    timed_out = False
 
-    status = await process.wait_for_exit(False)
+    try:
+        status, stderr, stdout = await ShellRunner.command_async(command, context)
+    except CommandTimeoutError as e:
+        stderr = e.args[2]
+        status = 124
+        timed_out = True
 
-    return await _process_done(process, context, normalized_url, seek, output_file, status)
+    return await _process_done(stderr, context, normalized_url, seek, output_file, status, timed_out)
 
 
 async def _process_done(
-        process,
+        stderr,
         context,
         normalized_url,
         seek,
         output_file,
-        status
+        status,
+        timed_out=False
         ):
     # T183907 Sometimes ffmpeg returns status 0 and actually fails to
     # generate a thumbnail. We double-check the existence of the thumbnail
@@ -229,19 +212,27 @@ async def _process_done(
     # If rendering the desired frame fails, attempt to render the
     # first frame instead
     if status != 0 and seek > 0:
+        _remove_output_file(context, output_file)
+
         return await seek_and_screenshot(context, normalized_url, 0)
 
     result = LoaderResult()
 
-    if status != 0:  # pragma: no cover
-        _http_code_from_stderr(context, process, result, normalized_url)
+    if timed_out:
+        result.successful = False
+        result.error = LoaderResult.ERROR_TIMEOUT
+    elif status != 0:  # pragma: no cover
+        _http_code_from_stderr(context, stderr, result, normalized_url)
     else:
         result.successful = True
         result.buffer = output_file.read()
 
-    process.stdout.close()
-    process.stderr.close()
+    _remove_output_file(context, output_file)
 
+    return result
+
+
+def _remove_output_file(context, output_file):
     output_file.close()
 
     try:
@@ -251,8 +242,6 @@ async def _process_done(
             logger.error('[Video] Unable to unlink output file', extra=log_extra(context))
             raise
 
-    return result
-
 
 def _normalize_url(url):
     # URLs provided by Thumbor to load() are fully URL-escaped, including the protocol.
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Rewrites the metadata of JPEG and WebP thumbnails in-process
+#
+# This does what "exiftool -all= -icc_profile<=... -Field=value" does to
+# a thumbnail, without the subprocess. For JPEG, existing APP and COM
+# segments are dropped, then an APP1 EXIF segment containing the fields we
+# keep and the APP2 segments of the ICC profile are inserted after SOI.
+# Like exiftool, the Adobe APP14 segment is kept, since it affects how
+# the colours of the image are decoded.
+#
+# For WebP, the ICCP, EXIF and XMP chunks are replaced, and the VP8X
+# header chunk those require is written or updated.
+
+import struct
+
+from wikimedia_thumbor.header_sniffer import HeaderSniffer
+
+
+class UnsupportedMetadata(Exception):
+    pass
+
+
+class MetadataWriter:
+    # EXIF IFD0 tags of type ASCII we know how to write
+    exif_ascii_tags = {
+        'ImageDescription': 0x010E,
+        'Make': 0x010F,
+        'Model': 0x0110,
+        'Software': 0x0131,
+        'Artist': 0x013B,
+        'Copyright': 0x8298,
+    }
+
+    icc_marker = b'ICC_PROFILE\x00'
+
+    # Segment length field, identifier and chunk numbering take the rest
+    icc_chunk_size = 65535 - 2 - len(icc_marker) - 2
+
+    @classmethod
+    def rewrite(cls, buffer, icc_profile=None, exif_fields=None):
+        """Same as rewrite_jpeg or rewrite_webp, depending on the format
+        of buffer."""
+        if buffer[:4] == b'RIFF' and buffer[8:12] == b'WEBP':
+            return cls.rewrite_webp(buffer, icc_profile, exif_fields)
+
+        return cls.rewrite_jpeg(buffer, icc_profile, exif_fields)
+
+    @classmethod
+    def rewrite_jpeg(cls, buffer, icc_profile=None, exif_fields=None):
+        """Returns the JPEG in buffer with its metadata replaced by the
+        ICC profile and EXIF fields passed.
+
+        Raises UnsupportedMetadata when that can't be done in-process."""
+        if buffer[:2] != b'\xff\xd8':
+            raise UnsupportedMetadata('Not a JPEG')
+
+        segments = [b'\xff\xd8']
+
+        exif = cls.exif_segment(exif_fields or {})
+
+        if exif is not None:
+            segments.append(exif)
+
+        if icc_profile:
+            segments += cls.icc_segments(icc_profile)
+
+        position = 2
+        length = len(buffer)
+
+        while True:
+            if position + 2 > length or buffer[position] != 0xFF:
+                raise UnsupportedMetadata('Corrupt JPEG segment at offset %d' % position)
+
+            marker = buffer[position + 1]
+
+            # Fill bytes
+            if marker == 0xFF:
+                position += 1
+                continue
+
+            # From the start of the scan (or the end of a file without one),
+            # the rest of the file is image data
+            if marker in (0xDA, 0xD9):
+                segments.append(buffer[position:])
+                break
+
+            # Markers without a payload
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                segments.append(buffer[position:position + 2])
+                position += 2
+                continue
+
+            if position + 4 > length:
+                raise UnsupportedMetadata('Truncated JPEG segment at offset %d' % position)
+
+            size = struct.unpack('>H', buffer[position + 2:position + 4])[0]
+            end = position + 2 + size
+
+            if size < 2 or end > length:
+                raise UnsupportedMetadata('Truncated JPEG segment at offset %d' % position)
+
+            segment = buffer[position:end]
+            position = end
+
+            if marker == 0xFE:
+                continue
+
+            if 0xE0 <= marker <= 0xEF:
+                if marker != 0xEE or segment[4:9] != b'Adobe':
+                    continue
+
+            segments.append(segment)
+
+        return b''.join(segments)
+
+    @classmethod
+    def rewrite_webp(cls, buffer, icc_profile=None, exif_fields=None):
+        """Returns the WebP in buffer with its metadata replaced by the
+        ICC profile and EXIF fields passed.
+
+        Raises UnsupportedMetadata when that can't be done in-process."""
+        if buffer[:4] != b'RIFF' or buffer[8:12] != b'WEBP':
+            raise UnsupportedMetadata('Not a WebP')
+
+        header = HeaderSniffer.sniff(buffer)
+
+        if header is None:
+            raise UnsupportedMetadata('Unreadable WebP header')
+
+        image_chunks = []
+        position = 12
+        # Ignores anything trailing the RIFF container
+        length = min(len(buffer), 8 + struct.unpack('<I', buffer[4:8])[0])
+
+        while position < length:
+            if position + 8 > length:
+                raise UnsupportedMetadata('Truncated WebP chunk at offset %d' % position)
+
+            fourcc, size = struct.unpack('<4sI', buffer[position:position + 8])
+            payload = buffer[position + 8:position + 8 + size]
+
+            if len(payload) != size:
+                raise UnsupportedMetadata('Truncated WebP chunk at offset %d' % position)
+
+            # Chunks are padded to an even size
+            position += 8 + size + (size & 1)
+
+            if fourcc not in (b'VP8X', b'ICCP', b'EXIF', b'XMP '):
+                image_chunks.append((fourcc, payload))
+
+        exif = cls.exif_tiff(exif_fields or {})
+        fourccs = [fourcc for fourcc, payload in image_chunks]
+
+        flags = 0
+
+        if icc_profile:
+            flags |= 0x20
+        if header.has_alpha or b'ALPH' in fourccs:
+            flags |= 0x10
+        if exif is not None:
+            flags |= 0x08
+        if b'ANIM' in fourccs:
+            flags |= 0x02
+
+        chunks = []
+
+        # Simple lossy or lossless files don't need the extended header
+        if icc_profile or exif is not None or set(fourccs) & {b'ALPH', b'ANIM', b'ANMF'}:
+            chunks.append(cls.chunk(
+                b'VP8X',
+                struct.pack('<B3x', flags)
+                + (header.width - 1).to_bytes(3, 'little')
+                + (header.height - 1).to_bytes(3, 'little')
+            ))
+
+        if icc_profile:
+            chunks.append(cls.chunk(b'ICCP', icc_profile))
+
+        chunks += [cls.chunk(fourcc, payload) for fourcc, payload in image_chunks]
+
+        if exif is not None:
+            chunks.append(cls.chunk(b'EXIF', exif))
+
+        body = b'WEBP' + b''.join(chunks)
+
+        return b'RIFF' + struct.pack('<I', len(body)) + body
+
+    @classmethod
+    def chunk(cls, fourcc, payload):
+        padding = b'\x00' if len(payload) & 1 else b''
+
+        return fourcc + struct.pack('<I', len(payload)) + payload + padding
+
+    @classmethod
+    def segment(cls, marker, payload):
+        if len(payload) + 2 > 65535:
+            raise UnsupportedMetadata('Segment too large: %d bytes' % len(payload))
+
+        return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+    @classmethod
+    def icc_segments(cls, icc_profile):
+        chunks = [
+            icc_profile[i:i + cls.icc_chunk_size]
+            for i in range(0, len(icc_profile), cls.icc_chunk_size)
+        ]
+
+        if len(chunks) > 255:
+            raise UnsupportedMetadata('ICC profile too large: %d bytes' % len(icc_profile))
+
+        return [
+            cls.segment(0xE2, cls.icc_marker + struct.pack('>BB', index + 1, len(chunks)) + chunk)
+            for index, chunk in enumerate(chunks)
+        ]
+
+    @classmethod
+    def exif_segment(cls, exif_fields):
+        tiff = cls.exif_tiff(exif_fields)
+
+        if tiff is None:
+            return None
+
+        return cls.segment(0xE1, b'Exif\x00\x00' + tiff)
+
+    @classmethod
+    def exif_tiff(cls, exif_fields):
+        entries = []
+
+        for field, value in exif_fields.items():
+            if field not in cls.exif_ascii_tags:
+                raise UnsupportedMetadata('Unsupported EXIF field: %s' % field)
+
+            value = str(value).encode('utf-8')
+
+            if b'\x00' in value:
+                raise UnsupportedMetadata('NUL byte in EXIF field: %s' % field)
+
+            # exiftool deletes fields set to an empty value
+            if value:
+                entries.append((cls.exif_ascii_tags[field], value + b'\x00'))
+
+        if not entries:
+            return None
+
+        entries.sort()
+
+        # Big endian TIFF header, followed by IFD0 and the values that
+        # don't fit in their entry
+        header = b'MM\x00\x2a' + struct.pack('>I', 8)
+        data_offset = 8 + 2 + 12 * len(entries) + 4
+
+        ifd = struct.pack('>H', len(entries))
+        data = b''
+
+        for tag, value in entries:
+            if len(value) <= 4:
+                ifd += struct.pack('>HHI', tag, 2, len(value)) + value.ljust(4, b'\x00')
+                continue
+
+            ifd += struct.pack('>HHII', tag, 2, len(value), data_offset + len(data))
+            data += value
+
+            # Values start on word boundaries
+            if len(data) % 2:
+                data += b'\x00'
+
+        # No IFD1
+        ifd += struct.pack('>I', 0)
+
+        return header + ifd + data
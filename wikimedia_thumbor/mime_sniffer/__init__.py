@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# MIME type detection from the first bytes of a file
+#
+# Thumbor's formats and the ones engines add are registered as signatures:
+# magic bytes at an offset, or a test function for formats without any.
+# Signatures are indexed by the first byte they can match, so detecting a
+# MIME type only tries the few signatures that could match the buffer.
+#
+# Signatures are tried by decreasing priority, then by MIME type, which
+# doesn't depend on the order in which engines are imported:
+# - MAGIC for magic bytes
+# - HEURISTIC for tests that could match files of another format
+# - FALLBACK for Thumbor's own SVG detection, which searches the buffer
+#
+# Registering a MIME type again at the same priority replaces its signature.
+
+from thumbor import engines
+from thumbor.engines import BaseEngine
+
+
+class Signature:
+    def __init__(self, mime, magic=None, offset=0, test=None, priority=0, prefixes=None):
+        self.mime = mime
+        self.magic = magic
+        self.offset = offset
+        self.test = test
+        self.priority = priority
+
+        # First bytes the signature can match, None for any
+        if prefixes is None and magic is not None and offset == 0:
+            alternatives = magic if isinstance(magic, tuple) else (magic,)
+            prefixes = sorted(set(alternative[:1] for alternative in alternatives))
+
+        self.prefixes = prefixes
+
+    def matches(self, buffer):
+        if self.magic is not None and not buffer.startswith(self.magic, self.offset):
+            return False
+
+        return self.test is None or bool(self.test(buffer))
+
+    def __repr__(self):
+        return '<Signature %s %r+%d priority=%d>' % (self.mime, self.magic, self.offset, self.priority)
+
+
+class MimeSniffer:
+    MAGIC = 2
+    HEURISTIC = 1
+    FALLBACK = 0
+
+    signatures = {}
+
+    # Signatures to try, by first byte of the buffer
+    index = {}
+
+    # Signatures that can match any first byte
+    unindexed = []
+
+    # Thumbor's own detection, as it was before install
+    thumbor_get_mimetype = BaseEngine.get_mimetype
+
+    @classmethod
+    def register(cls, mime, magic=None, offset=0, test=None, priority=None, prefixes=None):
+        """Detects mime in buffers with magic at offset that pass test.
+        magic can be a tuple of alternatives. Without magic, prefixes are
+        the first bytes test can accept, None for any."""
+        if priority is None:
+            priority = cls.HEURISTIC if magic is None else cls.MAGIC
+
+        cls.signatures[(mime, priority)] = Signature(mime, magic, offset, test, priority, prefixes)
+        cls.reindex()
+
+    @classmethod
+    def reindex(cls):
+        ordered = sorted(cls.signatures.values(), key=lambda signature: (-signature.priority, signature.mime))
+        unindexed = [signature for signature in ordered if signature.prefixes is None]
+        index = {}
+
+        for signature in ordered:
+            for prefix in signature.prefixes or ():
+                index[prefix] = None
+
+        # Each list keeps the overall order, unindexed signatures included
+        for prefix in index:
+            index[prefix] = [
+                signature for signature in ordered
+                if signature.prefixes is None or prefix in signature.prefixes
+            ]
+
+        cls.index = index
+        cls.unindexed = unindexed
+
+    @classmethod
+    def sniff(cls, buffer):
+        """MIME type of the file starting with buffer, None if unknown."""
+        for signature in cls.index.get(bytes(buffer[:1]), cls.unindexed):
+            if signature.matches(buffer):
+                return signature.mime
+
+        return None
+
+    @classmethod
+    def install(cls):
+        """Replaces Thumbor's MIME type detection."""
+        BaseEngine.get_mimetype = classmethod(lambda engine, buffer: cls.sniff(buffer))
+
+
+# Thumbor's own formats, see thumbor.engines.BaseEngine.get_mimetype
+MimeSniffer.register('image/gif', b'GIF8')
+MimeSniffer.register('image/png', b'\x89PNG\r\n\x1a\n')
+MimeSniffer.register('image/jpeg', b'\xff\xd8')
+MimeSniffer.register('image/webp', b'WEBP', offset=8)
+MimeSniffer.register('image/jp2', b'\x00\x00\x00\x0c')
+MimeSniffer.register('image/avif', (b'ftypavif', b'ftypavis'), offset=4)
+MimeSniffer.register(
+    'image/heif',
+    b'ftyp',
+    offset=4,
+    test=lambda buffer: buffer[8:12] in (b'heic', b'heix', b'heim', b'heis', b'mif1')
+)
+MimeSniffer.register('video/mp4', b'\x00\x00\x00 ftyp')
+MimeSniffer.register('video/webm', b'\x1aE\xdf\xa3')
+MimeSniffer.register('image/tiff', (b'II*\x00', b'MM\x00*'))
+MimeSniffer.register(
+    'image/svg+xml',
+    test=lambda buffer: engines.SVG_RE.search(bytes(buffer[:2048]).replace(b'\0', b'')),
+    priority=MimeSniffer.FALLBACK
+)
+
+MimeSniffer.install()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Loads engines outside of the IOLoop
+#
+# Thumbor calls engine.load() straight from the IOLoop, whether or not
+# ENGINE_THREADPOOL_SIZE is set. Our engines render whole documents there
+# (Ghostscript, ddjvu, rsvg-convert, vips, 3d2png) and probe originals with
+# exiftool, which froze the worker, cache hits included, for as long as it
+# took.
+#
+# The mixin is Thumbor's _fetch, in which the engine is loaded in Thumbor's
+# engine thread pool, or the IOLoop's default executor without one. Commands
+# run from there are handed over to the IOLoop, see ShellRunner.command.
+
+from thumbor.engines import BaseEngine, EngineResult
+from thumbor.handlers import FetchResult
+from thumbor.loaders import LoaderResult
+from thumbor.storages.mixed_storage import Storage as MixedStorage
+from thumbor.storages.no_storage import Storage as NoStorage
+from thumbor.utils import EXTENSION
+from tornado.ioloop import IOLoop
+
+
+class OffLoopFetchMixin:
+    async def load_engine(self, engine, buffer, extension):
+        thread_pool = getattr(self.context, 'thread_pool', None)
+        pool = None if thread_pool is None else thread_pool.pool
+
+        await IOLoop.current().run_in_executor(pool, engine.load, buffer, extension)
+
+    # Same as thumbor.handlers.BaseHandler._fetch from Thumbor 7.3, but for
+    # load_engine
+    async def _fetch(self, url):
+        fetch_result = FetchResult()
+
+        storage = self.context.modules.storage
+
+        await self.acquire_url_lock(url)
+
+        try:
+            fetch_result.buffer = await storage.get(url)
+            mime = None
+
+            if fetch_result.buffer is not None:
+                self.release_url_lock(url)
+
+                fetch_result.successful = True
+
+                self.context.metrics.incr("storage.hit")
+
+                mime = BaseEngine.get_mimetype(fetch_result.buffer)
+                self.context.request.extension = EXTENSION.get(mime, ".jpg")
+
+                if (
+                    mime == "image/gif"
+                    and self.context.config.USE_GIFSICLE_ENGINE
+                ):
+                    self.context.request.engine = (
+                        self.context.modules.gif_engine
+                    )
+                else:
+                    self.context.request.engine = self.context.modules.engine
+
+                return fetch_result
+
+            self.context.metrics.incr("storage.miss")
+
+            loader_result = await self.context.modules.loader.load(
+                self.context, url
+            )
+        finally:
+            self.release_url_lock(url)
+
+        if isinstance(loader_result, LoaderResult):
+            if not loader_result.successful:
+                fetch_result.buffer = None
+                fetch_result.loader_error = loader_result.error
+
+                return fetch_result
+
+            fetch_result.buffer = loader_result.buffer
+        else:
+            # Handle old loaders
+            fetch_result.buffer = loader_result
+
+        if fetch_result.buffer is None:
+            return fetch_result
+
+        fetch_result.successful = True
+
+        if mime is None:
+            mime = BaseEngine.get_mimetype(fetch_result.buffer)
+
+        self.context.request.extension = extension = EXTENSION.get(
+            mime, ".jpg"
+        )
+
+        try:
+            if mime == "image/gif" and self.context.config.USE_GIFSICLE_ENGINE:
+                self.context.request.engine = self.context.modules.gif_engine
+            else:
+                self.context.request.engine = self.context.modules.engine
+
+            await self.load_engine(self.context.request.engine, fetch_result.buffer, extension)
+
+            if self.context.request.engine.image is None:
+                fetch_result.successful = False
+                fetch_result.buffer = None
+                fetch_result.engine = self.context.request.engine
+                fetch_result.engine_error = EngineResult.COULD_NOT_LOAD_IMAGE
+
+                return fetch_result
+
+            fetch_result.normalized = self.context.request.engine.normalize()
+
+            # Allows engine or loader to override storage
+            # on the fly for the purpose of
+            # marking a specific file as unstoreable
+            storage = self.context.modules.storage
+
+            is_no_storage = isinstance(storage, NoStorage)
+            is_mixed_storage = isinstance(storage, MixedStorage)
+            is_mixed_no_file_storage = is_mixed_storage and isinstance(
+                storage.file_storage, NoStorage
+            )
+
+            if not (is_no_storage or is_mixed_no_file_storage):
+                await storage.put(url, fetch_result.buffer)
+
+            await storage.put_crypto(url)
+        except Exception as error:
+            fetch_result.successful = False
+            fetch_result.exception = error
+
+        if not fetch_result.successful and fetch_result.exception is not None:
+            raise fetch_result.exception
+        fetch_result.buffer = None
+        fetch_result.engine = self.context.request.engine
+
+        return fetch_result
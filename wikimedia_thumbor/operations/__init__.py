@@ -0,0 +1,368 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Image operations queued by the engines and filters
+#
+# Engines record what Thumbor asks of them as typed operations rather
+# than command line arguments. Before running them, the graph is
+# optimized for the size of the source:
+# - consecutive rotations and flips are fused into a single orientation
+# - crops are moved ahead of orientations and resizes, so that the rest of
+#   the operations only process the pixels kept
+# - resizes, crops and orientations that wouldn't change anything are
+#   dropped
+#
+# The optimized graph is then compiled to convert arguments, or applied
+# by an in-process backend such as the libvips engine.
+#
+# Crops aren't moved ahead of resizes that carry a decoding hint, since
+# the loader shrinks the source before any crop could run.
+
+import math
+
+
+class Operation:
+    def output_size(self, size):
+        """Size of the image after the operation, given its size before."""
+        return size
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            type(self).__name__,
+            ', '.join('%s=%r' % item for item in self.__dict__.items())
+        )
+
+
+class Raw(Operation):
+    """ImageMagick settings that don't change the geometry of the image."""
+    def __init__(self, args):
+        self.args = list(args)
+
+    def to_convert(self):
+        return self.args
+
+
+class Resize(Operation):
+    """Scales the image to fill width x height, then crops what overflows
+    around the centre.
+
+    hint is the size the loader may shrink the source to while decoding."""
+    def __init__(self, width, height, hint=None):
+        self.width = int(width)
+        self.height = int(height)
+        self.hint = hint
+
+    def output_size(self, size):
+        return (self.width, self.height)
+
+    def scale(self, size):
+        return max(self.width / size[0], self.height / size[1])
+
+    def source_region(self, size, region):
+        """Maps a region of the output back to the source."""
+        scale = self.scale(size)
+        left, top, right, bottom = region
+
+        offset_x = (size[0] * scale - self.width) / 2
+        offset_y = (size[1] * scale - self.height) / 2
+
+        return (
+            (left + offset_x) / scale,
+            (top + offset_y) / scale,
+            (right + offset_x) / scale,
+            (bottom + offset_y) / scale
+        )
+
+    def to_convert(self):
+        args = []
+
+        if self.hint is not None:
+            args += ['-define', 'jpeg:size=%dx%d' % self.hint]
+
+        target_size = '%dx%d' % (self.width, self.height)
+
+        # The ^ + gravity + extent trick is necessary to ensure that we get a thumbnail
+        # of exactly the width we've requested. In some edge cases a tiny fraction
+        # of the image might be cropped out. This is unavoidable with ImageMagick
+        # See http://www.imagemagick.org/Usage/resize/ for details
+        return args + [
+            '-resize',
+            '%s^' % target_size,
+            '-gravity',
+            'center',
+            '-extent',
+            target_size
+        ]
+
+
+class Crop(Operation):
+    def __init__(self, left, top, width, height):
+        self.left = int(left)
+        self.top = int(top)
+        self.width = int(width)
+        self.height = int(height)
+
+    def output_size(self, size):
+        return (
+            max(0, min(self.width, size[0] - self.left)),
+            max(0, min(self.height, size[1] - self.top))
+        )
+
+    @property
+    def region(self):
+        return (self.left, self.top, self.left + self.width, self.top + self.height)
+
+    @classmethod
+    def from_region(cls, size, region):
+        """Smallest crop containing region, within an image of size."""
+        left = max(0, math.floor(region[0] + 1e-6))
+        top = max(0, math.floor(region[1] + 1e-6))
+        right = min(size[0], math.ceil(region[2] - 1e-6))
+        bottom = min(size[1], math.ceil(region[3] - 1e-6))
+
+        return cls(left, top, right - left, bottom - top)
+
+    def to_convert(self):
+        return [
+            '-crop',
+            '%dx%d+%d+%d' % (self.width, self.height, self.left, self.top),
+            '+repage'
+        ]
+
+
+class Orient(Operation):
+    """Horizontal flip if flop, followed by a clockwise rotation by a
+    multiple of 90 degrees."""
+    def __init__(self, rotation=0, flop=False):
+        self.rotation = int(rotation) % 360
+        self.flop = flop
+
+    @classmethod
+    def flip(cls):
+        # A vertical flip is a horizontal one, turned upside down
+        return cls(180, True)
+
+    def then(self, other):
+        """The orientation applying self, then other."""
+        if other.flop:
+            # Flopping after rotating is the same as rotating the other way
+            # after flopping
+            return Orient(other.rotation - self.rotation, not self.flop)
+
+        return Orient(self.rotation + other.rotation, self.flop)
+
+    def inverse(self):
+        # Orientations with a flip are their own inverse
+        if self.flop:
+            return Orient(self.rotation, True)
+
+        return Orient(-self.rotation)
+
+    @property
+    def identity(self):
+        return self.rotation == 0 and not self.flop
+
+    def output_size(self, size):
+        if self.rotation in (90, 270):
+            return (size[1], size[0])
+
+        return size
+
+    def map_region(self, size, region):
+        """Maps a region of the source to the output."""
+        width, height = size
+        left, top, right, bottom = region
+
+        if self.flop:
+            left, right = width - right, width - left
+
+        if self.rotation == 90:
+            return (height - bottom, left, height - top, right)
+        if self.rotation == 180:
+            return (width - right, height - bottom, width - left, height - top)
+        if self.rotation == 270:
+            return (top, width - right, bottom, width - left)
+
+        return (left, top, right, bottom)
+
+    def source_region(self, size, region):
+        """Maps a region of the output back to the source."""
+        return self.inverse().map_region(self.output_size(size), region)
+
+    def to_convert(self):
+        if self.rotation == 0 and self.flop:
+            return ['-flop']
+
+        if self.rotation == 180 and self.flop:
+            return ['-flip']
+
+        args = ['-flop'] if self.flop else []
+
+        if self.rotation:
+            args += ['-rotate', '%d' % self.rotation]
+
+        return args
+
+
+class Rotate(Operation):
+    """Clockwise rotation by an arbitrary angle."""
+    def __init__(self, degrees):
+        self.degrees = degrees
+
+    def output_size(self, size):
+        angle = math.radians(float(self.degrees))
+        cos, sin = abs(math.cos(angle)), abs(math.sin(angle))
+
+        return (
+            int(math.ceil(size[0] * cos + size[1] * sin - 1e-6)),
+            int(math.ceil(size[0] * sin + size[1] * cos - 1e-6))
+        )
+
+    def to_convert(self):
+        return ['-rotate', '%s' % self.degrees]
+
+
+class Unsharp(Operation):
+    def __init__(self, radius, sigma, amount, threshold):
+        self.radius = float(radius)
+        self.sigma = float(sigma)
+        self.amount = float(amount)
+        self.threshold = float(threshold)
+
+    def to_convert(self):
+        return [
+            '-unsharp',
+            '%fx%f+%f+%f' % (self.radius, self.sigma, self.amount, self.threshold)
+        ]
+
+
+class OperationGraph:
+    def __init__(self, operations=()):
+        self.operations = list(operations)
+
+    def append(self, operation):
+        self.operations.append(operation)
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __repr__(self):
+        return 'OperationGraph(%r)' % self.operations
+
+    def optimize(self, size=None):
+        """Returns an optimized graph, for a source of size. Without the
+        size, only orientations are fused."""
+        operations = self.fuse(self.operations)
+
+        if size is None:
+            return OperationGraph(operations)
+
+        while True:
+            optimized = self.fuse(self.drop_noops(self.hoist_crops(operations, size), size))
+
+            if optimized == operations:
+                return OperationGraph(optimized)
+
+            operations = optimized
+
+    @classmethod
+    def fuse(cls, operations):
+        fused = []
+
+        for operation in operations:
+            if isinstance(operation, Orient) and fused and isinstance(fused[-1], Orient):
+                fused[-1] = fused[-1].then(operation)
+            else:
+                fused.append(operation)
+
+        return [operation for operation in fused if not (isinstance(operation, Orient) and operation.identity)]
+
+    @classmethod
+    def sizes(cls, operations, size):
+        """Size of the image before each operation."""
+        sizes = []
+
+        for operation in operations:
+            sizes.append(size)
+            size = operation.output_size(size)
+
+        return sizes
+
+    @classmethod
+    def hoist_crops(cls, operations, size):
+        operations = list(operations)
+        sizes = cls.sizes(operations, size)
+
+        for index in range(1, len(operations)):
+            crop = operations[index]
+
+            if not isinstance(crop, Crop):
+                continue
+
+            # Settings don't care where the crop happens
+            previous = index - 1
+            while previous > 0 and isinstance(operations[previous], Raw):
+                previous -= 1
+
+            operation = operations[previous]
+
+            if isinstance(operation, Orient) or (isinstance(operation, Resize) and operation.hint is None):
+                input_size = sizes[previous]
+                cropped = crop.output_size(sizes[index])
+
+                if cropped[0] == 0 or cropped[1] == 0:
+                    continue
+
+                region = operation.source_region(input_size, Crop(crop.left, crop.top, *cropped).region)
+                hoisted = Crop.from_region(input_size, region)
+
+                if isinstance(operation, Resize):
+                    replacement = Resize(*cropped)
+                else:
+                    replacement = operation
+
+                operations[index] = replacement
+                operations[previous] = hoisted
+                operations.insert(previous + 1, operations.pop(index))
+
+                return operations
+
+        return operations
+
+    @classmethod
+    def drop_noops(cls, operations, size):
+        sizes = cls.sizes(operations, size)
+        kept = []
+
+        for operation, input_size in zip(operations, sizes):
+            if isinstance(operation, Resize) and operation.output_size(input_size) == input_size:
+                continue
+
+            if isinstance(operation, Crop) and operation.region[:2] == (0, 0) and operation.output_size(input_size) == input_size:
+                continue
+
+            kept.append(operation)
+
+        return kept
+
+    def to_convert(self):
+        args = []
+
+        for operation in self.operations:
+            args += operation.to_convert()
+
+        return args
@@ -20,6 +20,7 @@ from thumbor.result_storages import BaseStorage, ResultStorageResult
 from thumbor.utils import logger
 
 from wikimedia_thumbor.logging import record_timing, log_extra
+from wikimedia_thumbor.size_ladder import SizeLadder
 
 
 class Storage(BaseStorage):
@@ -95,19 +96,22 @@ class Storage(BaseStorage):
 
             start = datetime.datetime.now()
 
-            await tornado.ioloop.IOLoop.current().run_in_executor(
-                None,  # Uses the default ThreadPoolExecutor
-                partial(
-                    self.swift.put_object,
-                    self.context.wikimedia_thumbnail_container,
-                    self.context.wikimedia_thumbnail_save_path,
-                    bytes,
-                    headers=headers,
-                    content_type=content_type,
-                ),
-            )
+            await self.put_object(self.context.wikimedia_thumbnail_save_path, bytes, headers, content_type)
             record_timing(self.context, datetime.datetime.now() - start, 'swift.thumbnail.write.success')
 
+            # The other widths rendered alongside it share the same original,
+            # and therefore the same xkey and Content-Disposition
+            ladder = getattr(self.context, 'wikimedia_size_ladder_results', {})
+
+            for width, ladder_bytes in sorted(ladder.items()):
+                start = datetime.datetime.now()
+                path = SizeLadder.save_path(self.context.wikimedia_thumbnail_save_path, width)
+
+                self.debug('[SWIFT_STORAGE] put size ladder: %r' % path)
+
+                await self.put_object(path, ladder_bytes, headers, content_type)
+                record_timing(self.context, datetime.datetime.now() - start, 'swift.thumbnail.ladder.write.success')
+
             # We cannot set the time spent in putting to swift in the response
             # headers, because the response has already been sent when saving
             # to Swift happens (which is the right thing to do).
@@ -120,6 +124,19 @@ class Storage(BaseStorage):
             # We cannnot let exceptions bubble up, because they would leave
             # the client's connection hanging
 
+    async def put_object(self, path, bytes, headers, content_type):
+        await tornado.ioloop.IOLoop.current().run_in_executor(
+            None,  # Uses the default ThreadPoolExecutor
+            partial(
+                self.swift.put_object,
+                self.context.wikimedia_thumbnail_container,
+                path,
+                bytes,
+                headers=dict(headers),
+                content_type=content_type,
+            ),
+        )
+
     async def get(self):
         self.debug('[SWIFT_STORAGE] get: %r %r' % (
                 self.context.wikimedia_thumbnail_container,
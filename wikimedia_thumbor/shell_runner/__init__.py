@@ -10,45 +10,147 @@
 # Copyright (c) 2015 Wikimedia Foundation
 
 # Utility class to run shell commands safely
-
+#
+# Commands can either be run synchronously with command(), or awaited
+# with command_async(), which doesn't block the IOLoop while the child
+# process is running. The number of children running concurrently through
+# command_async() can be capped with SUBPROCESS_MAX_CONCURRENCY.
+#
+# Every child is reaped with wait4(), which gives us the resources used by
+# that child alone: CPU time, peak RSS and block I/O. They are reported per
+# command as metrics and headers, and summed up on the request context.
+# Commands can also be spawned by a helper process, see the spawner module.
+#
+# pipeline() runs several commands piped into each other, which lets
+# engines stream a converter's output to the next tool or to a file
+# without holding it in memory.
+
+import asyncio
 import datetime
 import errno
 from functools import partial
 import os
 import re
+import signal
 import subprocess
+import tempfile
+import time
 import math
 
+from tornado.locks import Semaphore
+from tornado.iostream import PipeIOStream
+
 from thumbor.utils import logger
+from tornado.ioloop import IOLoop
 from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.spawner import Spawner, SpawnedPopen, SpawnerUnavailable
+
+
+def rusage_to_usage(rusage):
+    return {
+        # CPU times in milliseconds
+        "utime": rusage.ru_utime * 1000,
+        "stime": rusage.ru_stime * 1000,
+        # Peak resident set size in kilobytes
+        "maxrss": rusage.ru_maxrss,
+        # Blocks read and written from/to the filesystem
+        "inblock": rusage.ru_inblock,
+        "oublock": rusage.ru_oublock,
+    }
+
+
+class CommandTimeoutError(Exception):
+    pass
+
+
+class AccountedPopen(subprocess.Popen):
+    """Popen that reaps its child with wait4() to keep the child's resource usage."""
+    usage = None
+
+    # Overrides the hook through which Popen waits on its child
+    def _try_wait(self, wait_flags):
+        try:
+            (pid, sts, rusage) = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:  # pragma: no cover
+            return (self.pid, 0)
+
+        if pid == self.pid:
+            self.usage = rusage_to_usage(rusage)
+
+        return (pid, sts)
 
 
 class ShellRunner:
+    # IOLoop of the worker, set by the app at startup. Engines run in
+    # Thumbor's engine thread pool hand their commands over to it.
+    io_loop = None
+
+    # (limit, semaphore) tuple, created on first use
+    concurrency = None
+
     @classmethod
-    def wrap_command(cls, command, context):
+    def timeouts(cls, context):
+        """Returns the (timeout, kill_after) pair in seconds, or None if
+        commands shouldn't time out."""
         if not getattr(context.config, "SUBPROCESS_USE_TIMEOUT", False):
-            return command
+            return None
+
+        # Children receive a SIGTERM once the timeout is reached.
+        # SUBPROCESS_TIMEOUT_KILL_AFTER sends a SIGKILL if the command is
+        # still running that many seconds after the SIGTERM. 0 disables it.
+        return (
+            context.config.SUBPROCESS_TIMEOUT,
+            getattr(context.config, "SUBPROCESS_TIMEOUT_KILL_AFTER", 0)
+        )
+
+    @classmethod
+    def kill(cls, context, proc, sig):
+        cls.debug(context, "[ShellRunner] Sending signal %d to process group %d" % (sig, proc.pid))
+
+        # Children are started in their own process group, which lets us
+        # take down whatever they might have spawned themselves
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:  # pragma: no cover
+            pass
+
+    @classmethod
+    def communicate(cls, context, proc, upstream=()):
+        """Waits for proc, as well as the commands piped into it if any,
+        sending them a SIGTERM then a SIGKILL if they outlive the timeouts.
+        Returns (stdout, stderr, timed_out)."""
+        procs = list(upstream) + [proc]
+        timeouts = cls.timeouts(context)
+        limits = []
 
-        timeout = context.config.SUBPROCESS_TIMEOUT
-        timeout_path = context.config.SUBPROCESS_TIMEOUT_PATH
+        if timeouts is not None:
+            timeout, kill_after = timeouts
+            limits.append((timeout, signal.SIGTERM))
 
-        timeout_command = [
-                timeout_path,
-                "--foreground"
-        ]
-        # The timeout command sends a SIGTERM signal by default.
-        # --kill-after tells timeout to send a SIGKILL signal if the
-        # command is still running after the initial SIGTERM was sent.
-        # A value of 0 disables this.
-        kill_after = getattr(context.config, "SUBPROCESS_TIMEOUT_KILL_AFTER", 0)
-        if kill_after > 0:
-            timeout_command.extend(["--kill-after", f"{kill_after}s"])
+            if kill_after > 0:
+                limits.append((kill_after, signal.SIGKILL))
 
-        # Add the timeout, format is timeout $TIMEOUT_ARGS $TIMEOUT_TIME $ACTUAL_COMMAND $ACTUAL_ARGS
-        timeout_command.append(str(timeout))
-        command = timeout_command + command
+        output = None
+        timed_out = False
 
-        return command
+        for limit, sig in limits + [(None, None)]:
+            deadline = None if limit is None else time.monotonic() + limit
+
+            try:
+                if output is None:
+                    output = proc.communicate(timeout=limit)
+
+                for upstream_proc in upstream:
+                    upstream_proc.wait(
+                        timeout=None if deadline is None else max(0, deadline - time.monotonic())
+                    )
+
+                return output + (timed_out,)
+            except subprocess.TimeoutExpired:
+                for timed_out_proc in procs:
+                    cls.kill(context, timed_out_proc, sig)
+
+                timed_out = True
 
     @classmethod
     def preexec(cls, context):  # pragma: no cover
@@ -63,34 +165,347 @@ class ShellRunner:
             tasks.write("%s\n" % pid)
 
     @classmethod
-    def popen(cls, command, context, env=None):
-        wrapped_command = ShellRunner.wrap_command(command, context)
-
-        cls.debug(context, "[ShellRunner] Command: %r" % wrapped_command)
-
+    def environment(cls, env=None):
         combined_env = os.environ.copy()
 
         if env is not None:  # pragma: no cover
             combined_env.update(env)
 
-        proc = subprocess.Popen(
-            wrapped_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=combined_env,
-            preexec_fn=partial(cls.preexec, context),
+        return combined_env
+
+    @classmethod
+    def preexec_fn(cls, context):
+        # Without a preexec_fn, Popen can use vfork() or posix_spawn()
+        # instead of a full fork() of the worker
+        if not getattr(context.config, "SUBPROCESS_CGROUP_TASKS_PATH", False):
+            return None
+
+        return partial(cls.preexec, context)
+
+    @classmethod
+    def popen(cls, command, context, env=None, stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+        cls.debug(context, "[ShellRunner] Command: %r" % command)
+
+        if Spawner.running():
+            try:
+                return SpawnedPopen(
+                    command,
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=stderr,
+                    env=cls.environment(env),
+                )
+            except SpawnerUnavailable as e:  # pragma: no cover
+                logger.error("[ShellRunner] Spawner unavailable: %r" % e, extra=log_extra(context))
+
+        proc = AccountedPopen(
+            command,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            env=cls.environment(env),
+            preexec_fn=cls.preexec_fn(context),
+            start_new_session=True,
         )
 
         return proc
 
+    @classmethod
+    def semaphore(cls, context):
+        limit = getattr(context.config, "SUBPROCESS_MAX_CONCURRENCY", 0)
+
+        if not limit:
+            return None
+
+        if cls.concurrency is None or cls.concurrency[0] != limit:
+            cls.concurrency = (limit, Semaphore(limit))
+
+        return cls.concurrency[1]
+
+    @classmethod
+    def off_loop(cls):
+        """Whether we're running outside of the worker's IOLoop thread,
+        with that IOLoop available to run commands on our behalf."""
+        try:
+            asyncio.get_running_loop()
+            return False
+        except RuntimeError:
+            pass
+
+        return cls.io_loop is not None and cls.io_loop.asyncio_loop.is_running()
+
     @classmethod
     def command(cls, command, context, env=None):
+        # Engines are loaded outside of the IOLoop, see OffLoopFetchMixin,
+        # and Thumbor runs engine reads in its engine thread pool when
+        # ENGINE_THREADPOOL_SIZE is set. From there we can wait on the IOLoop
+        # running the command, which keeps the concurrency cap shared with
+        # command_async() callers.
+        if cls.off_loop():
+            future = asyncio.run_coroutine_threadsafe(
+                cls.command_async(command, context, env),
+                cls.io_loop.asyncio_loop
+            )
+            return future.result()
+
+        start = datetime.datetime.now()
+
+        try:
+            proc = cls.popen(command, context, env)
+        except OSError as e:
+            return cls.not_executed(command, context, start, e)
+
+        stdout, stderr, timed_out = cls.communicate(context, proc)
+
+        cls.report(command, context, start, proc.returncode, stderr, stdout, proc.usage)
+
+        if timed_out:
+            cls.timed_out(command, context, stderr, stdout)
+
+        return proc.returncode, stderr, stdout
+
+    @classmethod
+    async def acquire(cls, context):
+        """Takes a slot of the concurrency cap, returning the semaphore to
+        release, if any."""
+        semaphore = cls.semaphore(context)
+
+        if semaphore is not None:
+            await semaphore.acquire()
+
+        return semaphore
+
+    @classmethod
+    def pipeline(cls, commands, context, env=None, stdout=None):
+        """Runs commands with the stdout of each one piped into the stdin of
+        the next, like a shell would. Intermediate output only ever goes
+        through OS pipes. The output of the last command is returned, unless
+        a file is passed as stdout, in which case it's written there directly.
+
+        The return code is the one of the rightmost command that failed,
+        as with bash's pipefail."""
+        if not cls.off_loop():
+            return cls.run_pipeline(commands, context, env, stdout)
+
+        # The pipeline runs in this thread, under the same concurrency cap
+        # as the commands run on the IOLoop
+        semaphore = asyncio.run_coroutine_threadsafe(
+            cls.acquire(context),
+            cls.io_loop.asyncio_loop
+        ).result()
+
+        try:
+            return cls.run_pipeline(commands, context, env, stdout)
+        finally:
+            if semaphore is not None:
+                cls.io_loop.add_callback(semaphore.release)
+
+    @classmethod
+    def run_pipeline(cls, commands, context, env=None, stdout=None):
+        start = datetime.datetime.now()
+        procs = []
+        errors = []
+
+        try:
+            stdin = None
+
+            for index, command in enumerate(commands):
+                last = index == len(commands) - 1
+
+                # stderr goes to a file, reading several pipes at once
+                # would require polling them
+                errors.append(tempfile.TemporaryFile())
+
+                try:
+                    proc = cls.popen(
+                        command,
+                        context,
+                        env,
+                        stdin=stdin,
+                        stdout=stdout if last and stdout is not None else subprocess.PIPE,
+                        stderr=errors[-1]
+                    )
+                except OSError as e:
+                    for started in procs:
+                        cls.kill(context, started, signal.SIGKILL)
+                        started.wait()
+
+                    return cls.not_executed(command, context, start, e)
+                finally:
+                    # The next command holds the read end of the pipe now.
+                    # Closing ours lets the writer get a SIGPIPE if the reader
+                    # exits early.
+                    if stdin is not None:
+                        stdin.close()
+
+                stdin = proc.stdout
+                procs.append(proc)
+
+            output, _, timed_out = cls.communicate(context, procs[-1], procs[:-1])
+
+            stderrs = []
+            for error in errors:
+                error.seek(0)
+                stderrs.append(error.read())
+        finally:
+            for error in errors:
+                error.close()
+
+        returncode = 0
+        for proc in procs:
+            if proc.returncode != 0:
+                returncode = proc.returncode
+
+        if output is None:
+            output = b""
+
+        for proc, command, stderr in zip(procs, commands, stderrs):
+            cls.report(
+                command,
+                context,
+                start,
+                proc.returncode,
+                stderr,
+                output if proc is procs[-1] else b"",
+                proc.usage
+            )
+
+        stderr = b"".join(stderrs)
+
+        if timed_out:
+            cls.timed_out(commands[-1], context, stderr, output)
+
+        return returncode, stderr, output
+
+    @classmethod
+    async def command_async(cls, command, context, env=None):
+        semaphore = cls.semaphore(context)
+
+        if semaphore is None:
+            return await cls.run_async(command, context, env)
+
+        async with semaphore:
+            return await cls.run_async(command, context, env)
+
+    @classmethod
+    async def run_async(cls, command, context, env=None):
         start = datetime.datetime.now()
 
-        proc = cls.popen(command, context, env)
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+
+        try:
+            proc = cls.popen(command, context, env, stdout=stdout_w, stderr=stderr_w)
+        except OSError as e:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            return cls.not_executed(command, context, start, e)
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+        stdout_stream = PipeIOStream(stdout_r)
+        stderr_stream = PipeIOStream(stderr_r)
+
+        io_loop = IOLoop.current()
+        timeouts = cls.timeouts(context)
+        timers = []
+        signals = []
+
+        def escalate(sig, kill_after=0):
+            signals.append(sig)
+            cls.kill(context, proc, sig)
+
+            if kill_after > 0:
+                timers.append(io_loop.call_later(kill_after, escalate, signal.SIGKILL))
+
+        if timeouts is not None:
+            timeout, kill_after = timeouts
+            timers.append(io_loop.call_later(timeout, escalate, signal.SIGTERM, kill_after))
+
+        # Both pipes need to be drained before waiting, otherwise a child
+        # filling up one of them would never exit
+        stdout, stderr = await asyncio.gather(
+            stdout_stream.read_until_close(),
+            stderr_stream.read_until_close(),
+        )
+
+        # The child is normally exiting by the time its pipes are closed
+        await io_loop.run_in_executor(None, proc.wait)
+        returncode = proc.returncode
+
+        for timer in timers:
+            io_loop.remove_timeout(timer)
+
+        cls.report(command, context, start, returncode, stderr, stdout, proc.usage)
+
+        if signals:
+            cls.timed_out(command, context, stderr, stdout)
+
+        return returncode, stderr, stdout
 
-        stdout, stderr = proc.communicate()
+    @classmethod
+    def not_executed(cls, command, context, start, error):
+        # Report a command that couldn't be started the way a shell
+        # would, rather than letting the OSError escape
+        returncode = 127 if isinstance(error, FileNotFoundError) else 126
+        stderr = ("%s: %s\n" % (command[0], error.strerror)).encode()
+
+        cls.report(command, context, start, returncode, stderr, b"")
+
+        return returncode, stderr, b""
+
+    @classmethod
+    def timed_out(cls, command, context, stderr, stdout):
+        name = cls.command_name(command)
+
+        logger.error("[ShellRunner] Command timed out: %r" % command, extra=log_extra(context))
+
+        if context.metrics is not None:
+            context.metrics.incr("subprocess.%s.timeout" % name)
+
+        raise CommandTimeoutError(command, stdout, stderr)
+
+    @classmethod
+    def command_name(cls, command):
+        simple_command_name = os.path.basename(command[0])
+        return re.sub(r"[^a-zA-Z0-9-]", r"", simple_command_name)
+
+    @classmethod
+    def usage(cls, context):
+        """Resource usage of the children run for this request, per command."""
+        if not hasattr(context, "wikimedia_subprocess_usage"):
+            context.wikimedia_subprocess_usage = {}
+
+        return context.wikimedia_subprocess_usage
 
+    @classmethod
+    def total_usage(cls, context, field):
+        return sum(usage[field] for usage in cls.usage(context).values())
+
+    @classmethod
+    def record_usage(cls, context, name, usage):
+        cls.debug(context, "[ShellRunner] Usage: %r" % usage)
+
+        totals = cls.usage(context).setdefault(name, dict.fromkeys(usage, 0))
+
+        for field, value in usage.items():
+            if field == "maxrss":
+                totals[field] = max(totals[field], value)
+            else:
+                totals[field] += value
+
+        if context.metrics is not None:
+            for field, value in usage.items():
+                context.metrics.timing("subprocess.%s.%s" % (name, field), value)
+
+        if context.request_handler is not None:
+            context.request_handler.add_header("Thumbor-%s-Utime" % name, math.floor(usage["utime"] + 0.5))
+            context.request_handler.add_header("Thumbor-%s-Stime" % name, math.floor(usage["stime"] + 0.5))
+            context.request_handler.add_header("Thumbor-%s-Maxrss" % name, usage["maxrss"])
+
+    @classmethod
+    def report(cls, command, context, start, returncode, stderr, stdout, usage=None):
         duration = datetime.datetime.now() - start
         duration = duration.total_seconds() * 1000
 
@@ -105,11 +520,13 @@ class ShellRunner:
             cls.debug(context, "[ShellRunner] Stdout: %s" % stdout)
 
         cls.debug(context, "[ShellRunner] Stderr: %s" % stderr)
-        cls.debug(context, "[ShellRunner] Return code: %d" % proc.returncode)
+        cls.debug(context, "[ShellRunner] Return code: %d" % returncode)
         cls.debug(context, "[ShellRunner] Duration: %r" % duration)
 
-        simple_command_name = os.path.basename(command[0])
-        simple_command_name = re.sub(r"[^a-zA-Z0-9-]", r"", simple_command_name)
+        simple_command_name = cls.command_name(command)
+
+        if usage is not None:
+            cls.record_usage(context, simple_command_name, usage)
 
         if context.request_handler is not None:
             context.request_handler.add_header(
@@ -120,8 +537,6 @@ class ShellRunner:
                 math.floor(duration + 0.5),
             )
 
-        return proc.returncode, stderr, stdout
-
     @classmethod
     def rm_f(cls, path):
         """Remove a file if it exists."""
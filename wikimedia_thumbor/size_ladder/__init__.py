@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Several widths of the same original, rendered from a single decode
+#
+# MediaWiki asks for the same original at a handful of standard widths,
+# each as a separate request which downloads, probes and decodes the
+# original again. A request made through the ladder handler sets the
+# widths it wants on the context, the engine renders them alongside the
+# requested thumbnail and the Swift result storage stores them next to it.
+#
+# Only width-only requests without crops get a ladder, and only widths
+# smaller than the original, since thumbnails are never upscaled.
+
+import re
+
+from thumbor.utils import logger
+
+from wikimedia_thumbor.logging import log_extra
+
+
+class SizeLadder:
+    @classmethod
+    def parse(cls, widths):
+        """Parses a comma separated list of widths."""
+        try:
+            return sorted(set(int(width) for width in widths.split(',') if width.strip()))
+        except ValueError:
+            return []
+
+    @classmethod
+    def widths(cls, context, source_width):
+        """The extra widths to render for the current request."""
+        widths = getattr(context, 'wikimedia_size_ladder', None)
+
+        if not widths or context.request.height != 0:
+            return []
+
+        allowed = getattr(context.config, 'SIZE_LADDER_WIDTHS', [])
+        maximum = getattr(context.config, 'SIZE_LADDER_MAX_WIDTHS', 6)
+
+        widths = [
+            width for width in widths
+            if width in allowed and width != context.request.width and width < source_width
+        ]
+
+        logger.debug('[SizeLadder] Widths: %r' % widths, extra=log_extra(context))
+
+        return widths[-maximum:]
+
+    @classmethod
+    def save_path(cls, save_path, width):
+        """Swift path of the given width, next to the requested thumbnail."""
+        return re.sub(r'(^|/|-)\d+px-(?=[^/]*$)', r'\g<1>%dpx-' % width, save_path, count=1)
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# What engines need to know about the original to decide whether to run
+#
+# The facts are found once per request and kept on the context, where
+# every engine's should_run reads them instead of probing the original
+# on its own. The MIME type and the headers come from the loader excerpt,
+# or from the whole original when the excerpt isn't enough. Only if both
+# fail are the dimensions read with exiftool, and only when asked for.
+
+import json
+
+from thumbor.engines import BaseEngine
+from thumbor.utils import logger
+
+from wikimedia_thumbor.exiftool_runner import ExiftoolRunner
+from wikimedia_thumbor.header_sniffer import HeaderSniffer
+from wikimedia_thumbor.logging import log_extra
+
+
+class SourceFacts:
+    exiftool = ExiftoolRunner()
+
+    def __init__(self, context, buffer):
+        self.context = context
+        self.buffer = buffer
+        self.mime = BaseEngine.get_mimetype(buffer)
+
+        self.header = HeaderSniffer.sniff(buffer)
+
+        if self.header is None and self.original is not None:
+            self.header = HeaderSniffer.sniff_file(self.original.name)
+
+        self.size = None if self.header is None else (self.header.width, self.header.height)
+
+        self.debug('[SourceFacts] %s %r' % (self.mime, self.header))
+
+    @classmethod
+    def of(cls, context, buffer):
+        """Facts about the original whose excerpt is buffer, found on the
+        first call for that buffer."""
+        facts = getattr(context, 'wikimedia_source_facts', None)
+
+        if facts is None or facts.buffer is not buffer:
+            facts = context.wikimedia_source_facts = cls(context, buffer)
+
+        return facts
+
+    @property
+    def original(self):
+        return getattr(self.context, 'wikimedia_original_file', None)
+
+    @property
+    def format(self):
+        return None if self.header is None else self.header.format
+
+    @property
+    def pages(self):
+        """None when unknown."""
+        return None if self.header is None else self.header.pages
+
+    @property
+    def levels(self):
+        """Resolutions of each page, see HeaderInfo.levels."""
+        return None if self.header is None else self.header.levels
+
+    @property
+    def animated(self):
+        """Whether the original has several frames, None when unknown."""
+        if self.format == 'GIF':
+            # Animation tools write the looping extension before the first
+            # frame. Without it, there could still be frames past the buffer
+            if self.buffer.find(b'NETSCAPE2.0') != -1 or self.buffer.count(b'\x21\xf9\x04') > 1:
+                return True
+
+            return None
+
+        if self.format == 'WEBP':
+            return self.buffer[12:16] == b'VP8X' and bool(self.buffer[20] & 0x02)
+
+        if self.format == 'PNG':
+            # APNG animation control chunk, which comes before the image data
+            if self.buffer.find(b'acTL') != -1:
+                return True
+
+            return False if self.buffer.find(b'IDAT') != -1 else None
+
+        if self.format is not None:
+            return False
+
+        return None
+
+    def dimensions(self):
+        """(width, height) of the original, read with exiftool if the
+        headers couldn't be sniffed."""
+        if self.size is not None:
+            return self.size
+
+        command = [
+            '-ImageSize',
+            '-j'
+        ]
+
+        if self.original is not None:
+            stdout = SourceFacts.exiftool.command(
+                pre=command,
+                context=self.context,
+                input_temp_file=self.original
+            )
+        else:
+            stdout = SourceFacts.exiftool.command(
+                pre=command,
+                context=self.context,
+                buffer=self.buffer
+            )
+
+        if self.context.metrics is not None:
+            self.context.metrics.incr('source_facts.exiftool')
+
+        # index with 0 because we're reading a single file
+        exif_dict = json.loads(stdout.decode('utf-8'))[0]
+        size = exif_dict['ImageSize'].split('x')
+
+        self.size = (int(size[0]), int(size[1]))
+
+        return self.size
+
+    def debug(self, message):
+        logger.debug(message, extra=log_extra(self.context))
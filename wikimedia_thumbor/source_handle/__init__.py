@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Handle on the original, passed from the loaders to the engines
+#
+# Loaders used to read the whole original into memory and write a copy of
+# it to a temporary file, which some engines read back into memory. The
+# handle gets the original to the engines without copying it through Python:
+# - the file loader hardlinks the original, or reflinks it on filesystems
+#   that support it, and lets the kernel copy it otherwise
+# - network loaders write the body to an anonymous file: a memfd, or an
+#   O_TMPFILE in the temporary arena if SOURCE_HANDLE_USE_MEMFD is off
+# - command line tools open it by name. Anonymous files are named through
+#   /proc/<pid>/fd of the worker, which children started by the spawner
+#   can open too, unlike /proc/self/fd
+# - in-process consumers map it in memory with mmap()
+#
+# Handles expose the name attribute of the temporary files they replace.
+
+import fcntl
+import mmap
+import os
+import shutil
+import tempfile
+
+from thumbor.utils import logger
+
+from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.shell_runner import ShellRunner
+from wikimedia_thumbor.temp_arena import TempArena
+
+
+# linux/fs.h
+FICLONE = 0x40049409
+
+
+class SourceHandle:
+    def __init__(self, fd=None, path=None, directory=None):
+        self.fd = fd
+        self.path = path
+        # Created for this handle alone, removed along with it
+        self.directory = directory
+
+    @classmethod
+    def link(cls, context, path):
+        """Handle on a copy of the file at path, which stays valid if the
+        file is replaced or removed."""
+        directory = TempArena.mkdtemp(context)
+        target = os.path.join(directory, 'source_file')
+
+        try:
+            os.link(path, target)
+            cls.debug(context, '[SourceHandle] Hardlinked %s' % path)
+            method = 'hardlink'
+        except OSError:
+            method = cls.clone(path, target)
+            cls.debug(context, '[SourceHandle] %s %s' % (method, path))
+
+            # Shares its blocks with the original, like a hardlink
+            if method == 'reflink':
+                TempArena.share(context, target)
+
+        cls.incr(context, 'source_handle.%s' % method)
+
+        return cls(path=target, directory=directory)
+
+    @classmethod
+    def clone(cls, path, target):
+        """Reflinks path to target if the filesystem allows it, copies it
+        otherwise. Returns the method used."""
+        with open(path, 'rb') as source, open(target, 'wb') as clone:
+            try:
+                fcntl.ioctl(clone.fileno(), FICLONE, source.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+
+        # Copied by the kernel, with sendfile
+        shutil.copyfile(path, target)
+
+        return 'copy'
+
+    @classmethod
+    def anonymous(cls, context):
+        """Empty handle to write a body into."""
+        if getattr(context.config, 'SOURCE_HANDLE_USE_MEMFD', True) and hasattr(os, 'memfd_create'):
+            try:
+                fd = os.memfd_create('source_file', os.MFD_CLOEXEC)
+                cls.incr(context, 'source_handle.memfd')
+                return cls(fd=fd)
+            except OSError as e:  # pragma: no cover
+                cls.debug(context, '[SourceHandle] memfd_create failed: %r' % e)
+
+        if hasattr(os, 'O_TMPFILE'):
+            try:
+                directory = TempArena.dir(context) or tempfile.gettempdir()
+                fd = os.open(directory, os.O_TMPFILE | os.O_RDWR | os.O_CLOEXEC, 0o600)
+                cls.incr(context, 'source_handle.tmpfile')
+                return cls(fd=fd)
+            except OSError as e:  # pragma: no cover
+                # Not every filesystem supports O_TMPFILE
+                cls.debug(context, '[SourceHandle] O_TMPFILE failed: %r' % e)
+
+        fd, path = tempfile.mkstemp(dir=TempArena.dir(context))  # pragma: no cover
+        cls.incr(context, 'source_handle.tempfile')  # pragma: no cover
+        return cls(fd=fd, path=path)  # pragma: no cover
+
+    @classmethod
+    def from_bytes(cls, context, body):
+        handle = cls.anonymous(context)
+
+        try:
+            handle.write(body)
+        except OSError:
+            handle.close()
+            raise
+
+        return handle
+
+    @property
+    def name(self):
+        if self.path is not None:
+            return self.path
+
+        return '/proc/%d/fd/%d' % (os.getpid(), self.fd)
+
+    @property
+    def size(self):
+        if self.fd is not None:
+            return os.fstat(self.fd).st_size
+
+        return os.stat(self.path).st_size
+
+    def write(self, data):
+        view = memoryview(data)
+
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def read(self, length, offset=0):
+        if self.fd is not None:
+            return os.pread(self.fd, length, offset)
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def mmap(self):
+        """Read-only mapping of the whole file, which remains valid after
+        the handle is closed."""
+        if self.fd is not None:
+            return mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+        with open(self.path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        """Releases the file. Safe to call several times."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+        if self.path is not None:
+            ShellRunner.rm_f(self.path)
+            self.path = None
+
+        if self.directory is not None:
+            shutil.rmtree(self.directory, True)
+            self.directory = None
+
+    @property
+    def closed(self):
+        return self.fd is None and self.path is None
+
+    @classmethod
+    def discard(cls, source):
+        """Removes a source, be it a handle or a temporary file."""
+        if isinstance(source, cls):
+            source.close()
+        else:
+            ShellRunner.rm_f(source.name)
+
+    @classmethod
+    def incr(cls, context, metric):
+        if context.metrics is not None:
+            context.metrics.incr(metric)
+
+    @classmethod
+    def debug(cls, context, message):
+        logger.debug(message, extra=log_extra(context))
+
+    def __repr__(self):
+        return 'SourceHandle(%r)' % (self.name if not self.closed else None)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Metadata of a source image, read in a single exiftool pass
+#
+# This gets everything the engines need to know about the original
+# upfront: dimensions, EXIF orientation, colour type, transparency, the
+# ICC profile along with its description, the EXIF fields we keep
+# on thumbnails and the number of pages.
+#
+# Knowing the number of pages lets engines fall back to the first page
+# of documents before rendering, rather than after a failed render.
+
+import base64
+import json
+
+from wikimedia_thumbor.exiftool_runner import ExiftoolRunner
+from wikimedia_thumbor.header_sniffer import HeaderSniffer
+
+
+class SourceMetadata:
+    fields = [
+        'ImageSize',
+        'ProfileDescription',
+        'ColorType',
+        'WebP_Flags',
+        'FileType',
+        'Transparency',
+        'ICC_Profile',
+        'PageCount',
+    ]
+
+    # Formats with a single page, that exiftool doesn't count the pages of
+    single_page_types = ['JPEG', 'PNG', 'WEBP', 'XCF', 'SVG']
+
+    def __init__(self, exif, fields_to_keep=()):
+        if 'ImageSize' in exif:
+            self.size = tuple(int(x) for x in exif['ImageSize'].split('x'))
+        else:
+            # Have not been able to find a test file where that EXIF field comes up unpopulated
+            self.size = None  # pragma: no cover
+
+        # T172556 Only the Orientation found in IFD0, exiftool is otherwise
+        # overzealous in the way it interprets the field
+        self.orientation = exif.get('Orientation')
+
+        self.file_type = exif.get('FileType')
+        self.color_type = exif.get('ColorType')
+        self.webp_flags = exif.get('WebP_Flags')
+        self.transparency = 'Transparency' in exif
+        self.profile_description = exif.get('ProfileDescription')
+        self.icc_profile = self.binary(exif.get('ICC_Profile'))
+
+        # PDF and DjVu, TIFF pages are counted by probe(). None when unknown.
+        self.pages = exif.get('PageCount')
+
+        if self.pages is None and self.file_type in self.single_page_types:
+            self.pages = 1
+
+        self.kept_fields = {
+            field: exif[field] for field in fields_to_keep if field in exif
+        }
+
+    @classmethod
+    def binary(cls, value):
+        # exiftool's JSON output encodes binary values in base64
+        if not isinstance(value, str) or not value.startswith('base64:'):
+            return None
+
+        return base64.b64decode(value[len('base64:'):])
+
+    @classmethod
+    def probe(cls, context, input_temp_file):
+        fields_to_keep = context.config.EXIF_FIELDS_TO_KEEP
+
+        command = ['-j', '-b']
+        command += ['-{0}'.format(i) for i in cls.fields + list(fields_to_keep)]
+        # Numerical value, from EXIF only
+        command += ['-IFD0:Orientation#']
+
+        stdout = ExiftoolRunner.command(
+            context=context,
+            pre=command,
+            input_temp_file=input_temp_file
+        )
+
+        # index at 0 because we're processing a single file
+        metadata = cls(json.loads(stdout.decode('utf-8'))[0], fields_to_keep)
+
+        if metadata.pages is None:
+            metadata.pages = cls.tiff_pages(input_temp_file.name)
+
+        return metadata
+
+    @classmethod
+    def tiff_pages(cls, path):
+        header = HeaderSniffer.sniff_file(path)
+
+        if header is None or header.format != 'TIFF':
+            return None
+
+        return header.pages
+
+    @classmethod
+    def page_count(cls, context, path):
+        """Number of pages of the file at path, None if unknown. Cheaper
+        than probe() for engines that render documents before probing."""
+        pages = cls.tiff_pages(path)
+
+        if pages is not None:
+            return pages
+
+        with open(path, 'rb') as input_file:
+            stdout = ExiftoolRunner.command(
+                context=context,
+                pre=['-j', '-PageCount'],
+                input_temp_file=input_file
+            )
+
+        return json.loads(stdout.decode('utf-8'))[0].get('PageCount')
+
+    def page(self, page):
+        """The page to render, given the 0-based requested one: the first
+        page if the document doesn't have that many."""
+        if self.pages is not None and page >= self.pages:
+            return 0
+
+        return page
+
+    @property
+    def rotated(self):
+        """Whether the orientation swaps width and height."""
+        return self.orientation in (6, 8)
+
+    @property
+    def ratio(self):
+        """Width to height ratio, once oriented."""
+        width, height = self.size
+
+        if self.rotated:
+            return height / width
+
+        return width / height
+
+    @property
+    def has_alpha(self):
+        return (
+            (self.webp_flags is not None and 'Alpha' in self.webp_flags)
+            or self.color_type in ['RGB with Alpha', 'Grayscale with Alpha', 'Palette']
+            or self.transparency
+        )
+
+    def __repr__(self):
+        return '<SourceMetadata size=%r orientation=%r file_type=%r profile=%r icc=%s kept=%r pages=%r>' % (
+            self.size,
+            self.orientation,
+            self.file_type,
+            self.profile_description,
+            'none' if self.icc_profile is None else '%d bytes' % len(self.icc_profile),
+            self.kept_fields,
+            self.pages
+        )
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Spawns commands through a small helper process
+#
+# Forking the worker means copying the page tables of a process holding
+# Thumbor, its engines and their caches, which gets slower as the worker
+# grows. With SUBPROCESS_SPAWNER, each worker starts a helper process (see
+# helper.py) once it's forked, which spawns commands on the worker's behalf,
+# passed over a Unix socket along with their stdin, stdout and stderr.
+# Workers don't share helpers, which would serialize their spawns and have
+# them all fall back to forking if it went away.
+#
+# The helper is also the one placed in SUBPROCESS_CGROUP_TASKS_PATH, which
+# its children inherit. Without a preexec_fn, commands the worker still
+# runs itself don't require a full fork either.
+
+import json
+import os
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+from thumbor.utils import logger
+
+
+class SpawnerUnavailable(Exception):
+    pass
+
+
+class SpawnedPopen(subprocess.Popen):
+    """Popen whose child is spawned and reaped by the spawner helper."""
+    usage = None
+
+    def _execute_child(self, args, executable, preexec_fn, close_fds,
+                       pass_fds, cwd, env, startupinfo, creationflags, shell,
+                       p2cread, p2cwrite, c2pread, c2pwrite, errread,
+                       errwrite, *unused):
+        # Streams that aren't redirected are inherited from the worker
+        stdio = [
+            fd if fd != -1 else default
+            for fd, default in ((p2cread, 0), (c2pwrite, 1), (errwrite, 2))
+        ]
+
+        request = {
+            'args': [os.fsdecode(arg) for arg in args],
+            'env': dict(os.environ if env is None else env),
+        }
+
+        self.spawner = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+        try:
+            try:
+                self.spawner.connect(Spawner.socket_path)
+            except OSError as e:
+                self.spawner.close()
+                raise SpawnerUnavailable(e)
+
+            socket.send_fds(self.spawner, [json.dumps(request).encode()], stdio)
+            reply = self.receive()
+        finally:
+            # Same as Popen, the child has its own copies of these now
+            if p2cread != -1 and p2cwrite != -1 and p2cread != getattr(self, '_devnull', None):
+                os.close(p2cread)
+            if c2pwrite != -1 and c2pread != -1 and c2pwrite != getattr(self, '_devnull', None):
+                os.close(c2pwrite)
+            if errwrite != -1 and errread != -1 and errwrite != getattr(self, '_devnull', None):
+                os.close(errwrite)
+            if hasattr(self, '_devnull'):
+                os.close(self._devnull)
+            self._closed_child_pipe_fds = True
+
+        if 'pid' not in reply:
+            self.spawner.close()
+            raise OSError(reply['errno'], reply['strerror'], args[0])
+
+        self.pid = reply['pid']
+        self._child_created = True
+
+    def receive(self):
+        data = self.spawner.recv(4096)
+
+        if not data:
+            raise ConnectionResetError('Spawner helper went away')
+
+        return json.loads(data)
+
+    # Overrides the hook through which Popen waits on its child, which
+    # isn't ours to wait on
+    def _try_wait(self, wait_flags):
+        if wait_flags & os.WNOHANG:
+            poll = select.poll()
+            poll.register(self.spawner, select.POLLIN)
+
+            if not poll.poll(0):
+                return (0, 0)
+
+        try:
+            reply = self.receive()
+        except ConnectionResetError:
+            logger.error('[Spawner] Helper went away while pid %d was running' % self.pid)
+            # Reported as if the command had been killed
+            return (self.pid, 9)
+        finally:
+            self.spawner.close()
+
+        rusage = reply['rusage']
+        self.usage = {
+            "utime": rusage['utime'] * 1000,
+            "stime": rusage['stime'] * 1000,
+            "maxrss": rusage['maxrss'],
+            "inblock": rusage['inblock'],
+            "oublock": rusage['oublock'],
+        }
+
+        return (self.pid, reply['status'])
+
+    # poll() would call waitpid() directly otherwise
+    def _internal_poll(self, *args, **kwargs):
+        if self.returncode is None and self.spawner.fileno() != -1:
+            pid, status = self._try_wait(os.WNOHANG)
+
+            if pid == self.pid:
+                self._handle_exitstatus(status)
+
+        return self.returncode
+
+
+class Spawner:
+    process = None
+    socket_path = None
+    # The worker the helper belongs to
+    pid = None
+
+    @classmethod
+    def start(cls, cgroup_tasks_path=None):
+        directory = tempfile.mkdtemp(prefix='thumbor-spawner-')
+        cls.socket_path = os.path.join(directory, 'socket')
+
+        command = [
+            sys.executable,
+            # No site-packages, the helper only needs the standard library
+            '-I',
+            '-S',
+            os.path.join(os.path.dirname(__file__), 'helper.py'),
+            cls.socket_path,
+        ]
+
+        if cgroup_tasks_path:
+            command.append(cgroup_tasks_path)
+
+        logger.debug('[Spawner] Starting helper: %r' % command)
+
+        # The helper exits once its stdin is closed, which happens when
+        # we stop it or when the worker goes away
+        cls.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            start_new_session=True,
+        )
+        cls.pid = os.getpid()
+
+        if cls.process.stdout.readline() != b'ready\n':
+            logger.error('[Spawner] Helper failed to start')
+            cls.stop()
+
+    @classmethod
+    def running(cls):
+        """Whether the current process has a helper to spawn through."""
+        return cls.process is not None and cls.pid == os.getpid() and cls.process.poll() is None
+
+    @classmethod
+    def stop(cls):
+        # Processes forked after the helper was started don't own it
+        if cls.process is None or cls.pid != os.getpid():
+            return
+
+        cls.process.stdin.close()
+        cls.process.stdout.close()
+        cls.process.wait()
+        cls.process = None
+        cls.pid = None
+
+        shutil.rmtree(os.path.dirname(cls.socket_path), True)
+        cls.socket_path = None
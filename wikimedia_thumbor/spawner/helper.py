@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Spawner helper process
+#
+# Started once by the Thumbor worker, this spawns commands on its behalf.
+# It is run as a standalone script that only imports the standard library,
+# which keeps it small enough for forking it to be cheap.
+#
+# Usage: helper.py <socket path> [<cgroup tasks path>]
+#
+# Every connection to the socket spawns a single command. The client sends
+# a JSON request with the command's stdin, stdout and stderr attached, and
+# gets back the pid of the child, then its wait status and resource usage
+# once it exits.
+#
+# The helper exits when its stdin, a pipe held by the worker, is closed.
+
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def send(conn, message):
+    conn.send(json.dumps(message).encode())
+
+
+def spawn(request, fds):
+    args = request['args']
+
+    # dup2() onto the standard streams, which clears FD_CLOEXEC
+    file_actions = [
+        (os.POSIX_SPAWN_DUP2, fd, target)
+        for target, fd in enumerate(fds)
+    ]
+
+    # Children get their own session, which lets the worker kill whatever
+    # they spawn themselves with killpg(). Python ignores SIGPIPE and
+    # SIGXFSZ, children shouldn't.
+    return os.posix_spawnp(
+        args[0],
+        args,
+        request['env'],
+        file_actions=file_actions,
+        setsid=True,
+        setsigdef=(signal.SIGPIPE, signal.SIGXFSZ)
+    )
+
+
+def serve(conn):
+    with conn:
+        data, fds, flags, address = socket.recv_fds(
+            conn,
+            MAX_MESSAGE_SIZE,
+            3,
+            socket.MSG_CMSG_CLOEXEC
+        )
+
+        try:
+            if len(fds) != 3:
+                send(conn, {'errno': 0, 'strerror': 'Expected 3 file descriptors, got %d' % len(fds)})
+                return
+
+            pid = spawn(json.loads(data), fds)
+        except OSError as e:
+            send(conn, {'errno': e.errno, 'strerror': e.strerror})
+            return
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        send(conn, {'pid': pid})
+
+        pid, status, rusage = os.wait4(pid, 0)
+
+        send(conn, {
+            'status': status,
+            'rusage': {
+                'utime': rusage.ru_utime,
+                'stime': rusage.ru_stime,
+                'maxrss': rusage.ru_maxrss,
+                'inblock': rusage.ru_inblock,
+                'oublock': rusage.ru_oublock,
+            }
+        })
+
+
+def watch_parent(socket_path):
+    while os.read(0, 1024):
+        pass
+
+    os.unlink(socket_path)
+    os._exit(0)
+
+
+def main(socket_path, cgroup_tasks_path=None):
+    # Done before starting any thread, which makes children inherit it
+    if cgroup_tasks_path:
+        with open(cgroup_tasks_path, 'a+') as tasks:
+            tasks.write('%s\n' % os.getpid())
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    server.bind(socket_path)
+    server.listen(128)
+
+    threading.Thread(target=watch_parent, args=(socket_path,), daemon=True).start()
+
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+
+    # The worker only reads the line above from stdout
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+    while True:
+        conn, address = server.accept()
+        threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
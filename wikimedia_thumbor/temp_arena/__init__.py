@@ -0,0 +1,311 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2011 globo.com timehome@corp.globo.com
+# Copyright (c) 2015 Wikimedia Foundation
+
+# Per-request directory for temporary files
+#
+# The images handler creates an arena for every request it renders, and
+# removes it with everything left in it once the request is finished.
+# Loaders, engines and runners allocate their temporary files from the
+# arena of the context, or from the system temporary directory when there
+# is none, for instance for requests that didn't go through the handler.
+#
+# Arenas live under TEMP_ARENA_PATH, named after the pid of the worker
+# owning them. TEMP_ARENA_MAX_SIZE caps the bytes a request may have on
+# disk: allocating more once it's reached raises TempArenaQuotaExceeded.
+# Files sharing their blocks with a file outside of the arena, like the
+# hardlinks and reflinks of originals, don't count towards it.
+# The peak usage seen at allocation and teardown is reported as a metric.
+#
+# Directories some engines need on another filesystem, like the vips
+# engine's VIPS_ENGINE_TEMPORARY_PATH, are named like arenas and released
+# along with the arena of the request.
+#
+# Workers that crash leave their arenas behind. Every worker sweeps them
+# once it's forked and every TEMP_ARENA_SWEEP_INTERVAL seconds: arenas of dead
+# workers are removed, as well as arenas older than TEMP_ARENA_MAX_AGE
+# seconds, which belong to requests that got stuck. The same goes for the
+# directories created on VIPS_ENGINE_TEMPORARY_PATH.
+
+import os
+import shutil
+import tempfile
+import time
+from tempfile import NamedTemporaryFile
+
+import tornado.ioloop
+from thumbor.utils import logger
+
+from wikimedia_thumbor.logging import log_extra
+from wikimedia_thumbor.shell_runner import ShellRunner
+
+
+class TempArenaQuotaExceeded(Exception):
+    pass
+
+
+class TempArena:
+    prefix = 'arena-'
+
+    # Arenas of the current worker, which the sweeper leaves alone
+    live = set()
+
+    def __init__(self, context):
+        self.context = context
+        self.quota = getattr(context.config, 'TEMP_ARENA_MAX_SIZE', None)
+        self.peak = 0
+        self.callbacks = []
+        # Files that don't use disk space of their own
+        self.shared = set()
+
+        root = self.root(context.config)
+        os.makedirs(root, exist_ok=True)
+
+        self.directory = tempfile.mkdtemp(prefix='%s%d-' % (self.prefix, os.getpid()), dir=root)
+        TempArena.live.add(self.directory)
+
+        self.debug('[TempArena] Created %s' % self.directory)
+
+    @classmethod
+    def root(cls, config):
+        return getattr(config, 'TEMP_ARENA_PATH', None) or os.path.join(tempfile.gettempdir(), 'thumbor-arenas')
+
+    @classmethod
+    def of(cls, context):
+        """Arena of the context, None if it has none."""
+        arena = getattr(context, 'wikimedia_temp_arena', None)
+
+        if arena is None or arena.directory is None:
+            return None
+
+        return arena
+
+    @classmethod
+    def dir(cls, context):
+        """Directory to create temporary files for the context in, None
+        for the system default. Checks the quota first."""
+        arena = cls.of(context)
+
+        if arena is None:
+            return None
+
+        arena.check()
+
+        return arena.directory
+
+    @classmethod
+    def named_temporary_file(cls, context, **kwargs):
+        return NamedTemporaryFile(dir=cls.dir(context), **kwargs)
+
+    @classmethod
+    def mkdtemp(cls, context, **kwargs):
+        return tempfile.mkdtemp(dir=cls.dir(context), **kwargs)
+
+    @classmethod
+    def mkdtemp_in(cls, context, path):
+        """Temporary directory in path, outside of the arena. It's removed
+        along with the arena, and swept like arenas if the worker crashes
+        first."""
+        directory = tempfile.mkdtemp(prefix='%s%d-' % (cls.prefix, os.getpid()), dir=path)
+        TempArena.live.add(directory)
+
+        def remove():
+            shutil.rmtree(directory, True)
+            TempArena.live.discard(directory)
+
+        cls.release_later(context, remove)
+
+        return directory
+
+    @classmethod
+    def release_later(cls, context, callback):
+        """Calls callback when the arena of the context is torn down, or
+        after HTTP_LOADER_TEMP_FILE_TIMEOUT without an arena."""
+        arena = cls.of(context)
+
+        if arena is not None:
+            arena.callbacks.append(callback)
+            return
+
+        # Engines are loaded outside of the IOLoop, where IOLoop.current()
+        # would be a loop of their own that never runs. add_callback is the
+        # only IOLoop method that can be called from another thread.
+        if ShellRunner.off_loop():
+            io_loop = ShellRunner.io_loop
+        else:
+            io_loop = tornado.ioloop.IOLoop.current()
+
+        io_loop.add_callback(
+            io_loop.call_later,
+            context.config.HTTP_LOADER_TEMP_FILE_TIMEOUT,
+            callback
+        )
+
+    @classmethod
+    def share(cls, context, path):
+        """Leaves path, a reflink of a file outside of the arena, out of
+        the quota. Hardlinks are left out without it."""
+        arena = cls.of(context)
+
+        if arena is not None:
+            arena.shared.add(path)
+
+    def used(self):
+        """Bytes on disk in the arena, for files of its own."""
+        used = 0
+
+        for directory, subdirectories, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(directory, name)
+
+                if path in self.shared:
+                    continue
+
+                try:
+                    stat = os.lstat(path)
+                except OSError:  # pragma: no cover
+                    continue
+
+                # Counted once the other links are gone
+                if stat.st_nlink == 1:
+                    used += stat.st_blocks * 512
+
+        self.peak = max(self.peak, used)
+
+        return used
+
+    def check(self):
+        if self.quota is None:
+            return
+
+        used = self.used()
+
+        if used >= self.quota:
+            self.incr('temp_arena.quota_exceeded')
+            raise TempArenaQuotaExceeded(
+                'Temporary files use %d bytes, over the %d bytes quota' % (used, self.quota)
+            )
+
+    def close(self):
+        """Releases everything allocated from the arena. Safe to call
+        several times."""
+        if self.directory is None:
+            return
+
+        for callback in self.callbacks:
+            try:
+                callback()
+            except Exception as e:  # pragma: no cover
+                logger.error('[TempArena] Release failed: %r' % e, extra=log_extra(self.context))
+
+        self.callbacks = []
+
+        self.used()
+
+        if self.context.metrics is not None:
+            self.context.metrics.timing('temp_arena.peak_bytes', self.peak)
+
+        self.debug('[TempArena] Removing %s, peak usage %d bytes' % (self.directory, self.peak))
+
+        shutil.rmtree(self.directory, True)
+        TempArena.live.discard(self.directory)
+        self.directory = None
+
+    @classmethod
+    def roots(cls, config):
+        """Directories holding arenas, or directories named like them."""
+        roots = [cls.root(config)]
+        vips_path = getattr(config, 'VIPS_ENGINE_TEMPORARY_PATH', None)
+
+        if vips_path and vips_path not in roots:
+            roots.append(vips_path)
+
+        return roots
+
+    @classmethod
+    def sweep(cls, config, now=None):
+        """Removes the arenas left by dead workers or stuck requests.
+        Returns the paths removed."""
+        max_age = getattr(config, 'TEMP_ARENA_MAX_AGE', 3600)
+        now = time.time() if now is None else now
+        removed = []
+
+        for root in cls.roots(config):
+            removed += cls.sweep_root(root, max_age, now)
+
+        if removed:
+            logger.warning('[TempArena] Swept %d orphaned arenas' % len(removed))
+
+        return removed
+
+    @classmethod
+    def sweep_root(cls, root, max_age, now):
+        removed = []
+
+        try:
+            names = os.listdir(root)
+        except FileNotFoundError:
+            return removed
+
+        for name in names:
+            path = os.path.join(root, name)
+
+            if not name.startswith(cls.prefix) or path in cls.live:
+                continue
+
+            try:
+                pid = int(name[len(cls.prefix):].split('-')[0])
+                age = now - os.lstat(path).st_mtime
+            except (ValueError, OSError):
+                continue
+
+            if cls.running(pid) and pid != os.getpid() and age < max_age:
+                continue
+
+            # Arenas of this worker that aren't live were never torn down
+            shutil.rmtree(path, True)
+            removed.append(path)
+
+        return removed
+
+    @classmethod
+    def start_sweeper(cls, config):
+        cls.sweep(config)
+
+        interval = getattr(config, 'TEMP_ARENA_SWEEP_INTERVAL', 600)
+
+        if interval:
+            sweeper = tornado.ioloop.PeriodicCallback(lambda: cls.sweep(config), interval * 1000)
+            sweeper.start()
+
+            return sweeper
+
+    @classmethod
+    def running(cls, pid):
+        # 0 and negative pids would signal process groups
+        if pid <= 0:
+            return False
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:  # pragma: no cover
+            # Running, as another user
+            return True
+
+        return True
+
+    def incr(self, metric):
+        if self.context.metrics is not None:
+            self.context.metrics.incr(metric)
+
+    def debug(self, message):
+        logger.debug(message, extra=log_extra(self.context))